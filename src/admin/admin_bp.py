@@ -1,20 +1,70 @@
 """Mòdul d'administració amb els endpoints per a la gestió d'usuaris, pacients, doctors i centres."""
 
+import os
+import tracemalloc
+
 from flask import Blueprint, request, jsonify
 from database import SessionLocal, get_db
-from models import Patient, Doctor, Center, StatusEnum, User, RoleEnum
+from models import Patient, Doctor, Center, StatusEnum, User, RoleEnum, ChangeOpEnum
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from werkzeug.security import generate_password_hash
 from decorators import require_auth_role
+from querybudget import query_budget
+from cache import CACHES, center_cache, doctor_cache, patient_cache
+from versioning import conditional_get
+from idempotency import idempotent
+from search import build_match_query, parse_limit, search_statement
+from serializers import serialize_center, serialize_doctor, serialize_patient
+from diagnostics import (
+    diff_baseline,
+    memory_report,
+    parse_top_limit,
+    start_tracing,
+    stop_tracing,
+    take_baseline,
+)
+from changes import (
+    fetch_changes,
+    parse_limit as parse_changes_limit,
+    parse_since,
+    record_change,
+    serialize_change,
+)
 
 admin_bp = Blueprint("admin", __name__)
 
+# Segons que els clients poden reutilitzar els llistats sense revalidar-los
+CENTRES_MAX_AGE = int(os.getenv("CENTRES_MAX_AGE", "300"))
+DOCTORS_MAX_AGE = int(os.getenv("DOCTORS_MAX_AGE", "60"))
+
+# Nombre màxim d'identificadors que es poden demanar amb el paràmetre ids
+MAX_IDS = 1000
+
+
+def parse_ids(value):
+    """
+    Valida el paràmetre ids (enters separats per comes) dels llistats.
+
+    Returns:
+        Llista d'identificadors o None si no s'ha proporcionat
+
+    Raises:
+        ValueError: si algun valor no és un enter o se'n demanen massa
+    """
+    if not value:
+        return None
+    ids = {int(v) for v in value.split(",") if v.strip()}
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"Es poden demanar com a màxim {MAX_IDS} identificadors")
+    return sorted(ids)
+
 
 # ENDPOINTS DELS USUARIS =======================================================
 
 
 @admin_bp.route("/usuari", methods=["GET"])
+@query_budget(1)
 @require_auth_role("admin", "secretaria")
 def list_users():
     """
@@ -59,6 +109,7 @@ def list_users():
 
 
 @admin_bp.route("/usuari/<int:user_id>", methods=["GET"])
+@query_budget(1)
 @require_auth_role("admin", "secretaria")
 def get_user(user_id):
     """
@@ -102,14 +153,18 @@ def get_user(user_id):
 
 
 @admin_bp.route("/usuari", methods=["POST"])
+# Pitjor cas mesurat: reemplaçament d'una clau d'idempotència caducada
+@query_budget(8)
 @require_auth_role("admin")
+@idempotent
 def create_user():
     """
     Endpoint per crear un nou usuari
 
     Capçaleres:
     {
-        "Authorization": "Bearer <token>"
+        "Authorization": "Bearer <token>",
+        "Idempotency-Key": "<clau>" (opcional)
     }
 
     Petició JSON:
@@ -196,6 +251,7 @@ def create_user():
 
 
 @admin_bp.route("/usuari/<int:user_id>", methods=["PUT"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def update_user(user_id):
     """
@@ -316,6 +372,7 @@ def update_user(user_id):
 
 
 @admin_bp.route("/usuari/<int:user_id>", methods=["DELETE"])
+@query_budget(2)
 @require_auth_role("admin", "secretaria")
 def delete_user(user_id):
     """
@@ -363,7 +420,9 @@ def delete_user(user_id):
 
 
 @admin_bp.route("/pacients", methods=["GET"])
+@query_budget(2)
 @require_auth_role("admin", "secretaria")
+@conditional_get("patients")
 def get_patients():
     """
     Endpoint per obtenir tots els pacients
@@ -373,6 +432,9 @@ def get_patients():
         "Authorization": "Bearer <token>"
     }
 
+    Paràmetres de consulta:
+        ids: llista d'identificadors separats per comes (opcional)
+
     Resposta JSON:
     [
         {
@@ -384,25 +446,79 @@ def get_patients():
         },
         ...
     ]
+
+    La resposta inclou un ETag: amb If-None-Match es retorna 304 si les dades
+    no han canviat.
     """
+    try:
+        ids = parse_ids(request.args.get("ids"))
+    except ValueError:
+        return jsonify({"error": "El paràmetre 'ids' no és vàlid"}), 400
+
     db: Session = SessionLocal()
     try:
-        patients = db.query(Patient).all()
+        query = db.query(Patient)
+        # Filtra per identificadors si s'han passat en la consulta
+        if ids is not None:
+            query = query.filter(Patient.id_patient.in_(ids))
+        patients = query.all()
+        return jsonify([serialize_patient(p) for p in patients]), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+@admin_bp.route("/pacients/cerca", methods=["GET"])
+@query_budget(1)
+@require_auth_role("admin", "secretaria")
+def search_patients():
+    """
+    Endpoint per cercar pacients per una part del nom o del telèfon
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        q: text a cercar (termes d'almenys 3 caràcters)
+        limit: nombre màxim de resultats (opcional)
+
+    Resposta JSON (ordenada per rellevància):
+    [
+        {
+            "id_patient": int,
+            "id_user": int,
+            "name": "string",
+            "phone": "string",
+            "status": "ACTIU|INACTIU"
+        },
+        ...
+    ]
+    """
+    match = build_match_query(request.args.get("q"))
+    if match is None:
         return (
             jsonify(
-                [
-                    {
-                        "id_patient": p.id_patient,
-                        "id_user": p.id_user,
-                        "name": p.name,
-                        "phone": p.phone,
-                        "status": p.status.value,
-                    }
-                    for p in patients
-                ]
+                {"error": "El paràmetre 'q' ha de tenir termes d'almenys 3 caràcters"}
             ),
-            200,
+            400,
         )
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "El paràmetre 'limit' no és vàlid"}), 400
+
+    db: Session = SessionLocal()
+    try:
+        patients = (
+            db.query(Patient)
+            .from_statement(search_statement("patients_fts"))
+            .params(match=match, limit=limit)
+            .all()
+        )
+        return jsonify([serialize_patient(p) for p in patients]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -410,6 +526,7 @@ def get_patients():
 
 
 @admin_bp.route("/pacients/<int:id_patient>", methods=["GET"])
+@query_budget(1)
 @require_auth_role("admin", "pacient")
 def get_patient(id_patient):
     """
@@ -429,6 +546,14 @@ def get_patient(id_patient):
         "status": "ACTIU|INACTIU"
     }
     """
+    # Primer es consulta la memòria cau (s'invalida en actualitzar o eliminar)
+    cached = patient_cache.get(id_patient)
+    if cached is not None:
+        return jsonify(cached), 200
+    # La marca es pren abans de la consulta: si una modificació invalida la
+    # memòria cau mentrestant, el valor llegit no es desa
+    stamp = patient_cache.stamp()
+
     db: Session = SessionLocal()
     try:
         patient = db.query(Patient).filter(Patient.id_patient == id_patient).first()
@@ -436,18 +561,9 @@ def get_patient(id_patient):
         if not patient:
             return jsonify({"error": "No s'ha trobat el pacient"}), 404
 
-        return (
-            jsonify(
-                {
-                    "id_patient": patient.id_patient,
-                    "id_user": patient.id_user,
-                    "name": patient.name,
-                    "phone": patient.phone,
-                    "status": patient.status.value,
-                }
-            ),
-            200,
-        )
+        data = serialize_patient(patient)
+        patient_cache.set(id_patient, data, stamp=stamp)
+        return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -455,14 +571,19 @@ def get_patient(id_patient):
 
 
 @admin_bp.route("/pacients", methods=["POST"])
+# Pitjor cas mesurat: usuari associat (username i password) i reemplaçament
+# d'una clau d'idempotència caducada
+@query_budget(11)
 @require_auth_role("admin")
+@idempotent
 def create_patient():
     """
     Endpoint per crear un nou pacient
 
     Capçaleres:
     {
-        "Authorization": "Bearer <token>"
+        "Authorization": "Bearer <token>",
+        "Idempotency-Key": "<clau>" (opcional)
     }
 
     Petició JSON:
@@ -557,20 +678,17 @@ def create_patient():
         )
 
         db.add(new_patient)
+        db.flush()
+        record_change(
+            db,
+            "patient",
+            new_patient.id_patient,
+            ChangeOpEnum.INSERT,
+            serialize_patient(new_patient),
+        )
         db.commit()
 
-        return (
-            jsonify(
-                {
-                    "id_patient": new_patient.id_patient,
-                    "id_user": new_patient.id_user,
-                    "name": new_patient.name,
-                    "phone": new_patient.phone,
-                    "status": new_patient.status.value,
-                }
-            ),
-            201,
-        )
+        return jsonify(serialize_patient(new_patient)), 201
     except IntegrityError:
         db.rollback()
         return jsonify({"error": "Error d'integritat en la base de dades"}), 400
@@ -582,6 +700,7 @@ def create_patient():
 
 
 @admin_bp.route("/pacients/<int:id_patient>", methods=["PUT"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def update_patient(id_patient):
     """
@@ -635,20 +754,17 @@ def update_patient(id_patient):
         if "id_user" in data:
             patient.id_user = data["id_user"]
 
+        record_change(
+            db,
+            "patient",
+            patient.id_patient,
+            ChangeOpEnum.UPDATE,
+            serialize_patient(patient),
+        )
         db.commit()
+        patient_cache.invalidate(id_patient)
 
-        return (
-            jsonify(
-                {
-                    "id_patient": patient.id_patient,
-                    "id_user": patient.id_user,
-                    "name": patient.name,
-                    "phone": patient.phone,
-                    "status": patient.status.value,
-                }
-            ),
-            200,
-        )
+        return jsonify(serialize_patient(patient)), 200
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
@@ -657,6 +773,7 @@ def update_patient(id_patient):
 
 
 @admin_bp.route("/pacients/<int:id_patient>", methods=["DELETE"])
+@query_budget(5)
 @require_auth_role("admin", "secretaria")
 def delete_patient(id_patient):
     """
@@ -686,7 +803,9 @@ def delete_patient(id_patient):
                 db.delete(user)
 
         db.delete(patient)
+        record_change(db, "patient", id_patient, ChangeOpEnum.DELETE)
         db.commit()
+        patient_cache.invalidate(id_patient)
 
         return jsonify({"message": "S'ha eliminat correctament el pacient"}), 200
     except Exception as e:
@@ -700,7 +819,9 @@ def delete_patient(id_patient):
 
 
 @admin_bp.route("/doctors", methods=["GET"])
+@query_budget(2)
 @require_auth_role("admin", "secretaria")
+@conditional_get("doctors", max_age=DOCTORS_MAX_AGE)
 def get_doctors():
     """
     Endpoint per obtenir tots els doctors
@@ -710,6 +831,9 @@ def get_doctors():
         "Authorization": "Bearer <token>"
     }
 
+    Paràmetres de consulta:
+        ids: llista d'identificadors separats per comes (opcional)
+
     Resposta JSON:
     [
         {
@@ -720,24 +844,78 @@ def get_doctors():
         },
         ...
     ]
+
+    La resposta inclou un ETag: amb If-None-Match es retorna 304 si les dades
+    no han canviat.
     """
+    try:
+        ids = parse_ids(request.args.get("ids"))
+    except ValueError:
+        return jsonify({"error": "El paràmetre 'ids' no és vàlid"}), 400
+
     db: Session = SessionLocal()
     try:
-        doctors = db.query(Doctor).all()
+        query = db.query(Doctor)
+        # Filtra per identificadors si s'han passat en la consulta
+        if ids is not None:
+            query = query.filter(Doctor.id_doctor.in_(ids))
+        doctors = query.all()
+        return jsonify([serialize_doctor(d) for d in doctors]), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+@admin_bp.route("/doctors/cerca", methods=["GET"])
+@query_budget(1)
+@require_auth_role("admin", "secretaria")
+def search_doctors():
+    """
+    Endpoint per cercar doctors per una part del nom o de l'especialitat
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        q: text a cercar (termes d'almenys 3 caràcters)
+        limit: nombre màxim de resultats (opcional)
+
+    Resposta JSON (ordenada per rellevància):
+    [
+        {
+            "id_doctor": int,
+            "id_user": int,
+            "name": "string",
+            "specialty": "string"
+        },
+        ...
+    ]
+    """
+    match = build_match_query(request.args.get("q"))
+    if match is None:
         return (
             jsonify(
-                [
-                    {
-                        "id_doctor": d.id_doctor,
-                        "id_user": d.id_user,
-                        "name": d.name,
-                        "specialty": d.specialty,
-                    }
-                    for d in doctors
-                ]
+                {"error": "El paràmetre 'q' ha de tenir termes d'almenys 3 caràcters"}
             ),
-            200,
+            400,
         )
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "El paràmetre 'limit' no és vàlid"}), 400
+
+    db: Session = SessionLocal()
+    try:
+        doctors = (
+            db.query(Doctor)
+            .from_statement(search_statement("doctors_fts"))
+            .params(match=match, limit=limit)
+            .all()
+        )
+        return jsonify([serialize_doctor(d) for d in doctors]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -745,6 +923,7 @@ def get_doctors():
 
 
 @admin_bp.route("/doctors/<int:id_doctor>", methods=["GET"])
+@query_budget(1)
 @require_auth_role("admin", "pacient")
 def get_doctor(id_doctor):
     """
@@ -763,6 +942,14 @@ def get_doctor(id_doctor):
         "specialty": "string"
     }
     """
+    # Primer es consulta la memòria cau (s'invalida en actualitzar o eliminar)
+    cached = doctor_cache.get(id_doctor)
+    if cached is not None:
+        return jsonify(cached), 200
+    # La marca es pren abans de la consulta: si una modificació invalida la
+    # memòria cau mentrestant, el valor llegit no es desa
+    stamp = doctor_cache.stamp()
+
     db: Session = SessionLocal()
     try:
         doctor = db.query(Doctor).filter(Doctor.id_doctor == id_doctor).first()
@@ -770,17 +957,9 @@ def get_doctor(id_doctor):
         if not doctor:
             return jsonify({"error": "No s'ha trobat el doctor"}), 404
 
-        return (
-            jsonify(
-                {
-                    "id_doctor": doctor.id_doctor,
-                    "id_user": doctor.id_user,
-                    "name": doctor.name,
-                    "specialty": doctor.specialty,
-                }
-            ),
-            200,
-        )
+        data = serialize_doctor(doctor)
+        doctor_cache.set(id_doctor, data, stamp=stamp)
+        return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -788,14 +967,19 @@ def get_doctor(id_doctor):
 
 
 @admin_bp.route("/doctors", methods=["POST"])
+# Pitjor cas mesurat: usuari associat (username i password) i reemplaçament
+# d'una clau d'idempotència caducada
+@query_budget(11)
 @require_auth_role("admin")
+@idempotent
 def create_doctor():
     """
     Endpoint per crear un nou doctor
 
     Capçaleres:
     {
-        "Authorization": "Bearer <token>"
+        "Authorization": "Bearer <token>",
+        "Idempotency-Key": "<clau>" (opcional)
     }
 
     Petició JSON:
@@ -875,19 +1059,17 @@ def create_doctor():
         )
 
         db.add(new_doctor)
+        db.flush()
+        record_change(
+            db,
+            "doctor",
+            new_doctor.id_doctor,
+            ChangeOpEnum.INSERT,
+            serialize_doctor(new_doctor),
+        )
         db.commit()
 
-        return (
-            jsonify(
-                {
-                    "id_doctor": new_doctor.id_doctor,
-                    "id_user": new_doctor.id_user,
-                    "name": new_doctor.name,
-                    "specialty": new_doctor.specialty,
-                }
-            ),
-            201,
-        )
+        return jsonify(serialize_doctor(new_doctor)), 201
     except IntegrityError:
         db.rollback()
         return jsonify({"error": "Error d'integritat en la base de dades"}), 400
@@ -899,6 +1081,7 @@ def create_doctor():
 
 
 @admin_bp.route("/doctors/<int:id_doctor>", methods=["PUT"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def update_doctor(id_doctor):
     """
@@ -940,19 +1123,17 @@ def update_doctor(id_doctor):
         if "id_user" in data:
             doctor.id_user = data["id_user"]
 
+        record_change(
+            db,
+            "doctor",
+            doctor.id_doctor,
+            ChangeOpEnum.UPDATE,
+            serialize_doctor(doctor),
+        )
         db.commit()
+        doctor_cache.invalidate(id_doctor)
 
-        return (
-            jsonify(
-                {
-                    "id_doctor": doctor.id_doctor,
-                    "id_user": doctor.id_user,
-                    "name": doctor.name,
-                    "specialty": doctor.specialty,
-                }
-            ),
-            200,
-        )
+        return jsonify(serialize_doctor(doctor)), 200
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
@@ -961,6 +1142,7 @@ def update_doctor(id_doctor):
 
 
 @admin_bp.route("/doctors/<int:id_doctor>", methods=["DELETE"])
+@query_budget(5)
 @require_auth_role("admin", "secretaria")
 def delete_doctor(id_doctor):
     """
@@ -990,7 +1172,9 @@ def delete_doctor(id_doctor):
                 db.delete(user)
 
         db.delete(doctor)
+        record_change(db, "doctor", id_doctor, ChangeOpEnum.DELETE)
         db.commit()
+        doctor_cache.invalidate(id_doctor)
 
         return jsonify({"message": "S'ha eliminat correctament el doctor"}), 200
     except Exception as e:
@@ -1004,7 +1188,9 @@ def delete_doctor(id_doctor):
 
 
 @admin_bp.route("/centres", methods=["GET"])
+@query_budget(2)
 @require_auth_role("admin", "secretaria")
+@conditional_get("centers", max_age=CENTRES_MAX_AGE)
 def get_centers():
     """
     Endpoint per obtenir tots els centres
@@ -1014,6 +1200,9 @@ def get_centers():
         "Authorization": "Bearer <token>"
     }
 
+    Paràmetres de consulta:
+        ids: llista d'identificadors separats per comes (opcional)
+
     Resposta JSON:
     [
         {
@@ -1023,19 +1212,23 @@ def get_centers():
         },
         ...
     ]
+
+    La resposta inclou un ETag: amb If-None-Match es retorna 304 si les dades
+    no han canviat.
     """
+    try:
+        ids = parse_ids(request.args.get("ids"))
+    except ValueError:
+        return jsonify({"error": "El paràmetre 'ids' no és vàlid"}), 400
+
     db: Session = SessionLocal()
     try:
-        centers = db.query(Center).all()
-        return (
-            jsonify(
-                [
-                    {"id_center": c.id_center, "name": c.name, "address": c.address}
-                    for c in centers
-                ]
-            ),
-            200,
-        )
+        query = db.query(Center)
+        # Filtra per identificadors si s'han passat en la consulta
+        if ids is not None:
+            query = query.filter(Center.id_center.in_(ids))
+        centers = query.all()
+        return jsonify([serialize_center(c) for c in centers]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -1043,6 +1236,7 @@ def get_centers():
 
 
 @admin_bp.route("/centres/<int:id_center>", methods=["GET"])
+@query_budget(1)
 @require_auth_role("admin", "pacient")
 def get_center(id_center):
     """
@@ -1060,6 +1254,14 @@ def get_center(id_center):
         "address": "string"
     }
     """
+    # Primer es consulta la memòria cau (s'invalida en actualitzar o eliminar)
+    cached = center_cache.get(id_center)
+    if cached is not None:
+        return jsonify(cached), 200
+    # La marca es pren abans de la consulta: si una modificació invalida la
+    # memòria cau mentrestant, el valor llegit no es desa
+    stamp = center_cache.stamp()
+
     db: Session = SessionLocal()
     try:
         center = db.query(Center).filter(Center.id_center == id_center).first()
@@ -1067,16 +1269,9 @@ def get_center(id_center):
         if not center:
             return jsonify({"error": "No s'ha trobat el centre"}), 404
 
-        return (
-            jsonify(
-                {
-                    "id_center": center.id_center,
-                    "name": center.name,
-                    "address": center.address,
-                }
-            ),
-            200,
-        )
+        data = serialize_center(center)
+        center_cache.set(id_center, data, stamp=stamp)
+        return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -1084,14 +1279,18 @@ def get_center(id_center):
 
 
 @admin_bp.route("/centres", methods=["POST"])
+# Pitjor cas mesurat: reemplaçament d'una clau d'idempotència caducada
+@query_budget(9)
 @require_auth_role("admin")
+@idempotent
 def create_center():
     """
     Endpoint per crear un nou centre
 
     Capçaleres:
     {
-        "Authorization": "Bearer <token>"
+        "Authorization": "Bearer <token>",
+        "Idempotency-Key": "<clau>" (opcional)
     }
 
     Petició JSON:
@@ -1139,18 +1338,17 @@ def create_center():
         new_center = Center(name=name, address=address)
 
         db.add(new_center)
+        db.flush()
+        record_change(
+            db,
+            "center",
+            new_center.id_center,
+            ChangeOpEnum.INSERT,
+            serialize_center(new_center),
+        )
         db.commit()
 
-        return (
-            jsonify(
-                {
-                    "id_center": new_center.id_center,
-                    "name": new_center.name,
-                    "address": new_center.address,
-                }
-            ),
-            201,
-        )
+        return jsonify(serialize_center(new_center)), 201
     except IntegrityError:
         db.rollback()
         return jsonify({"error": "Error d'integritat en la base de dades"}), 400
@@ -1162,6 +1360,7 @@ def create_center():
 
 
 @admin_bp.route("/centres/<int:id_center>", methods=["PUT"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def update_center(id_center):
     """
@@ -1199,18 +1398,17 @@ def update_center(id_center):
         if "address" in data:
             center.address = data["address"]
 
+        record_change(
+            db,
+            "center",
+            center.id_center,
+            ChangeOpEnum.UPDATE,
+            serialize_center(center),
+        )
         db.commit()
+        center_cache.invalidate(id_center)
 
-        return (
-            jsonify(
-                {
-                    "id_center": center.id_center,
-                    "name": center.name,
-                    "address": center.address,
-                }
-            ),
-            200,
-        )
+        return jsonify(serialize_center(center)), 200
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
@@ -1219,6 +1417,7 @@ def update_center(id_center):
 
 
 @admin_bp.route("/centres/<int:id_center>", methods=["DELETE"])
+@query_budget(3)
 @require_auth_role("admin", "secretaria")
 def delete_center(id_center):
     """
@@ -1242,7 +1441,9 @@ def delete_center(id_center):
             return jsonify({"error": "No s'ha trobat el centre"}), 404
 
         db.delete(center)
+        record_change(db, "center", id_center, ChangeOpEnum.DELETE)
         db.commit()
+        center_cache.invalidate(id_center)
 
         return jsonify({"message": "S'ha eliminat correctament el centre"}), 200
     except Exception as e:
@@ -1250,3 +1451,209 @@ def delete_center(id_center):
         return jsonify({"error": str(e)}), 500
     finally:
         db.close()
+
+
+# ENDPOINT DEL REGISTRE DE CANVIS ==============================================
+
+
+@admin_bp.route("/canvis", methods=["GET"])
+@query_budget(1)
+@require_auth_role("admin", "secretaria")
+def list_changes():
+    """
+    Endpoint per obtenir els canvis de pacients, doctors i centres en ordre
+
+    Permet la sincronització incremental: el consumidor desa el valor de
+    next_since i el passa com a since a la següent petició.
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        since: seqüència de l'últim canvi processat (per defecte 0)
+        limit: nombre màxim de canvis de la pàgina (opcional)
+
+    Resposta JSON:
+    {
+        "changes": [
+            {
+                "seq": int,
+                "entity": "patient|doctor|center",
+                "id": int,
+                "op": "INSERT|UPDATE|DELETE",
+                "data": {...} | null,
+                "changed_at": "2026-07-01T10:00:00"
+            },
+            ...
+        ],
+        "next_since": int,
+        "has_more": bool
+    }
+    """
+    try:
+        since = parse_since(request.args.get("since"))
+        limit = parse_changes_limit(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "Els paràmetres 'since' i 'limit' no són vàlids"}), 400
+
+    db: Session = SessionLocal()
+    try:
+        changes, has_more = fetch_changes(db, since, limit)
+        return (
+            jsonify(
+                {
+                    "changes": [serialize_change(c) for c in changes],
+                    "next_since": changes[-1].seq if changes else since,
+                    "has_more": has_more,
+                }
+            ),
+            200,
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+# ENDPOINT DE LA MEMÒRIA CAU ===================================================
+
+
+@admin_bp.route("/cache", methods=["GET"])
+@query_budget(0)
+@require_auth_role("admin")
+def cache_stats():
+    """
+    Endpoint per consultar les estadístiques de les memòries cau d'entitats
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Resposta JSON:
+    [
+        {
+            "name": "patients|doctors|centers",
+            "size": int,
+            "maxsize": int,
+            "ttl": float,
+            "hits": int,
+            "misses": int,
+            "evictions": int,
+            "hit_rate": float
+        },
+        ...
+    ]
+    """
+    return jsonify([cache.stats() for cache in CACHES]), 200
+
+
+# ENDPOINTS DE DIAGNÒSTIC DE MEMÒRIA ===========================================
+
+
+@admin_bp.route("/diagnostics/memory", methods=["GET"])
+@query_budget(0)
+@require_auth_role("admin")
+def memory_diagnostics():
+    """
+    Endpoint per consultar l'estat de la memòria del worker que atén la petició
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        limit: llocs d'assignació que es retornen (per defecte 20, màxim 200)
+
+    Resposta JSON:
+    {
+        "pid": int,
+        "rss_bytes": int,
+        "gc_counts": [int, int, int],
+        "tracing": bool,
+        "sqlalchemy": {
+            "sessions": int,
+            "identity_map_total": int,
+            "identity_map_largest": [int, ...],
+            "with_pending_changes": int
+        },
+        "caches": [{"name": ..., "size": int, ...}, ...],
+        "traced_current_bytes": int,  (només amb tracemalloc actiu)
+        "traced_peak_bytes": int,
+        "top": [{"file": ..., "line": int, "size": int, "count": int}, ...],
+        "has_baseline": bool
+    }
+    """
+    limit = parse_top_limit(request.args.get("limit"))
+    if limit is None:
+        return (
+            jsonify({"error": "El paràmetre 'limit' ha de ser un enter entre 1 i 200"}),
+            400,
+        )
+    report = memory_report(CACHES, limit)
+    return jsonify(report), 200
+
+
+@admin_bp.route("/diagnostics/memory/<action>", methods=["POST"])
+@query_budget(0)
+@require_auth_role("admin")
+def memory_diagnostics_action(action):
+    """
+    Endpoint per controlar tracemalloc al worker que atén la petició
+
+    Accions:
+        start: activa tracemalloc (cos opcional: {"frames": int})
+        stop: atura tracemalloc i descarta la instantània de referència
+        snapshot: desa una instantània de referència
+        diff: compara l'estat actual amb la instantània de referència
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        limit: llocs d'assignació que es retornen (snapshot i diff)
+
+    Resposta JSON (diff):
+    {
+        "size_diff": int,
+        "top": [{"file": ..., "line": int, "size": int, "count": int,
+                 "size_diff": int, "count_diff": int}, ...]
+    }
+    """
+    limit = parse_top_limit(request.args.get("limit"))
+    if limit is None:
+        return (
+            jsonify({"error": "El paràmetre 'limit' ha de ser un enter entre 1 i 200"}),
+            400,
+        )
+
+    if action == "start":
+        frames = (request.get_json(silent=True) or {}).get("frames", 1)
+        if not isinstance(frames, int) or not 1 <= frames <= 100:
+            return (
+                jsonify({"error": "El camp 'frames' ha de ser un enter entre 1 i 100"}),
+                400,
+            )
+        return jsonify(start_tracing(frames)), 200
+    if action == "stop":
+        return jsonify(stop_tracing()), 200
+    if action not in ("snapshot", "diff"):
+        return jsonify({"error": f"Acció desconeguda: {action}"}), 404
+    if not tracemalloc.is_tracing():
+        return jsonify({"error": "Cal activar tracemalloc abans (acció start)"}), 409
+    if action == "snapshot":
+        return jsonify(take_baseline(limit)), 200
+    diff = diff_baseline(limit)
+    if diff is None:
+        return (
+            jsonify(
+                {"error": "No hi ha cap instantània de referència (acció snapshot)"}
+            ),
+            409,
+        )
+    return jsonify(diff), 200
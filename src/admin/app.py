@@ -1,28 +1,73 @@
 import os
 from flask import Flask
 from flask_cors import CORS
+from sqlalchemy.orm import configure_mappers
+from compression import init_compression
+from metrics import init_metrics
+from tracing import init_tracing
+from profiling import init_profiling
+from querybudget import init_query_budget, missing_budgets
+from cache import CACHES
 from auth_bp import auth_bp
 from admin_bp import admin_bp
-from database import init_db, create_default_admin
+from config import get_config
+import database
 
-app = Flask(__name__)
-CORS(app)
 
-# Inicialitzar la base de dades i crear usuari per defecte
-with app.app_context():
-    init_db()
-    create_default_admin()
+def create_app(config=None):
+    """
+    Crea l'aplicació amb un perfil de configuració (development, production,
+    testing o una classe de configuració).
 
-# Registrar blueprints amb prefix /auth i /admin
-app.register_blueprint(auth_bp, url_prefix="/auth")
-app.register_blueprint(admin_bp, url_prefix="/admin")
+    Importar el mòdul no toca la base de dades: l'esquema es comprova aquí, i
+    només si la versió desada no coincideix amb la dels models.
+    """
+    config = get_config(config)
+    app = Flask(__name__)
+    app.config.from_object(config)
+    CORS(app)
 
+    # Comprimir les respostes grans (brotli/gzip) segons Accept-Encoding
+    init_compression(app)
 
-@app.route("/")
-def hello():
-    return {"message": "Admin Service API", "status": "running"}
+    # Mètriques de peticions, base de dades i memòries cau a /metrics
+    init_metrics(app, caches=CACHES)
+
+    # Identificador de correlació (X-Request-ID) i trams de temps de les peticions
+    init_tracing(app, "admin")
+
+    # Perfilat amb cProfile de les peticions seleccionades (PROFILE_ENABLED)
+    init_profiling(app)
+
+    # Pressupost de consultes SQL per ruta (QUERY_BUDGET_MODE)
+    init_query_budget(app)
+
+    # Configurar els mappers ara i no a la primera petició
+    configure_mappers()
+
+    # Inicialitzar la base de dades i crear usuari per defecte
+    database.configure_engine(config.DATABASE_PATH, config.SQL_ECHO)
+    with app.app_context():
+        database.init_db()
+        if config.CREATE_DEFAULT_ADMIN:
+            database.create_default_admin()
+
+    # Registrar blueprints amb prefix /auth i /admin
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+
+    if app.config["QUERY_BUDGET_MODE"] != "off":
+        for endpoint in missing_budgets(app):
+            print(f"L'endpoint {endpoint} no declara cap pressupost de consultes")
+
+    @app.route("/")
+    def hello():
+        return {"message": "Admin Service API", "status": "running"}
+
+    return app
 
 
 if __name__ == "__main__":
+    app = create_app()
     port = int(os.getenv("PORT", 5002))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=app.config["DEBUG"])
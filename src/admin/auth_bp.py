@@ -9,6 +9,7 @@ from werkzeug.security import check_password_hash
 
 from database import get_db
 from models import User
+from querybudget import query_budget
 
 # Crear el blueprint principal d'autenticació
 auth_bp = Blueprint("auth", __name__)
@@ -17,6 +18,7 @@ SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 
 
 @auth_bp.route("/login", methods=["POST"])
+@query_budget(1)
 def login():
     """
     Endpoint per autenticar un usuari
@@ -81,6 +83,7 @@ def login():
 
 
 @auth_bp.route("/", methods=["GET"])
+@query_budget(0)
 def verify_token():
     """
     Endpoint per verificar un token
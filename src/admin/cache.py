@@ -0,0 +1,105 @@
+"""Memòria cau LRU amb caducitat (TTL) per a les consultes d'entitats per ID."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "1024"))
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "60"))
+
+
+class TTLCache:
+    """
+    Memòria cau LRU de mida fixa on cada entrada caduca després de ttl segons.
+
+    És segura entre fils i compta encerts, errades i expulsions per poder
+    exposar-ne la taxa d'encerts. Cada procés (worker) en té una còpia pròpia;
+    la caducitat limita el temps que una entrada pot quedar obsoleta si un
+    altre procés modifica l'entitat.
+
+    Per evitar que una lectura feta abans d'una modificació torni a desar el
+    valor antic després d'invalidar-lo, el lector obté stamp() abans de
+    consultar la base de dades i el passa a set(): si entremig s'ha invalidat
+    alguna entrada, el valor no es desa.
+    """
+
+    def __init__(self, name, maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._invalidations = 0
+
+    def stamp(self):
+        """Marca de les invalidacions fetes fins ara (vegeu set)."""
+        with self._lock:
+            return self._invalidations
+
+    def get(self, key):
+        """Retorna el valor desat o None si no hi és o ha caducat."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, stamp=None):
+        """
+        Desa un valor i expulsa l'entrada menys usada si se supera la mida.
+
+        Si s'indica stamp (obtingut amb stamp() abans de llegir el valor) i
+        des de llavors s'ha invalidat alguna entrada, el valor pot ser antic i
+        no es desa.
+        """
+        with self._lock:
+            if stamp is not None and stamp != self._invalidations:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Elimina una entrada (s'ha de cridar quan l'entitat es modifica)."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Memòries cau dels endpoints GET per ID dels pacients, doctors i centres
+patient_cache = TTLCache("patients")
+doctor_cache = TTLCache("doctors")
+center_cache = TTLCache("centers")
+
+CACHES = [patient_cache, doctor_cache, center_cache]
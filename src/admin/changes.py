@@ -0,0 +1,108 @@
+"""Mòdul del registre de canvis (change feed) de les entitats d'administració."""
+
+import json
+import os
+
+from models import Center, Change, ChangeOpEnum, Doctor, Patient
+from serializers import serialize_center, serialize_doctor, serialize_patient
+
+# Mida per defecte i màxima d'una pàgina del feed de canvis
+CHANGES_DEFAULT_LIMIT = int(os.getenv("CHANGES_DEFAULT_LIMIT", "100"))
+CHANGES_MAX_LIMIT = int(os.getenv("CHANGES_MAX_LIMIT", "1000"))
+
+# Entitats que es registren al feed amb el model i la clau primària
+TRACKED_ENTITIES = {
+    "patient": (Patient, "id_patient", serialize_patient),
+    "doctor": (Doctor, "id_doctor", serialize_doctor),
+    "center": (Center, "id_center", serialize_center),
+}
+
+
+def record_change(db, entity, entity_id, op: ChangeOpEnum, data=None):
+    """
+    Afegeix un canvi a la sessió perquè es confirmi amb la mateixa transacció
+    que l'escriptura de l'entitat.
+
+    Args:
+        db: Sessió de la base de dades
+        entity: Tipus d'entitat ('patient', 'doctor' o 'center')
+        entity_id: Identificador de l'entitat modificada
+        op: Operació realitzada
+        data: Representació serialitzada de l'entitat (None en eliminar)
+    """
+    db.add(
+        Change(
+            entity=entity,
+            entity_id=entity_id,
+            op=op,
+            data=json.dumps(data) if data is not None else None,
+        )
+    )
+
+
+def backfill_changes(db):
+    """
+    Registra com a insercions les entitats existents si el registre és buit.
+
+    D'aquesta manera un consumidor que comença amb since=0 rep totes les
+    dades, incloses les creades abans d'existir el registre de canvis.
+
+    Args:
+        db: Sessió de la base de dades
+    """
+    if db.query(Change.seq).first() is not None:
+        return
+    for entity, (model, pk, serializer) in TRACKED_ENTITIES.items():
+        for obj in db.query(model).order_by(getattr(model, pk)):
+            record_change(
+                db, entity, getattr(obj, pk), ChangeOpEnum.INSERT, serializer(obj)
+            )
+    db.commit()
+
+
+def parse_since(value):
+    """Valida el paràmetre since (seqüència a partir de la qual es llegeix)."""
+    if value is None or value == "":
+        return 0
+    since = int(value)
+    if since < 0:
+        raise ValueError("El paràmetre 'since' no pot ser negatiu")
+    return since
+
+
+def parse_limit(value):
+    """Valida el paràmetre limit i el restringeix a CHANGES_MAX_LIMIT."""
+    if value is None or value == "":
+        return CHANGES_DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("El paràmetre 'limit' ha de ser positiu")
+    return min(limit, CHANGES_MAX_LIMIT)
+
+
+def fetch_changes(db, since, limit):
+    """
+    Retorna una pàgina de canvis amb seq > since en ordre creixent.
+
+    Returns:
+        Tupla (llista de canvis, hi ha més pàgines)
+    """
+    rows = (
+        db.query(Change)
+        .filter(Change.seq > since)
+        .order_by(Change.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def serialize_change(change: Change):
+    return {
+        "seq": change.seq,
+        "entity": change.entity,
+        "id": change.entity_id,
+        "op": change.op.value,
+        "data": json.loads(change.data) if change.data is not None else None,
+        "changed_at": change.changed_at.isoformat(),
+    }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Comprovació dels plans d'execució de les consultes per username i id_user del
+servei d'administració.
+
+Crea l'esquema en una base de dades temporal, executa les peticions que
+cerquen usuaris pel username (login, alta i modificació d'usuaris, pacients i
+doctors) i pacients i doctors per l'id_user (alta amb usuari existent i
+baixa), captura les sentències SQL que generen i n'obté el pla amb EXPLAIN
+QUERY PLAN. Retorna el codi de sortida 1 si alguna recorre sencera una taula
+(SCAN) en lloc de fer servir un índex, de manera que un canvi d'esquema o de
+consulta que torni a introduir recorreguts complets fa fallar la comprovació.
+
+Ús (des del directori del servei):
+    python comprova_plans.py
+"""
+
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# La base de dades temporal s'ha de configurar abans d'importar l'aplicació
+os.environ["TEST_DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "admin.db")
+os.environ["SLOW_QUERY_THRESHOLD_MS"] = "-1"
+
+from sqlalchemy import event
+
+import database
+from app import create_app
+from slowlog import EXPLAINABLE, explain_query_plan
+
+SCAN_PATTERN = re.compile(r"^SCAN (\w+)")
+
+_captured = None
+
+
+def _capture_statement(conn, cursor, statement, parameters, context, many):
+    if _captured is not None and statement.lstrip().upper().startswith(EXPLAINABLE):
+        params = parameters[0] if many and parameters else parameters
+        _captured.append((statement, params))
+
+
+@contextmanager
+def capture():
+    """Captura les sentències SQL executades dins del bloc."""
+    global _captured
+    _captured = statements = []
+    try:
+        yield statements
+    finally:
+        _captured = None
+
+
+def full_scans(statements):
+    """
+    Retorna les sentències que recorren sencera alguna taula, amb el seu pla.
+    """
+    connection = database.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        scans = []
+        for statement, parameters in statements:
+            plan = explain_query_plan(connection, statement, parameters)
+            if any(
+                m and m.group(1) in tables
+                for m in (SCAN_PATTERN.match(line) for line in plan)
+            ):
+                scans.append((statement, plan))
+        return scans
+    finally:
+        connection.close()
+
+
+class Checker:
+    def __init__(self, client, headers):
+        self.client = client
+        self.headers = headers
+        self.checked = 0
+        self.failures = 0
+
+    def request(self, name, method, path, json=None, expected=(200, 201)):
+        """
+        Fa una petició i comprova que les sentències que genera fan servir
+        índexs.
+
+        Returns:
+            El cos JSON de la resposta
+        """
+        self.checked += 1
+        with capture() as statements:
+            response = self.client.open(
+                path, method=method, json=json, headers=self.headers
+            )
+        if response.status_code not in expected:
+            print(f"FALLA  {name}: {response.status_code} {response.get_json()}")
+            self.failures += 1
+            return response.get_json()
+        scans = full_scans(statements)
+        if not scans:
+            print(f"OK     {name}")
+            return response.get_json()
+        self.failures += 1
+        print(f"FALLA  {name}")
+        for statement, plan in scans:
+            print("    " + " ".join(statement.split())[:300])
+            for line in plan:
+                print(f"        {line}")
+        return response.get_json()
+
+
+def main():
+    app = create_app("testing")
+    event.listen(database.engine, "before_cursor_execute", _capture_statement)
+    client = app.test_client()
+
+    login = Checker(client, {})
+    data = login.request(
+        "login: usuari pel username",
+        "POST",
+        "/auth/login",
+        json={
+            "username": os.getenv("DEFAULT_ADMIN_USERNAME", "admin"),
+            "password": os.getenv("DEFAULT_ADMIN_PASSWORD", "admin123"),
+        },
+    )
+    checker = Checker(client, {"Authorization": f"Bearer {data['access_token']}"})
+
+    # Usuaris: alta i canvi de username
+    user = checker.request(
+        "create_user: username repetit",
+        "POST",
+        "/admin/usuari",
+        json={"username": "plans_doctor", "password": "secret", "role": "secretaria"},
+    )
+    id_user = user["id_user"]
+    checker.request("get_user: usuari per id_user", "GET", f"/admin/usuari/{id_user}")
+    checker.request(
+        "update_user: username repetit",
+        "PUT",
+        f"/admin/usuari/{id_user}",
+        json={"username": "plans_doctor_2"},
+    )
+    patient_user = checker.request(
+        "create_user: usuari del pacient",
+        "POST",
+        "/admin/usuari",
+        json={"username": "plans_pacient", "password": "secret", "role": "secretaria"},
+    )
+    id_patient_user = patient_user["id_user"]
+
+    # Pacients i doctors: alta amb usuari existent (per id_user) o nou (per
+    # username) i baixa (usuari associat per id_user)
+    doctor = checker.request(
+        "create_doctor: doctor per id_user",
+        "POST",
+        "/admin/doctors",
+        json={"name": "Plans", "specialty": "Cardiologia", "id_user": id_user},
+    )
+    patient = checker.request(
+        "create_patient: pacient per id_user",
+        "POST",
+        "/admin/pacients",
+        json={"name": "Plans", "status": "ACTIU", "id_user": id_patient_user},
+    )
+    new_doctor = checker.request(
+        "create_doctor: username repetit",
+        "POST",
+        "/admin/doctors",
+        json={
+            "name": "Plans 2",
+            "specialty": "Pediatria",
+            "username": "plans_metge_3",
+            "password": "secret",
+        },
+    )
+    new_patient = checker.request(
+        "create_patient: username repetit",
+        "POST",
+        "/admin/pacients",
+        json={
+            "name": "Plans 2",
+            "status": "ACTIU",
+            "username": "plans_pacient_2",
+            "password": "secret",
+        },
+    )
+    for name, path, item in (
+        ("delete_doctor", "/admin/doctors", doctor),
+        ("delete_doctor", "/admin/doctors", new_doctor),
+        ("delete_patient", "/admin/pacients", patient),
+        ("delete_patient", "/admin/pacients", new_patient),
+    ):
+        key = "id_doctor" if "doctor" in name else "id_patient"
+        checker.request(
+            f"{name}: usuari associat per id_user", "DELETE", f"{path}/{item[key]}"
+        )
+
+    checked = login.checked + checker.checked
+    failures = login.failures + checker.failures
+    print()
+    print(f"Peticions comprovades: {checked}, errors: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
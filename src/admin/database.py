@@ -1,19 +1,40 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from werkzeug.security import generate_password_hash
 from models import Base, User, RoleEnum
+from search import init_search_index
+from changes import backfill_changes
+from versioning import init_table_versions
+from metrics import engine_options, instrument_engine
+from slowlog import instrument_slow_queries
+from querybudget import count_queries
 
 # Configuració de la base de dades
 DATABASE_PATH = os.getenv("DATABASE_PATH", "/app/data/auth.db")
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
-# Crear engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=True,  # Canvia a False en producció
-)
+# Versió de l'esquema (es desa a PRAGMA user_version). Cal incrementar-la
+# quan es modifiquen els models, els índexs de cerca o els triggers.
+SCHEMA_VERSION = 2
+
+
+def create_database_engine(url, echo=False):
+    """Crea l'engine d'una base de dades SQLite amb les mètriques activades"""
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        echo=echo,
+        **engine_options(url),
+    )
+    instrument_engine(new_engine)
+    instrument_slow_queries(new_engine)
+    count_queries(new_engine)
+    return new_engine
+
+
+# Crear engine (no es connecta fins a la primera consulta)
+engine = create_database_engine(DATABASE_URL, os.getenv("SQL_ECHO", "0") == "1")
 
 # Crear session factory
 SessionLocal = scoped_session(
@@ -21,19 +42,77 @@ SessionLocal = scoped_session(
 )
 
 
+def configure_engine(path=None, echo=None):
+    """
+    Aplica la configuració de l'aplicació: torna a crear l'engine si canvia
+    la ruta de la base de dades i activa o desactiva el registre de SQL.
+    """
+    global engine, DATABASE_PATH, DATABASE_URL
+    if path and path != DATABASE_PATH:
+        engine.dispose()
+        DATABASE_PATH = path
+        DATABASE_URL = f"sqlite:///{path}"
+        engine = create_database_engine(DATABASE_URL)
+        SessionLocal.remove()
+        SessionLocal.configure(bind=engine)
+    if echo is not None:
+        engine.echo = echo
+
+
+def schema_version(bind):
+    """Retorna la versió de l'esquema desada a la base de dades"""
+    with bind.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate_indexes(bind):
+    """
+    Crea els índexs dels models que no existeixen a les bases de dades creades
+    abans que es definissin (create_all només els crea amb les taules noves).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
 def init_db():
-    """Inicialitza la base de dades creant totes les taules"""
+    """
+    Inicialitza la base de dades creant totes les taules i els índexs de cerca.
+
+    Si la versió desada coincideix amb SCHEMA_VERSION, l'esquema ja és al dia
+    i no es fa cap comprovació.
+
+    Returns:
+        True si s'ha inicialitzat l'esquema, False si ja era al dia
+    """
+    if schema_version(engine) == SCHEMA_VERSION:
+        return False
+
     Base.metadata.create_all(bind=engine)
+    migrate_indexes(engine)
+    init_search_index(engine)
+    init_table_versions(engine, ["users", "patients", "doctors", "centers"])
+
+    # Registrar les entitats existents al feed de canvis si encara és buit
+    db = SessionLocal()
+    try:
+        backfill_changes(db)
+    finally:
+        db.close()
+
+    with engine.begin() as conn:
+        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    return True
 
 
 def create_default_admin():
     """Crea l'usuari administrador per defecte si no existeix cap usuari"""
     db = SessionLocal()
     try:
-        # Verificar si ja hi ha usuaris a la base de dades
-        user_count = db.query(User).count()
+        # Verificar si ja hi ha usuaris a la base de dades (sense comptar-los)
+        has_users = db.query(User.id_user).limit(1).first() is not None
 
-        if user_count == 0:
+        if not has_users:
             # Obtenir dades de les variables d'entorn
             admin_username = os.getenv("DEFAULT_ADMIN_USER", "admin")
             admin_password = os.getenv("DEFAULT_ADMIN_PASSWORD", "admin123")
@@ -62,7 +141,7 @@ def create_default_admin():
             )
         else:
             print(
-                f"La base de dades ja conté {user_count} usuari(s). No es crea l'usuari administrador per defecte."
+                "La base de dades ja conté usuaris. No es crea l'usuari administrador per defecte."
             )
 
     except Exception as e:
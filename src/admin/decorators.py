@@ -6,6 +6,8 @@ from functools import wraps
 import jwt
 from flask import jsonify, request
 
+from tracing import span
+
 
 def require_auth_role(*allowed_roles):
     """
@@ -43,7 +45,8 @@ def require_auth_role(*allowed_roles):
                 )
 
                 # Descodificar el token
-                payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                with span("jwt_decode"):
+                    payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
 
                 # Verificar el rol
                 user_role = payload.get("role")
@@ -0,0 +1,165 @@
+"""
+Diagnòstic de memòria del procés (worker).
+
+Permet activar i aturar tracemalloc, desar una instantània de referència i
+comparar-la amb l'estat actual, i informa dels llocs amb més memòria
+assignada, de les sessions de SQLAlchemy vives (amb la mida del seu mapa
+d'identitat) i de les memòries cau. Amb les sessions es pot distingir una
+fuita (sessions que no es tanquen i acumulen objectes) d'un pic de memòria
+per una resposta gran.
+
+Cada procés té el seu estat: les peticions s'han d'adreçar al mateix worker.
+"""
+
+import gc
+import linecache
+import os
+import threading
+import tracemalloc
+
+from sqlalchemy.orm import Session
+
+# Llocs d'assignació que es retornen per defecte i com a màxim
+MEMORY_TOP_LIMIT = int(os.getenv("MEMORY_TOP_LIMIT", "20"))
+MEMORY_TOP_MAX = 200
+
+_baseline = None
+_baseline_lock = threading.Lock()
+
+# Assignacions del mateix tracemalloc i de la importació de mòduls
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def parse_top_limit(value):
+    """
+    Valida el paràmetre limit (llocs d'assignació retornats).
+
+    Returns:
+        El límit o None si no és un enter entre 1 i MEMORY_TOP_MAX
+    """
+    if value is None:
+        return MEMORY_TOP_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    return limit if 1 <= limit <= MEMORY_TOP_MAX else None
+
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+
+def _format_stat(stat, diff=False):
+    frame = stat.traceback[0]
+    item = {
+        "file": frame.filename,
+        "line": frame.lineno,
+        "size": stat.size,
+        "count": stat.count,
+    }
+    if diff:
+        item["size_diff"] = stat.size_diff
+        item["count_diff"] = stat.count_diff
+    return item
+
+
+def rss_bytes():
+    """Memòria resident del procés (Linux) o None si no es pot llegir."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def session_stats():
+    """
+    Sessions de SQLAlchemy vives al procés, trobades pel recol·lector, amb els
+    objectes que té cadascuna al mapa d'identitat.
+    """
+    sessions = [obj for obj in gc.get_objects() if isinstance(obj, Session)]
+    sizes = sorted((len(s.identity_map) for s in sessions), reverse=True)
+    return {
+        "sessions": len(sessions),
+        "identity_map_total": sum(sizes),
+        "identity_map_largest": sizes[:10],
+        "with_pending_changes": sum(1 for s in sessions if s.new or s.dirty),
+    }
+
+
+def memory_report(caches=(), limit=MEMORY_TOP_LIMIT):
+    """Estat de la memòria: tracemalloc, sessions, memòries cau i procés."""
+    report = {
+        "pid": os.getpid(),
+        "rss_bytes": rss_bytes(),
+        "gc_counts": gc.get_count(),
+        "tracing": tracemalloc.is_tracing(),
+        "sqlalchemy": session_stats(),
+        "caches": [cache.stats() for cache in caches],
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = _take_snapshot()
+        report["traced_current_bytes"] = current
+        report["traced_peak_bytes"] = peak
+        report["top"] = [
+            _format_stat(stat) for stat in snapshot.statistics("lineno")[:limit]
+        ]
+        report["has_baseline"] = _baseline is not None
+    return report
+
+
+def start_tracing(frames=1):
+    """Activa tracemalloc (amb frames nivells de traça per assignació)."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+def stop_tracing():
+    """Atura tracemalloc i descarta la instantània de referència."""
+    global _baseline
+    with _baseline_lock:
+        _baseline = None
+    tracemalloc.stop()
+    return {"tracing": False}
+
+
+def take_baseline(limit=MEMORY_TOP_LIMIT):
+    """Desa una instantània com a referència per a diff_baseline."""
+    global _baseline
+    snapshot = _take_snapshot()
+    with _baseline_lock:
+        _baseline = snapshot
+    return {
+        "traced_bytes": sum(stat.size for stat in snapshot.statistics("filename")),
+        "top": [_format_stat(stat) for stat in snapshot.statistics("lineno")[:limit]],
+    }
+
+
+def diff_baseline(limit=MEMORY_TOP_LIMIT):
+    """
+    Compara l'estat actual amb la instantània de referència.
+
+    Returns:
+        Els llocs que més han crescut o None si no hi ha referència
+    """
+    with _baseline_lock:
+        baseline = _baseline
+    if baseline is None:
+        return None
+    stats = _take_snapshot().compare_to(baseline, "lineno")
+    return {
+        "size_diff": sum(stat.size_diff for stat in stats),
+        "top": [_format_stat(stat, diff=True) for stat in stats[:limit]],
+    }
@@ -0,0 +1,194 @@
+"""
+Claus d'idempotència (capçalera Idempotency-Key) per als endpoints de creació.
+
+La primera petició amb una clau reserva una fila a idempotency_keys, executa
+l'endpoint i hi desa la resposta (comprimida). Els reintents amb la mateixa
+clau reben la resposta desada sense tornar a executar cap validació ni cap
+escriptura. Les claus caduquen al cap d'IDEMPOTENCY_TTL segons; les
+caducades es purguen com a molt un cop cada IDEMPOTENCY_PURGE_INTERVAL segons
+per procés, i mentrestant es reemplacen quan es torna a fer servir la clau.
+"""
+
+import datetime
+import hashlib
+import os
+import threading
+import time
+import zlib
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+import database
+from models import IdempotencyKey
+
+# Segons que es conserva la resposta d'una clau
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Segons que una clau queda reservada si el procés cau abans de respondre
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+# Segons entre dues purgues de les claus caducades (a cada procés)
+IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "300"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Intents de reservar una clau que entra en conflicte amb una fila que
+# desapareix o caduca entremig
+IDEMPOTENCY_CLAIM_ATTEMPTS = 3
+
+_last_purge = None
+_purge_lock = threading.Lock()
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def _purge_expired(db, now):
+    """Elimina les claus caducades si fa prou que no es purguen."""
+    global _last_purge
+    with _purge_lock:
+        current = time.monotonic()
+        if (
+            _last_purge is not None
+            and current - _last_purge < IDEMPOTENCY_PURGE_INTERVAL
+        ):
+            return
+        _last_purge = current
+    db.query(IdempotencyKey).filter(IdempotencyKey.expires_at < now).delete(
+        synchronize_session=False
+    )
+    db.commit()
+
+
+def _claim(db, key, fingerprint):
+    """
+    Reserva la clau. Retorna None si s'ha reservat o la fila existent si ja
+    hi era.
+
+    Si la fila que ha provocat el conflicte ha caducat, s'elimina i es torna a
+    provar; si ha desaparegut entremig (la primera petició ha fallat), també.
+    Si després de IDEMPOTENCY_CLAIM_ATTEMPTS intents no s'ha pogut reservar ni
+    llegir, es retorna una fila sense resposta, que es tracta com una petició
+    encara en curs (409).
+    """
+    now = datetime.datetime.utcnow()
+    _purge_expired(db, now)
+    for _ in range(IDEMPOTENCY_CLAIM_ATTEMPTS):
+        db.add(
+            IdempotencyKey(
+                key=key,
+                fingerprint=fingerprint,
+                expires_at=now + datetime.timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT),
+            )
+        )
+        try:
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+        existing = db.get(IdempotencyKey, key)
+        if existing is None:
+            continue
+        if existing.expires_at >= now:
+            return existing
+        # Clau caducada encara no purgada: només s'elimina si cap altra
+        # petició l'ha reemplaçada entremig
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.key == key, IdempotencyKey.expires_at < now
+        ).delete(synchronize_session=False)
+        db.commit()
+        db.expunge(existing)
+    return IdempotencyKey(key=key, fingerprint=fingerprint, status_code=None)
+
+
+def _replay(row):
+    response = Response(
+        zlib.decompress(row.body), status=row.status_code, mimetype="application/json"
+    )
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(f):
+    """
+    Decorador que fa idempotent un endpoint POST quan la petició porta la
+    capçalera Idempotency-Key.
+
+    S'ha d'aplicar després de require_auth_role: les claus són per usuari.
+    Respostes:
+        - La resposta original (amb Idempotent-Replayed: true) si la clau ja
+          s'ha fet servir amb el mateix cos
+        - 422 si la clau ja s'ha fet servir amb un cos diferent
+        - 409 si la primera petició amb la clau encara s'està processant
+    Les respostes 5xx no es desen, perquè el client pugui tornar-ho a provar.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        header = request.headers.get("Idempotency-Key")
+        if not header:
+            return f(*args, **kwargs)
+        if len(header) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return (
+                jsonify(
+                    {
+                        "error": f"La clau d'idempotència no pot superar {IDEMPOTENCY_KEY_MAX_LENGTH} caràcters"
+                    }
+                ),
+                400,
+            )
+
+        user = getattr(request, "user", {})
+        owner = user.get("id_user") or user.get("username")
+        key = _digest(f"{owner}|{request.method}|{request.path}|{header}")
+        fingerprint = hashlib.sha1(request.get_data()).hexdigest()
+
+        db = database.SessionLocal()
+        try:
+            existing = _claim(db, key, fingerprint)
+            if existing is not None:
+                if existing.fingerprint != fingerprint:
+                    return (
+                        jsonify(
+                            {
+                                "error": "La clau d'idempotència ja s'ha utilitzat amb una petició diferent"
+                            }
+                        ),
+                        422,
+                    )
+                if existing.status_code is None:
+                    return (
+                        jsonify(
+                            {
+                                "error": "La petició amb aquesta clau d'idempotència encara s'està processant"
+                            }
+                        ),
+                        409,
+                    )
+                return _replay(existing)
+
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                db.query(IdempotencyKey).filter(IdempotencyKey.key == key).delete()
+                db.commit()
+                raise
+
+            # La sessió és la mateixa que la de l'endpoint (scoped_session), que
+            # ja l'ha tancada: la fila es torna a llegir
+            row = db.get(IdempotencyKey, key)
+            if row is None:
+                return response
+            if response.status_code >= 500:
+                db.delete(row)
+            else:
+                row.status_code = response.status_code
+                row.body = zlib.compress(response.get_data())
+                row.expires_at = datetime.datetime.utcnow() + datetime.timedelta(
+                    seconds=IDEMPOTENCY_TTL
+                )
+            db.commit()
+            return response
+        finally:
+            db.close()
+
+    return decorated_function
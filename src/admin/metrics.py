@@ -0,0 +1,373 @@
+"""
+Mètriques del servei en format de text de Prometheus (endpoint /metrics).
+
+Es recullen sense dependències externes:
+    - Peticions i latència per ruta (comptador i histograma), i peticions en curs
+    - Consultes SQL i temps de base de dades per petició
+    - Connexions obtingudes del pool i temps d'espera per obtenir-les
+    - Encerts, errades i mida de les memòries cau
+
+Cada procés (worker) té els seus comptadors: Prometheus els ha de recollir de
+cada procés o sumar-los amb les etiquetes de la instància.
+"""
+
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Límits (en segons) dels histogrames de latència
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Família de mètriques amb un valor per combinació d'etiquetes."""
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """Retorna les mostres (nom, etiquetes, valor) de la família."""
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [comptadors per límit (no acumulats), suma, recompte]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(
+                        (
+                            f"{self.name}_bucket",
+                            key + (("le", _format_value(float(bound))),),
+                            cumulative,
+                        )
+                    )
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Family:
+    """Mètrica calculada per un col·lector, amb les mostres ja preparades."""
+
+    def __init__(self, name, metric_type, documentation, samples):
+        self.name = name
+        self.type = metric_type
+        self.documentation = documentation
+        self._samples = samples
+
+    def samples(self):
+        return self._samples
+
+
+class Registry:
+    """Conjunt de mètriques i de col·lectors que es llegeixen a cada consulta."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name, collector):
+        """
+        Afegeix (o substitueix) una funció que retorna mètriques calculades en
+        el moment de la consulta (per exemple, la mida d'una memòria cau).
+        """
+        self._collectors[name] = collector
+
+    def render(self):
+        """Retorna totes les mètriques en format de text de Prometheus."""
+        metrics = list(self._metrics)
+        for collector in list(self._collectors.values()):
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "Peticions HTTP ateses",
+        ("method", "endpoint", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Temps de resposta de les peticions HTTP",
+        ("method", "endpoint"),
+    )
+)
+http_in_flight = registry.register(
+    Gauge("http_requests_in_flight", "Peticions HTTP en curs")
+)
+http_request_queries = registry.register(
+    Histogram(
+        "http_request_db_queries",
+        "Consultes SQL executades per petició (al fil de la petició)",
+        ("endpoint",),
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+)
+http_request_db_duration = registry.register(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Temps de base de dades per petició (al fil de la petició)",
+        ("endpoint",),
+    )
+)
+db_queries = registry.register(
+    Counter("db_queries_total", "Consultes SQL executades", ("database",))
+)
+db_query_duration = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Temps d'execució de les consultes SQL",
+        ("database",),
+        buckets=QUERY_BUCKETS,
+    )
+)
+db_pool_checkouts = registry.register(
+    Counter("db_pool_checkouts_total", "Connexions obtingudes del pool", ("database",))
+)
+db_pool_wait = registry.register(
+    Histogram(
+        "db_pool_wait_seconds",
+        "Temps d'espera per obtenir una connexió del pool",
+        ("database",),
+        buckets=QUERY_BUCKETS,
+    )
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mesura el temps d'espera per obtenir cada connexió."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(
+                time.perf_counter() - start, database=self.logging_name or ""
+            )
+
+
+def _database_name(url):
+    """Nom curt d'una base de dades SQLite (el nom del fitxer sense extensió)."""
+    return os.path.splitext(os.path.basename(make_url(url).database or ""))[0]
+
+
+def instrument_engine(engine):
+    """Compta les consultes, el temps de base de dades i les connexions d'un engine."""
+    name = _database_name(engine.url)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        db_queries.inc(database=name)
+        db_query_duration.observe(elapsed, database=name)
+        if has_request_context() and "metrics_queries" in g:
+            g.metrics_queries += 1
+            g.metrics_db_time += elapsed
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checkouts.inc(database=name)
+
+
+def engine_options(url):
+    """Opcions de create_engine perquè el pool mesuri el temps d'espera."""
+    return {"poolclass": TimedQueuePool, "pool_logging_name": _database_name(url)}
+
+
+def cache_collector(caches):
+    """Crea un col·lector amb les estadístiques d'unes memòries cau (TTLCache)."""
+
+    def collect():
+        stats = [cache.stats() for cache in caches]
+
+        def family(name, metric_type, documentation, field):
+            return Family(
+                name,
+                metric_type,
+                documentation,
+                [(name, (("cache", s["name"]),), s[field]) for s in stats],
+            )
+
+        return [
+            family("cache_hits_total", "counter", "Encerts de la memòria cau", "hits"),
+            family(
+                "cache_misses_total", "counter", "Errades de la memòria cau", "misses"
+            ),
+            family(
+                "cache_evictions_total",
+                "counter",
+                "Entrades expulsades per mida",
+                "evictions",
+            ),
+            family("cache_size", "gauge", "Entrades desades a la memòria cau", "size"),
+            family(
+                "cache_hit_ratio",
+                "gauge",
+                "Proporció d'encerts de la memòria cau",
+                "hit_rate",
+            ),
+        ]
+
+    return collect
+
+
+def _endpoint():
+    return request.endpoint or "unmatched"
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_db_time = 0.0
+    http_in_flight.inc()
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    if "metrics_start" not in g:
+        return
+    endpoint = _endpoint()
+    elapsed = time.perf_counter() - g.metrics_start
+    http_in_flight.dec()
+    http_requests.inc(
+        method=request.method,
+        endpoint=endpoint,
+        status=g.get("metrics_status", 500),
+    )
+    http_request_duration.observe(elapsed, method=request.method, endpoint=endpoint)
+    http_request_queries.observe(g.metrics_queries, endpoint=endpoint)
+    http_request_db_duration.observe(g.metrics_db_time, endpoint=endpoint)
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app, caches=()):
+    """
+    Activa la recollida de mètriques de les peticions i l'endpoint /metrics.
+
+    Configuració (variables d'entorn o app.config):
+        METRICS_ENABLED: 0 per desactivar-les (per defecte 1)
+    """
+    app.config.setdefault("METRICS_ENABLED", METRICS_ENABLED)
+    if not app.config["METRICS_ENABLED"]:
+        return
+    if caches:
+        registry.register_collector("caches", cache_collector(caches))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
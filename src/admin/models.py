@@ -1,4 +1,15 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    Enum,
+    ForeignKey,
+)
 from sqlalchemy.ext.declarative import declarative_base
 import enum
 
@@ -33,7 +44,7 @@ class Patient(Base):
     __tablename__ = "patients"
 
     id_patient = Column(Integer, primary_key=True, autoincrement=True)
-    id_user = Column(Integer, ForeignKey("users.id_user"), nullable=True)
+    id_user = Column(Integer, ForeignKey("users.id_user"), nullable=True, index=True)
     name = Column(String(100), nullable=False)
     phone = Column(String(20), nullable=True)
     status = Column(Enum(StatusEnum), nullable=False)
@@ -46,7 +57,7 @@ class Doctor(Base):
     __tablename__ = "doctors"
 
     id_doctor = Column(Integer, primary_key=True, autoincrement=True)
-    id_user = Column(Integer, ForeignKey("users.id_user"), nullable=True)
+    id_user = Column(Integer, ForeignKey("users.id_user"), nullable=True, index=True)
     name = Column(String(100), nullable=False)
     specialty = Column(String(100), nullable=False)
 
@@ -63,3 +74,55 @@ class Center(Base):
 
     def __repr__(self):
         return f"<Center(id_center={self.id_center}, name='{self.name}', address='{self.address}')>"
+
+
+class ChangeOpEnum(enum.Enum):
+    INSERT = "INSERT"
+    UPDATE = "UPDATE"
+    DELETE = "DELETE"
+
+
+class Change(Base):
+    """Registre de canvis de pacients, doctors i centres per a la sincronització incremental."""
+
+    __tablename__ = "changes"
+    # AUTOINCREMENT garanteix que seq no es reutilitza mai, encara que s'eliminin files
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(Enum(ChangeOpEnum), nullable=False)
+    data = Column(Text, nullable=True)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Change(seq={self.seq}, entity='{self.entity}', entity_id={self.entity_id}, op='{self.op.value}')>"
+
+
+class TableVersion(Base):
+    """Comptador de versions d'una taula, incrementat per triggers a cada escriptura."""
+
+    __tablename__ = "table_versions"
+
+    table_name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """Resposta desada d'una petició amb capçalera Idempotency-Key."""
+
+    __tablename__ = "idempotency_keys"
+
+    # Resum SHA-1 de l'usuari, l'endpoint i la clau enviada pel client
+    key = Column(String(40), primary_key=True)
+    # Resum SHA-1 del cos de la petició, per detectar reutilitzacions de la clau
+    fingerprint = Column(String(40), nullable=False)
+    # NULL mentre la primera petició encara s'està processant
+    status_code = Column(Integer, nullable=True)
+    # Cos de la resposta comprimit amb zlib
+    body = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key='{self.key}', status_code={self.status_code})>"
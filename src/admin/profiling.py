@@ -0,0 +1,111 @@
+"""
+Perfilat (cProfile) de peticions concretes en producció.
+
+Amb PROFILE_ENABLED=1 es perfilen les peticions que porten la capçalera
+X-Profile amb el valor de PROFILE_TOKEN i, a més, una proporció aleatòria
+(PROFILE_SAMPLE_RATE) de la resta. Per a cada petició perfilada es desen a
+PROFILE_DIR:
+    - <nom>.prof: estadístiques de cProfile (per a snakeviz, flameprof,
+      gprof2dot o pstats)
+    - <nom>.txt: resum de les funcions amb més temps acumulat
+
+El nom del fitxer es retorna a la capçalera X-Profile-Id de la resposta. Per
+procés només es perfila una petició alhora; les altres s'atenen sense perfilar.
+
+Configuració (variables d'entorn o app.config):
+    PROFILE_ENABLED: 1 per activar el perfilat (per defecte 0)
+    PROFILE_TOKEN: valor de la capçalera X-Profile (buit: només per mostreig)
+    PROFILE_SAMPLE_RATE: proporció de peticions perfilades, de 0 a 1 (per
+        defecte 0)
+    PROFILE_DIR: directori on es desen els perfils
+    PROFILE_TOP: funcions del resum (per defecte 30)
+"""
+
+import cProfile
+import datetime
+import hmac
+import io
+import os
+import pstats
+import random
+import tempfile
+import threading
+
+from flask import current_app, g, request
+
+PROFILE_HEADER = "X-Profile"
+
+# cProfile no admet dos perfiladors actius alhora en totes les versions
+_profile_lock = threading.Lock()
+
+
+def _requested():
+    config = current_app.config
+    token = config["PROFILE_TOKEN"]
+    header = request.headers.get(PROFILE_HEADER)
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+    return random.random() < config["PROFILE_SAMPLE_RATE"]
+
+
+def _before_request():
+    if not current_app.config["PROFILE_ENABLED"] or not _requested():
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    endpoint = (request.endpoint or "unmatched").replace(".", "_")
+    g.profile_name = f"{timestamp}_{endpoint}"
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def _after_request(response):
+    if "profile_name" in g:
+        response.headers["X-Profile-Id"] = g.profile_name
+    return response
+
+
+def _teardown_request(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    profiler.disable()
+    _profile_lock.release()
+    try:
+        write_profile(profiler, g.profile_name)
+    except OSError as e:
+        print(f"Error en desar el perfil {g.profile_name}: {e}")
+
+
+def write_profile(profiler, name):
+    """Desa les estadístiques i el resum d'un perfil a PROFILE_DIR."""
+    config = current_app.config
+    directory = config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    profiler.dump_stats(f"{path}.prof")
+
+    summary = io.StringIO()
+    summary.write(f"{request.method} {request.full_path}\n\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats("cumulative").print_stats(config["PROFILE_TOP"])
+    with open(f"{path}.txt", "w", encoding="utf-8") as f:
+        f.write(summary.getvalue())
+
+
+def init_profiling(app):
+    """Activa el perfilat de peticions segons la configuració."""
+    app.config.setdefault("PROFILE_ENABLED", os.getenv("PROFILE_ENABLED", "0") == "1")
+    app.config.setdefault("PROFILE_TOKEN", os.getenv("PROFILE_TOKEN", ""))
+    app.config.setdefault(
+        "PROFILE_SAMPLE_RATE", float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    )
+    app.config.setdefault(
+        "PROFILE_DIR",
+        os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles")),
+    )
+    app.config.setdefault("PROFILE_TOP", int(os.getenv("PROFILE_TOP", "30")))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,151 @@
+"""
+Pressupost de consultes SQL per ruta.
+
+Cada endpoint declara amb @query_budget(n) el nombre màxim de consultes que
+pot executar. Un patró N+1 (una consulta per element d'un llistat) o una
+seqüència de consultes que es pot agrupar fa que la ruta superi el pressupost:
+
+    warn: s'escriu un avís i la resposta porta les capçaleres X-Query-Count i
+        X-Query-Budget (per a proves i staging)
+    enforce: a més, la resposta de les peticions de lectura (GET, HEAD,
+        OPTIONS) es substitueix per un error 500, de manera que la prova o la
+        petició de staging falla. Les escriptures ja s'han confirmat quan es
+        comprova el pressupost: la seva resposta no es substitueix (el client
+        la repetiria i, amb una clau d'idempotència, ja s'hauria desat), només
+        s'escriu l'avís
+    off: no es compta res (per defecte)
+
+Es compten les consultes del fil de la petició i les de les operacions que
+altres fils (la cua d'escriptura) executen per compte seu amb counting_into.
+
+Configuració (variables d'entorn o app.config):
+    QUERY_BUDGET_MODE: off, warn o enforce
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+QUERY_BUDGET_MODES = ("off", "warn", "enforce")
+# Mètodes les respostes dels quals es poden substituir en mode enforce
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Comptador de la petició per a la qual treballa el fil actual (si no és el
+# fil de la petició)
+_delegated = threading.local()
+
+
+def query_budget(limit):
+    """
+    Decorador que declara el nombre màxim de consultes SQL d'un endpoint.
+
+    S'aplica just després de la ruta; la resta de decoradors (amb wraps)
+    conserven l'atribut. Amb limit=None es declara explícitament que la ruta
+    no té pressupost: les consultes es compten però no es comproven. limit
+    també pot ser una funció sense arguments que el calcula al final de la
+    petició, per a les rutes que fan una consulta per shard o per partició.
+    """
+
+    def decorator(f):
+        f.query_budget = limit
+        return f
+
+    return decorator
+
+
+def count_queries(engine):
+    """Compta les consultes d'un engine a la petició en curs."""
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if has_request_context() and "query_count" in g:
+            g.query_count += 1
+        elif getattr(_delegated, "counter", None) is not None:
+            _delegated.counter[0] += 1
+
+
+def request_counter():
+    """
+    Comptador per a les consultes que un altre fil farà per compte de la
+    petició en curs, o None si no s'estan comptant.
+    """
+    if has_request_context() and "query_count" in g:
+        return [0]
+    return None
+
+
+@contextmanager
+def counting_into(counter):
+    """Compta al comptador d'una petició les consultes del fil actual."""
+    _delegated.counter = counter
+    try:
+        yield
+    finally:
+        _delegated.counter = None
+
+
+def add_queries(counter):
+    """Suma a la petició en curs les consultes d'un comptador de request_counter."""
+    if counter is not None and has_request_context() and "query_count" in g:
+        g.query_count += counter[0]
+
+
+def route_budget(endpoint):
+    """Pressupost declarat d'un endpoint o None si no en té."""
+    view = current_app.view_functions.get(endpoint)
+    budget = getattr(view, "query_budget", None)
+    return budget() if callable(budget) else budget
+
+
+def missing_budgets(app):
+    """Endpoints dels blueprints que no declaren cap pressupost."""
+    return sorted(
+        endpoint
+        for endpoint, view in app.view_functions.items()
+        if "." in endpoint and not hasattr(view, "query_budget")
+    )
+
+
+def _before_request():
+    if current_app.config["QUERY_BUDGET_MODE"] != "off":
+        g.query_count = 0
+
+
+def _after_request(response):
+    if "query_count" not in g or request.endpoint is None:
+        return response
+    count = g.query_count
+    budget = route_budget(request.endpoint)
+    response.headers["X-Query-Count"] = str(count)
+    if budget is None:
+        return response
+    response.headers["X-Query-Budget"] = str(budget)
+    if count <= budget:
+        return response
+
+    message = (
+        f"{request.method} {request.path} ({request.endpoint}) ha executat "
+        f"{count} consultes SQL; el pressupost és {budget}"
+    )
+    print(f"Pressupost de consultes superat: {message}")
+    if current_app.config["QUERY_BUDGET_MODE"] != "enforce":
+        return response
+    if request.method not in SAFE_METHODS:
+        return response
+    error = jsonify({"error": f"Pressupost de consultes superat: {message}"})
+    error.status_code = 500
+    error.headers["X-Query-Count"] = str(count)
+    error.headers["X-Query-Budget"] = str(budget)
+    return error
+
+
+def init_query_budget(app):
+    """Activa la comprovació dels pressupostos segons QUERY_BUDGET_MODE."""
+    app.config.setdefault("QUERY_BUDGET_MODE", os.getenv("QUERY_BUDGET_MODE", "off"))
+    if app.config["QUERY_BUDGET_MODE"] not in QUERY_BUDGET_MODES:
+        raise ValueError(f"QUERY_BUDGET_MODE ha de ser {', '.join(QUERY_BUDGET_MODES)}")
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,116 @@
+"""Mòdul de cerca de text complet de pacients i doctors amb SQLite FTS5."""
+
+import os
+
+from sqlalchemy import text
+
+# Nombre de resultats per defecte i màxim que retorna una cerca
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+
+# El tokenitzador trigram permet cercar qualsevol subcadena (parts del nom o
+# del telèfon), però només troba termes d'almenys 3 caràcters
+MIN_TERM_LENGTH = 3
+
+# Taules virtuals FTS5 de contingut extern: l'índex no duplica les dades, que
+# continuen a les taules patients i doctors
+FTS_TABLES = {
+    "patients_fts": {
+        "content": "patients",
+        "rowid": "id_patient",
+        "columns": ["name", "phone"],
+    },
+    "doctors_fts": {
+        "content": "doctors",
+        "rowid": "id_doctor",
+        "columns": ["name", "specialty"],
+    },
+}
+
+
+def _fts_ddl(fts_table, content, rowid, columns):
+    """Genera les sentències per crear la taula FTS5 i els triggers de sincronització."""
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{cols}, content='{content}', content_rowid='{rowid}', "
+        f"tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {content} "
+        f"BEGIN INSERT INTO {fts_table}(rowid, {cols}) "
+        f"VALUES (new.{rowid}, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {content} "
+        f"BEGIN INSERT INTO {fts_table}({fts_table}, rowid, {cols}) "
+        f"VALUES ('delete', old.{rowid}, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {content} "
+        f"BEGIN INSERT INTO {fts_table}({fts_table}, rowid, {cols}) "
+        f"VALUES ('delete', old.{rowid}, {old_values}); "
+        f"INSERT INTO {fts_table}(rowid, {cols}) "
+        f"VALUES (new.{rowid}, {new_values}); END",
+    ]
+
+
+def init_search_index(engine):
+    """
+    Crea els índexs FTS5 i els triggers que els mantenen sincronitzats.
+
+    Si l'índex no existia, es reconstrueix a partir de les files actuals perquè
+    les bases de dades creades abans de la cerca també tinguin els registres
+    indexats.
+    """
+    with engine.begin() as conn:
+        for fts_table, spec in FTS_TABLES.items():
+            exists = conn.execute(
+                text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ),
+                {"name": fts_table},
+            ).first()
+            for statement in _fts_ddl(fts_table, **spec):
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(
+                    text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+                )
+
+
+def build_match_query(q):
+    """
+    Converteix el text introduït per l'usuari en una consulta MATCH segura.
+
+    Cada terme es cita com a frase perquè els caràcters especials de FTS5
+    (cometes, asteriscs, operadors) no es puguin interpretar. Els termes es
+    combinen amb AND implícit. Retorna None si no hi ha cap terme cercable.
+    """
+    terms = [t for t in (q or "").split() if len(t) >= MIN_TERM_LENGTH]
+    if not terms:
+        return None
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def parse_limit(value):
+    """Valida el paràmetre limit i el restringeix a SEARCH_MAX_LIMIT."""
+    if value is None or value == "":
+        return SEARCH_DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("El paràmetre 'limit' ha de ser positiu")
+    return min(limit, SEARCH_MAX_LIMIT)
+
+
+def search_statement(fts_table):
+    """
+    Retorna la consulta que cerca a la taula FTS5 i uneix les files originals.
+
+    El resultat s'ordena per rellevància (bm25) i es limita a :limit files.
+    """
+    spec = FTS_TABLES[fts_table]
+    content = spec["content"]
+    rowid = spec["rowid"]
+    return text(
+        f"SELECT {content}.* FROM {fts_table} "
+        f"JOIN {content} ON {content}.{rowid} = {fts_table}.rowid "
+        f"WHERE {fts_table} MATCH :match "
+        f"ORDER BY {fts_table}.rank LIMIT :limit"
+    )
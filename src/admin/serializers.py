@@ -0,0 +1,30 @@
+"""Funcions de serialització de les entitats d'administració a JSON."""
+
+from models import Center, Doctor, Patient
+
+
+def serialize_patient(patient: Patient):
+    return {
+        "id_patient": patient.id_patient,
+        "id_user": patient.id_user,
+        "name": patient.name,
+        "phone": patient.phone,
+        "status": patient.status.value,
+    }
+
+
+def serialize_doctor(doctor: Doctor):
+    return {
+        "id_doctor": doctor.id_doctor,
+        "id_user": doctor.id_user,
+        "name": doctor.name,
+        "specialty": doctor.specialty,
+    }
+
+
+def serialize_center(center: Center):
+    return {
+        "id_center": center.id_center,
+        "name": center.name,
+        "address": center.address,
+    }
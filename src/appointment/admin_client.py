@@ -0,0 +1,88 @@
+"""Client HTTP per a les crides del servei de cites al servei admin."""
+
+import datetime
+import os
+import re
+import time
+
+import jwt
+import requests
+
+from metrics import Histogram, registry
+from tracing import REQUEST_ID_HEADER, current_request_id, span
+
+ADMIN_HOST = os.getenv("ADMIN_HOST", "localhost")
+ADMIN_PORT = os.getenv("ADMIN_PORT", "5002")
+ADMIN_TIMEOUT = float(os.getenv("ADMIN_TIMEOUT", "5"))
+
+admin_request_duration = registry.register(
+    Histogram(
+        "admin_request_duration_seconds",
+        "Temps de resposta de les crides al servei admin",
+        ("path", "status"),
+    )
+)
+
+# Identitat amb què el servei de cites s'autentica en les tasques en segon pla
+SERVICE_USERNAME = "appointment-service"
+
+
+def admin_url(path: str):
+    """Construeix l'URL absoluta d'un endpoint del servei admin."""
+    return f"http://{ADMIN_HOST}:{ADMIN_PORT}{path}"
+
+
+def get(path: str, auth_header: str, params=None):
+    """
+    Fa una petició GET al servei admin amb la capçalera d'autorització donada.
+
+    Args:
+        path: Camí de l'endpoint (ex: '/admin/pacients/1')
+        auth_header: Valor de la capçalera Authorization ("Bearer <token>")
+        params: Paràmetres de consulta opcionals
+
+    Returns:
+        L'objecte resposta de requests
+    """
+    headers = {"Authorization": auth_header}
+    # El servei admin fa servir el mateix identificador de petició als seus trams
+    request_id = current_request_id()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+
+    # Els identificadors no formen part de l'etiqueta (ex: /admin/pacients/:id)
+    label = re.sub(r"/\d+", "/:id", path)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with span("admin_call", path=path):
+            resp = requests.get(
+                admin_url(path),
+                headers=headers,
+                params=params,
+                timeout=ADMIN_TIMEOUT,
+            )
+        status = resp.status_code
+        return resp
+    finally:
+        admin_request_duration.observe(
+            time.perf_counter() - start, path=label, status=status
+        )
+
+
+def service_auth_header():
+    """
+    Genera una capçalera d'autorització de servei de curta durada.
+
+    Els dos serveis comparteixen SECRET_KEY, de manera que el servei de cites
+    pot signar un token propi per a les tasques que no tenen cap petició
+    d'usuari associada (per exemple, la sincronització en segon pla).
+    """
+    secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+    payload = {
+        "id_user": 0,
+        "username": SERVICE_USERNAME,
+        "role": "admin",
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
+    }
+    return f"Bearer {jwt.encode(payload, secret_key, algorithm='HS256')}"
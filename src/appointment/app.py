@@ -1,25 +1,79 @@
 import os
 from flask import Flask
 from flask_cors import CORS
+from sqlalchemy.orm import configure_mappers
+from compression import init_compression
+from metrics import init_metrics
+from tracing import init_tracing
+from profiling import init_profiling
+from querybudget import init_query_budget, missing_budgets
+from cache import CACHES
 from cites_bp import cites_bp
-from database import init_db
+from config import get_config
+import database
+from sync import start_sync_worker
+from archive import start_archive_worker
 
-app = Flask(__name__)
-CORS(app)
 
-# Inicialitzar BD
-with app.app_context():
-    init_db()
+def create_app(config=None):
+    """
+    Crea l'aplicació amb un perfil de configuració (development, production,
+    testing o una classe de configuració).
 
-# Registrar blueprint
-app.register_blueprint(cites_bp, url_prefix="/cites")
+    Importar el mòdul no toca la base de dades ni inicia cap fil: l'esquema es
+    comprova aquí, i només si la versió desada no coincideix amb la dels
+    models.
+    """
+    config = get_config(config)
+    app = Flask(__name__)
+    app.config.from_object(config)
+    CORS(app)
 
+    # Comprimir les respostes grans (brotli/gzip) segons Accept-Encoding
+    init_compression(app)
 
-@app.route("/")
-def hello():
-    return {"message": "Appointment Service API", "status": "running"}
+    # Mètriques de peticions, base de dades i memòries cau a /metrics
+    init_metrics(app, caches=CACHES)
+
+    # Identificador de correlació (X-Request-ID) i trams de temps de les peticions
+    init_tracing(app, "appointment")
+
+    # Perfilat amb cProfile de les peticions seleccionades (PROFILE_ENABLED)
+    init_profiling(app)
+
+    # Pressupost de consultes SQL per ruta (QUERY_BUDGET_MODE)
+    init_query_budget(app)
+
+    # Configurar els mappers ara i no a la primera petició
+    configure_mappers()
+
+    # Inicialitzar BD
+    database.configure_engine(config.DATABASE_PATH, config.SQL_ECHO)
+    with app.app_context():
+        database.init_db()
+
+    if config.START_WORKERS:
+        # Mantenir al dia el model de lectura local de pacients, doctors i centres
+        start_sync_worker(app.config["TRACE_FILE"])
+
+        # Moure periòdicament les cites antigues i cancel·lades a l'arxiu
+        start_archive_worker()
+
+    # Registrar blueprint
+    app.register_blueprint(cites_bp, url_prefix="/cites")
+
+    if app.config["QUERY_BUDGET_MODE"] != "off":
+        for endpoint in missing_budgets(app):
+            print(f"L'endpoint {endpoint} no declara cap pressupost de consultes")
+
+    @app.route("/")
+    def hello():
+        return {"message": "Appointment Service API", "status": "running"}
+
+    return app
 
 
 if __name__ == "__main__":
+    app = create_app()
     port = int(os.getenv("PORT", 5001))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=app.config["DEBUG"])
@@ -0,0 +1,137 @@
+"""
+Arxivament en segon pla de les cites antigues i cancel·lades.
+
+Les cites amb data anterior a l'horitzó configurat (i les cancel·lades, amb
+un horitzó més curt) es mouen per lots de les particions mensuals actuals a
+les de l'arxiu (vegeu partitions.py). Així les particions actuals, els seus
+índexs i les comprovacions de conflictes només treballen amb les cites
+recents, encara que es conservin anys d'històric. Els llistats poden incloure
+l'arxiu amb el paràmetre include_archived.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+from sqlalchemy import DateTime, and_, delete, insert, literal, or_, select
+
+from models import Appointment, AppointmentStatusEnum
+from partitions import (
+    active_tables_between,
+    ensure_partition,
+    partition_name,
+    refresh_partitions,
+)
+from shards import shards
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+# Dies que es conserven a les particions actuals les cites passades i les cancel·lades
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+ARCHIVE_CANCELLED_HORIZON_DAYS = int(os.getenv("ARCHIVE_CANCELLED_HORIZON_DAYS", "30"))
+# Cites per lot (cada lot és una transacció curta a la cua d'escriptura)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Segons entre execucions del procés d'arxivament
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def archive_batch(conn, now, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Mou un lot de cites a l'arxiu. S'executa al fil escriptor.
+
+    Només es consulten les particions actuals dels mesos fins a l'horitzó de
+    les cites cancel·lades (el més recent).
+
+    Returns:
+        Llista d'identificadors de les cites arxivades
+    """
+    cutoff = now - datetime.timedelta(days=ARCHIVE_HORIZON_DAYS)
+    cancelled_cutoff = now - datetime.timedelta(days=ARCHIVE_CANCELLED_HORIZON_DAYS)
+    archived = []
+    for table in active_tables_between(conn, None, max(cutoff, cancelled_cutoff)):
+        rows = conn.execute(
+            select(table.c.id_appointment, table.c.date)
+            .where(
+                or_(
+                    table.c.date < cutoff,
+                    and_(
+                        table.c.status == AppointmentStatusEnum.CANCELLED,
+                        table.c.date < cancelled_cutoff,
+                    ),
+                ),
+            )
+            .order_by(table.c.id_appointment)
+            .limit(batch_size - len(archived))
+        ).all()
+        if not rows:
+            continue
+
+        # Cada cita va a la partició de l'arxiu del mes de la seva data
+        by_partition = {}
+        for id_appointment, date in rows:
+            by_partition.setdefault(partition_name(date), []).append(id_appointment)
+
+        columns = [c.name for c in Appointment.__table__.columns]
+        for name, ids in by_partition.items():
+            archive = ensure_partition(conn, name)
+            conn.execute(
+                insert(archive).from_select(
+                    [archive.c[column] for column in columns] + [archive.c.archived_at],
+                    select(
+                        *[table.c[column] for column in columns],
+                        literal(now, DateTime),
+                    ).where(table.c.id_appointment.in_(ids)),
+                )
+            )
+        ids = [id_appointment for id_appointment, _ in rows]
+        conn.execute(delete(table).where(table.c.id_appointment.in_(ids)))
+        archived.extend(ids)
+        if len(archived) == batch_size:
+            break
+    return archived
+
+
+def archive_once(now=None):
+    """
+    Arxiva per lots, a cada shard, totes les cites que han superat l'horitzó.
+
+    Returns:
+        Nombre de cites arxivades
+    """
+    now = now or datetime.datetime.now()
+    total = 0
+    for shard in shards():
+        while True:
+            ids = shard.write_queue.submit(lambda conn: archive_batch(conn, now))
+            if ids:
+                with shard.engine.connect() as conn:
+                    refresh_partitions(conn)
+            total += len(ids)
+            if len(ids) < ARCHIVE_BATCH_SIZE:
+                break
+    return total
+
+
+def _run():
+    while True:
+        try:
+            archived = archive_once()
+            if archived:
+                print(f"S'han arxivat {archived} cites")
+        except Exception as e:
+            print(f"Error en arxivar les cites: {e}")
+        time.sleep(ARCHIVE_INTERVAL)
+
+
+def start_archive_worker():
+    """Inicia (una sola vegada per procés) el fil d'arxivament en segon pla."""
+    global _worker
+    if not ARCHIVE_ENABLED:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name="archive", daemon=True)
+            _worker.start()
@@ -0,0 +1,123 @@
+"""
+Memòria cau dels resultats de list_appointments.
+
+La clau de cada entrada inclou les versions de les taules de les quals depèn
+el llistat (table_versions, vegeu versioning.py), que els triggers
+incrementen a cada escriptura de qualsevol procés. Després d'una escriptura
+les entrades anteriors deixen de ser accessibles sense haver-les d'invalidar,
+també en els altres workers.
+"""
+
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from models import AppointmentStatusEnum
+
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", "256"))
+# Les entrades obsoletes ja no es poden llegir: la caducitat només allibera
+# la memòria de les que no es tornen a consultar
+LISTING_CACHE_TTL = float(os.getenv("LISTING_CACHE_TTL", "30"))
+
+
+class TTLCache:
+    """
+    Memòria cau LRU de mida fixa, segura entre fils, on cada entrada caduca
+    després de ttl segons.
+
+    Compta encerts, errades i expulsions per a les mètriques i el diagnòstic
+    de memòria. Les claus han d'incloure tot allò de què depèn el valor
+    desat, ja que les entrades no s'invaliden.
+    """
+
+    def __init__(self, name, maxsize=LISTING_CACHE_SIZE, ttl=LISTING_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Retorna el valor desat o None si no hi és o ha caducat."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Desa un valor i expulsa l'entrada menys usada si se supera la mida."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+listing_cache = TTLCache("appointments")
+
+# Informes d'utilització ja calculats (reports.py), per rang, filtres i
+# versions de les taules de l'informe: una cita nova, cancel·lada o arxivada
+# fa que es torni a calcular
+report_cache = TTLCache(
+    "reports",
+    maxsize=int(os.getenv("REPORT_CACHE_SIZE", "32")),
+    ttl=float(os.getenv("REPORT_CACHE_TTL", "300")),
+)
+
+CACHES = [listing_cache, report_cache]
+
+
+def listing_cache_key(versions, role, args):
+    """
+    Construeix la clau de la memòria cau a partir de les versions de les
+    taules, el rol i els filtres normalitzats (dates en ISO-8601, expand
+    ordenat, paràmetres ordenats).
+
+    Returns:
+        Clau o None si algun filtre no és vàlid (la petició no es desa)
+    """
+    params = []
+    for name in sorted(set(args.keys())):
+        value = args.get(name)
+        if name in ("date_from", "date_to"):
+            try:
+                value = datetime.datetime.fromisoformat(value).isoformat()
+            except ValueError:
+                return None
+        elif name == "expand":
+            value = ",".join(sorted({v.strip() for v in value.split(",")}))
+        elif name == "status" and value not in AppointmentStatusEnum.__members__:
+            return None
+        params.append((name, value))
+    return (versions, role, tuple(params))
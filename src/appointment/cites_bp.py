@@ -1,16 +1,67 @@
 import datetime
-import os
+import heapq
+import tracemalloc
 
-import jwt
-
-from flask import Blueprint, request, jsonify
-import requests
+from flask import Blueprint, Response, g, request, jsonify
+from sqlalchemy import (
+    Integer,
+    String,
+    and_,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    union_all,
+    update,
+)
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 
+import admin_client
 from database import SessionLocal
-from models import Appointment, AppointmentStatusEnum
+from models import (
+    APPOINTMENT_SEQUENCE,
+    Appointment,
+    AppointmentStatusEnum,
+    CenterRef,
+    DoctorRef,
+    IdSequence,
+    PatientRef,
+    SLOT_SECONDS,
+    slot_for,
+)
 from decorators import require_auth_role
+from querybudget import query_budget
+from expand import EXPANDABLE, expand_items, parse_expand
+from versioning import conditional_get
+from idempotency import idempotent
+from cache import CACHES, listing_cache, listing_cache_key
+from interval_index import free_slots, interval_index, read_version
+from partitions import (
+    active_table,
+    active_table_name,
+    active_tables_between,
+    ensure_active_table,
+    locate_appointment,
+    partitions_between,
+    relocate_rows,
+    union_of,
+)
+from shards import shard_for_appointment, shard_for_center, shards, shards_for
+from reports import REPORT_RETRY_AFTER, report_worker
+from tracing import span
+from diagnostics import (
+    diff_baseline,
+    memory_report,
+    parse_top_limit,
+    start_tracing,
+    stop_tracing,
+    take_baseline,
+)
 
 cites_bp = Blueprint("cites", __name__)
 
@@ -36,8 +87,450 @@ def serialize(appointment: Appointment):
     }
 
 
+class AppointmentConflictError(Exception):
+    """La cita se solapa amb una altra cita activa del mateix doctor i centre."""
+
+
+# Marge mínim entre dues cites actives del mateix doctor i centre
+CONFLICT_WINDOW = datetime.timedelta(minutes=30)
+
+
+def next_appointment_id(conn, id_base=0):
+    """
+    Assigna el següent identificador de cita del shard.
+
+    La seqüència comença pel màxim de la taula (bases de dades anteriors a la
+    seqüència) o per id_base, el rang del shard: així els ids són únics entre
+    shards i no es reutilitzen encara que s'eliminin o s'arxivin cites.
+    """
+    table = Appointment.__table__
+    seed = select(
+        literal(APPOINTMENT_SEQUENCE),
+        func.max(func.coalesce(func.max(table.c.id_appointment), 0), id_base),
+    )
+    conn.execute(
+        insert(IdSequence)
+        .prefix_with("OR IGNORE")
+        .from_select([IdSequence.name, IdSequence.last_id], seed)
+    )
+    return conn.execute(
+        update(IdSequence)
+        .where(IdSequence.name == APPOINTMENT_SEQUENCE)
+        .values(last_id=IdSequence.last_id + 1)
+        .returning(IdSequence.last_id)
+    ).scalar_one()
+
+
+def insert_appointment(conn, appointment: Appointment, id_base=0):
+    """
+    Insereix la cita amb una sola sentència condicional a la partició del mes
+    de la seva data, que es crea si encara no existeix.
+
+    L'INSERT ... SELECT ... WHERE NOT EXISTS comprova el marge de 30 minuts a
+    les particions que el cobreixen (la del mes i, a prop d'un canvi de mes,
+    la del mes veí) i insereix de forma atòmica, i l'índex únic parcial de la
+    franja de la partició garanteix que, encara que dos processos insereixin
+    alhora, no hi pugui haver dues cites actives a la mateixa franja.
+    S'executa al fil escriptor de la cua d'escriptura del shard, dins de la
+    transacció del lot.
+
+    L'identificador s'obté de next_appointment_id; si hi ha conflicte, el
+    SAVEPOINT de l'operació també desfà l'increment de la seqüència.
+
+    Returns:
+        L'identificador de la cita creada
+
+    Raises:
+        AppointmentConflictError: si hi ha una cita activa dins del marge
+    """
+    appointment.slot = slot_for(appointment.date)
+    tables = active_tables_between(
+        conn, appointment.date - CONFLICT_WINDOW, appointment.date + CONFLICT_WINDOW
+    )
+    table = active_table(active_table_name(appointment.date))
+    if table.name not in [t.name for t in tables]:
+        ensure_active_table(conn, table.name)
+        tables.append(table)
+    columns = [
+        table.c.date,
+        table.c.reason,
+        table.c.status,
+        table.c.id_patient,
+        table.c.id_doctor,
+        table.c.id_center,
+        table.c.id_user_register,
+        table.c.slot,
+    ]
+    conflict = or_(
+        *[
+            exists().where(
+                t.c.id_doctor == appointment.id_doctor,
+                t.c.id_center == appointment.id_center,
+                t.c.status == AppointmentStatusEnum.ACTIVE,
+                t.c.date >= appointment.date - CONFLICT_WINDOW,
+                t.c.date <= appointment.date + CONFLICT_WINDOW,
+            )
+            for t in tables
+        ]
+    )
+    appointment.id_appointment = next_appointment_id(conn, id_base)
+    values = select(
+        literal(appointment.id_appointment),
+        *[literal(getattr(appointment, c.name), type_=c.type) for c in columns],
+    ).where(~conflict)
+
+    try:
+        result = conn.execute(
+            insert(table).from_select([table.c.id_appointment] + columns, values)
+        )
+    except IntegrityError as e:
+        if "UNIQUE" in str(e.orig):
+            raise AppointmentConflictError() from e
+        raise
+    if result.rowcount == 0:
+        raise AppointmentConflictError()
+    return appointment.id_appointment
+
+
+def cancel_appointment_row(conn, id_appointment):
+    """
+    Cancel·la una cita si està activa. S'executa al fil escriptor.
+
+    Returns:
+        Tupla amb l'estat que tenia la cita abans (None si no existeix) i, si
+        s'ha cancel·lat, els arguments de interval_index.remove
+    """
+    table, status = locate_appointment(conn, id_appointment)
+    if status != AppointmentStatusEnum.ACTIVE:
+        return status, None
+    id_doctor, id_center, date = conn.execute(
+        update(table)
+        .where(table.c.id_appointment == id_appointment)
+        .values(status=AppointmentStatusEnum.CANCELLED)
+        .returning(table.c.id_doctor, table.c.id_center, table.c.date)
+    ).one()
+    version = read_version(conn, id_doctor, id_center, date)
+    return status, (id_doctor, id_center, date, id_appointment, version)
+
+
+def parse_bulk_filter(data):
+    """
+    Valida els criteris d'una operació massiva: les cites actives d'un
+    doctor, filtrades per rang de dates i/o centre.
+
+    Returns:
+        (criteris, None) o (None, missatge d'error)
+    """
+    try:
+        criteria = {"id_doctor": int(data.get("id_doctor"))}
+    except (TypeError, ValueError):
+        return None, "El camp 'id_doctor' és obligatori"
+
+    if data.get("id_center") is not None:
+        try:
+            criteria["id_center"] = int(data["id_center"])
+        except (TypeError, ValueError):
+            return None, "El camp 'id_center' no és vàlid"
+    for field in ("date_from", "date_to"):
+        if data.get(field) is not None:
+            criteria[field] = parse_datetime(data[field])
+            if criteria[field] is None:
+                return None, f"El camp '{field}' ha de tenir el format ISO-8601"
+    # Sense rang ni centre s'afectarien totes les cites del doctor
+    if len(criteria) == 1:
+        return None, "Cal indicar un rang de dates (date_from, date_to) o un centre"
+    return criteria, None
+
+
+def bulk_conditions(table, criteria):
+    """Condicions WHERE dels criteris d'una operació massiva sobre table."""
+    conditions = [
+        table.c.id_doctor == criteria["id_doctor"],
+        table.c.status == AppointmentStatusEnum.ACTIVE,
+    ]
+    if "id_center" in criteria:
+        conditions.append(table.c.id_center == criteria["id_center"])
+    if "date_from" in criteria:
+        conditions.append(table.c.date >= criteria["date_from"])
+    if "date_to" in criteria:
+        conditions.append(table.c.date <= criteria["date_to"])
+    return conditions
+
+
+def cancel_appointments_bulk(conn, criteria):
+    """
+    Cancel·la amb un UPDATE per partició totes les cites que compleixen els
+    criteris. S'executa al fil escriptor.
+
+    Returns:
+        Llista d'identificadors de les cites cancel·lades
+    """
+    ids = []
+    for table in active_tables_between(
+        conn, criteria.get("date_from"), criteria.get("date_to")
+    ):
+        result = conn.execute(
+            update(table)
+            .where(*bulk_conditions(table, criteria))
+            .values(status=AppointmentStatusEnum.CANCELLED)
+            .returning(table.c.id_appointment)
+        )
+        ids.extend(result.scalars())
+    return sorted(ids)
+
+
+class ShiftConflictError(Exception):
+    """Alguna cita desplaçada se solaparia amb una cita que no es desplaça."""
+
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+
+
+def find_shift_conflicts(conn, criteria, minutes):
+    """
+    Comprova amb una sola consulta si desplaçar minutes minuts les cites que
+    compleixen els criteris les deixaria a menys de 30 minuts d'una altra.
+
+    Les cites desplaçades mantenen les distàncies entre elles, així que només
+    poden entrar en conflicte amb les cites actives del mateix doctor i centre
+    que no es mouen. Es consulta cada parell de particions (la de les cites
+    desplaçades i la de les cites del rang de destinació) per separat, amb
+    els seus índexs, i se n'uneixen els resultats.
+
+    Returns:
+        Llista de parelles (cita desplaçada, cita existent)
+    """
+    shift = datetime.timedelta(minutes=minutes)
+    date_from = criteria.get("date_from")
+    date_to = criteria.get("date_to")
+    sources = active_tables_between(conn, date_from, date_to)
+    targets = active_tables_between(
+        conn,
+        date_from + shift - CONFLICT_WINDOW if date_from else None,
+        date_to + shift + CONFLICT_WINDOW if date_to else None,
+    )
+    offset = minutes * 60
+    window = int(CONFLICT_WINDOW.total_seconds())
+    queries = []
+    for source in sources:
+        for target in targets:
+            moved = source.alias("moved")
+            other = target.alias("other")
+            # Les dates es comparen en segons des de l'època
+            moved_epoch = cast(func.strftime("%s", moved.c.date), Integer) + offset
+            other_epoch = cast(func.strftime("%s", other.c.date), Integer)
+            queries.append(
+                select(moved.c.id_appointment, other.c.id_appointment)
+                .join(
+                    other,
+                    and_(
+                        other.c.id_doctor == moved.c.id_doctor,
+                        other.c.id_center == moved.c.id_center,
+                        other.c.status == AppointmentStatusEnum.ACTIVE,
+                        other_epoch.between(moved_epoch - window, moved_epoch + window),
+                    ),
+                )
+                .where(*bulk_conditions(moved, criteria))
+                # Les cites que també es desplacen no compten com a conflicte
+                .where(~and_(*bulk_conditions(other, criteria)))
+            )
+    if not queries:
+        return []
+    return conn.execute(union_all(*queries)).all()
+
+
+def shift_appointments_bulk(conn, criteria, minutes):
+    """
+    Desplaça minutes minuts totes les cites que compleixen els criteris, amb
+    un UPDATE per partició. Les cites que canvien de mes es mouen a la
+    partició del mes nou. S'executa al fil escriptor, de manera que la
+    comprovació de conflictes (find_shift_conflicts) i l'escriptura són
+    atòmiques.
+
+    Returns:
+        Llista d'identificadors de les cites desplaçades
+
+    Raises:
+        ShiftConflictError: amb les parelles (cita desplaçada, cita existent)
+    """
+    conflicts = find_shift_conflicts(conn, criteria, minutes)
+    if conflicts:
+        raise ShiftConflictError(conflicts)
+
+    # El slot es buida primer: durant l'UPDATE una cita podria ocupar
+    # temporalment la franja d'una altra cita del mateix lot encara no moguda
+    modifier = f"{minutes:+d} minutes"
+    sources = active_tables_between(
+        conn, criteria.get("date_from"), criteria.get("date_to")
+    )
+    ids = []
+    for table in sources:
+        result = conn.execute(
+            update(table)
+            .where(*bulk_conditions(table, criteria))
+            .values(
+                # datetime() descarta els microsegons: es conserven els
+                # originals perquè les dates continuïn en el format que
+                # escriu SQLAlchemy
+                date=func.datetime(table.c.date, modifier, type_=String).concat(
+                    func.substr(table.c.date, 20)
+                ),
+                slot=None,
+            )
+            .returning(table.c.id_appointment)
+        )
+        ids.extend(result.scalars())
+    if not ids:
+        return []
+
+    # Les cites desplaçades són les del doctor sense franja
+    tables = {}
+    for table in sources:
+        tables[table.name] = table
+        shifted = [table.c.id_doctor == criteria["id_doctor"], table.c.slot.is_(None)]
+        for target in relocate_rows(conn, table, *shifted):
+            tables[target.name] = target
+    for table in tables.values():
+        conn.execute(
+            update(table)
+            .where(table.c.id_doctor == criteria["id_doctor"], table.c.slot.is_(None))
+            .values(
+                slot=cast(func.strftime("%s", table.c.date), Integer) // SLOT_SECONDS
+            )
+        )
+    return sorted(ids)
+
+
+def partial_shift(ids, applied, targets):
+    """
+    Camps de la resposta d'error d'un desplaçament entre shards: les cites ja
+    desplaçades i els shards aplicats i pendents.
+    """
+    return {
+        "partial": bool(applied),
+        "ids": sorted(ids),
+        "applied_shards": applied,
+        "pending_shards": [s.name for s in targets if s.name not in applied],
+    }
+
+
+def appointment_source(conn, include_archived=False, date_from=None, date_to=None):
+    """
+    Encaminador de les consultes de cites: retorna l'entitat sobre la qual es
+    consulta, que és la unió de les particions actuals que se solapen amb el
+    rang [date_from, date_to] (tots dos opcionals) a la base de dades de conn
+    i, si es demana l'arxiu, de les particions de l'arxiu del mateix rang.
+    """
+    tables = active_tables_between(conn, date_from, date_to)
+    if include_archived:
+        tables += partitions_between(conn, date_from, date_to)
+    if not tables:
+        # Cap partició al rang: la taula appointments, buida
+        return Appointment
+    return aliased(
+        Appointment, union_of(tables, "appointments_all"), adapt_on_names=True
+    )
+
+
+def listing_query(db: Session, source=Appointment):
+    """
+    Consulta de cites unida amb el model de lectura local de pacients, doctors
+    i centres, per retornar llistats amb noms sense fer crides al servei admin.
+    """
+    return (
+        db.query(
+            source,
+            PatientRef.name,
+            PatientRef.status,
+            DoctorRef.name,
+            DoctorRef.specialty,
+            CenterRef.name,
+        )
+        .outerjoin(PatientRef, PatientRef.id_patient == source.id_patient)
+        .outerjoin(DoctorRef, DoctorRef.id_doctor == source.id_doctor)
+        .outerjoin(CenterRef, CenterRef.id_center == source.id_center)
+    )
+
+
+def fetch_listing(
+    filters, include_archived=False, date_from=None, date_to=None, id_center=None
+):
+    """
+    Executa el llistat a cada shard implicat (només el del centre si se'n
+    filtra un) i en combina els resultats.
+
+    Cada shard retorna les seves files ordenades per data i identificador, i
+    es fusionen amb heapq.merge (merge sort) sense tornar-les a ordenar.
+
+    Args:
+        filters: Funcions que reben l'entitat consultada i retornen una condició
+        include_archived: Si s'han d'incloure les particions de l'arxiu
+        date_from, date_to: Rang de dates, per llegir només les particions
+            que hi toquen
+        id_center: Centre pel qual es filtra, si n'hi ha
+
+    Returns:
+        Llista de files de listing_query
+    """
+    results = []
+    for shard in shards_for(id_center):
+        db = shard.SessionLocal()
+        try:
+            source = appointment_source(
+                db.connection(), include_archived, date_from, date_to
+            )
+            query = (
+                listing_query(db, source)
+                .filter(*[condition(source) for condition in filters])
+                .order_by(source.date, source.id_appointment)
+            )
+            results.append(query.all())
+        finally:
+            db.close()
+    if len(results) == 1:
+        return results[0]
+    return list(
+        heapq.merge(*results, key=lambda row: (row[0].date, row[0].id_appointment))
+    )
+
+
+def serialize_listing(row):
+    """Serialitza una fila de listing_query: la cita amb els noms associats."""
+    appointment, patient_name, patient_status, doctor_name, specialty, center_name = row
+    item = serialize(appointment)
+    item.update(
+        {
+            "patient_name": patient_name,
+            "patient_status": patient_status,
+            "doctor_name": doctor_name,
+            "doctor_specialty": specialty,
+            "center_name": center_name,
+        }
+    )
+    return item
+
+
+def listing_budget():
+    """
+    Pressupost de consultes del llistat, que creix amb el nombre de shards: a
+    cada shard es llegeixen les versions (conditional_get), es comprova la
+    llista de particions actuals i de l'arxiu i es fa la consulta; i després
+    una consulta per entitat expandida.
+    """
+    return 4 * len(shards()) + len(EXPANDABLE)
+
+
 @cites_bp.route("/", methods=["GET"])
+@query_budget(listing_budget)
 @require_auth_role("admin", "metge", "secretaria")
+@conditional_get(
+    "appointments",
+    "appointments_archive",
+    "patients_ref",
+    "doctors_ref",
+    "centers_ref",
+)
 def list_appointments():
     """
     Endpoint per llistar totes les cites.
@@ -57,27 +550,64 @@ def list_appointments():
             "id_patient": 1,
             "id_doctor": 2,
             "id_center": 1,
-            "id_user_register": 3
+            "id_user_register": 3,
+            "patient_name": "string" | null,
+            "patient_status": "ACTIU|INACTIU" | null,
+            "doctor_name": "string" | null,
+            "doctor_specialty": "string" | null,
+            "center_name": "string" | null
         },
         ...
     ]
+
+    Els noms provenen del model de lectura local, que se sincronitza en segon
+    pla amb el servei admin; són null si l'entitat encara no s'ha sincronitzat.
+
+    Paràmetres de consulta addicionals:
+        expand: llista separada per comes de patient, doctor i center. Cada
+            cita inclou l'objecte de l'entitat (ex: "doctor": {"id_doctor": 2,
+            "name": "...", "specialty": "..."}), resolt amb una sola consulta
+            per tipus d'entitat.
+        include_archived: true per incloure les cites antigues o cancel·lades
+            que el procés d'arxivament ha mogut a les particions mensuals de
+            l'arxiu (amb date_from/date_to només es llegeixen les del rang).
+
+    La resposta inclou un ETag: amb If-None-Match es retorna 304 si les dades
+    no han canviat.
     """
-    # Obté el rol de l'usuari amb el token incrustat a la capçalera
-    auth_header = request.headers.get("Authorization")
-    parts = auth_header.split()
-    token = parts[1]
-    SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
-    payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    # Obté el rol de l'usuari del token, ja descodificat per require_auth_role
+    payload = request.user
     user_role = payload.get("role")
 
+    # Entitats a incrustar a cada cita (expand=patient,doctor,center)
+    try:
+        expand = parse_expand(request.args.get("expand"))
+    except ValueError as e:
+        return jsonify({"error": f"No es pot expandir l'entitat '{e}'"}), 400
+
+    # Amb include_archived també es consulten les particions de l'arxiu
+    include_archived = request.args.get("include_archived", "").lower() in (
+        "1",
+        "true",
+    )
+
+    # Les consultes repetides amb els mateixos filtres es serveixen de memòria
+    # mentre no canviïn les versions de les taules (llegides per conditional_get)
+    cache_key = listing_cache_key(g.table_versions, user_role, request.args)
+    if cache_key is not None:
+        cached = listing_cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, mimetype="application/json"), 200
+
+    # Cada filtre rep l'entitat consultada (la unió de les particions del
+    # rang) i retorna la condició, perquè s'aplica a cada shard
+    filters = []
+    dt_from = dt_to = id_center = None
     if user_role == "metge":
-        # Filtra per paràmetres opcionals
-        db: Session = SessionLocal()
-        query = db.query(Appointment)
         # Filtra amb l'identificador del doctor si s'ha passat en la consulta
         id_doctor = request.args.get("id_doctor")
         if id_doctor:
-            query = query.filter(Appointment.id_doctor == id_doctor)
+            filters.append(lambda source: source.id_doctor == id_doctor)
         else:
             return (
                 jsonify(
@@ -85,57 +615,35 @@ def list_appointments():
                 ),
                 400,
             )
-        # Executa la consulta
-        try:
-            items = query.all()
-            return jsonify([serialize(a) for a in items]), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            db.close()
     elif user_role == "secretaria":
-        # Filtra per paràmetres opcionals
-        db: Session = SessionLocal()
-        query = db.query(Appointment)
         # Filtra per rang de dates si s'han passat en la consulta
         date_from = request.args.get("date_from")
         if date_from:
             dt_from = parse_datetime(date_from)
             if dt_from is None:
                 return jsonify({"error": "Invalid date_from format"}), 400
-            query = query.filter(Appointment.date >= dt_from)
+            filters.append(lambda source: source.date >= dt_from)
         date_to = request.args.get("date_to")
         if date_to:
             dt_to = parse_datetime(date_to)
             if dt_to is None:
                 return jsonify({"error": "Invalid date_to format"}), 400
-            query = query.filter(Appointment.date <= dt_to)
-        # Executa la consulta
-        try:
-            items = query.all()
-            return jsonify([serialize(a) for a in items]), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            db.close()
+            filters.append(lambda source: source.date <= dt_to)
     else:
-        # Filtra per paràmetres opcionals
-        db: Session = SessionLocal()
-        query = db.query(Appointment)
         # Filtra amb l'identificador del doctor si s'ha passat en la consulta
         id_doctor = request.args.get("id_doctor")
         if id_doctor:
-            query = query.filter(Appointment.id_doctor == id_doctor)
+            filters.append(lambda source: source.id_doctor == id_doctor)
         # Filtra amb l'identificador del centre si s'ha passat en la consulta
-        id_center = request.args.get("id_center")
+        id_center = request.args.get("id_center") or None
         if id_center:
-            query = query.filter(Appointment.id_center == id_center)
+            filters.append(lambda source: source.id_center == id_center)
         # Filtra amb l'estat si s'ha passat en la consulta
         status = request.args.get("status")
         if status:
             try:
                 status_enum = AppointmentStatusEnum[status]
-                query = query.filter(Appointment.status == status_enum)
+                filters.append(lambda source: source.status == status_enum)
             except KeyError:
                 return jsonify({"error": "Invalid status value"}), 400
         # Filtra per rang de dates si s'han passat en la consulta
@@ -144,29 +652,102 @@ def list_appointments():
             dt_from = parse_datetime(date_from)
             if dt_from is None:
                 return jsonify({"error": "Invalid date_from format"}), 400
-            query = query.filter(Appointment.date >= dt_from)
+            filters.append(lambda source: source.date >= dt_from)
         date_to = request.args.get("date_to")
         if date_to:
             dt_to = parse_datetime(date_to)
             if dt_to is None:
                 return jsonify({"error": "Invalid date_to format"}), 400
-            query = query.filter(Appointment.date <= dt_to)
+            filters.append(lambda source: source.date <= dt_to)
         # Filtra amb l'identificador del pacient si s'ha passat en la consulta
         id_patient = request.args.get("id_patient")
         if id_patient:
-            query = query.filter(Appointment.id_patient == id_patient)
-        # Executa la consulta
-        try:
-            items = query.all()
-            return jsonify([serialize(a) for a in items]), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            db.close()
+            filters.append(lambda source: source.id_patient == id_patient)
+
+    # Executa la consulta
+    db: Session = SessionLocal()
+    try:
+        rows = fetch_listing(filters, include_archived, dt_from, dt_to, id_center)
+        items = [serialize_listing(row) for row in rows]
+        complete = expand_items(db, items, expand, request.headers.get("Authorization"))
+        response = jsonify(items)
+        # Una expansió incompleta per un error del servei admin no es desa
+        if cache_key is not None and complete:
+            listing_cache.set(cache_key, response.get_data())
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+@cites_bp.route("/disponibilitat", methods=["GET"])
+@query_budget(3)
+@require_auth_role("admin", "metge", "secretaria", "pacient")
+def get_availability():
+    """
+    Endpoint per consultar les hores lliures d'un doctor en un centre.
+
+    Capçaleres:
+    {
+        Authorization: Bearer <token>
+    }
+
+    Paràmetres de consulta:
+        id_doctor: identificador del doctor (obligatori)
+        id_center: identificador del centre (obligatori)
+        date: dia en format ISO-8601, ex: 2026-07-01 (obligatori)
+
+    Resposta JSON:
+    {
+        "id_doctor": 2,
+        "id_center": 1,
+        "date": "2026-07-01",
+        "free": ["2026-07-01T08:00:00", "2026-07-01T08:30:00", ...]
+    }
+
+    Una hora és lliure si no hi ha cap cita activa del doctor al centre
+    dins de 30 minuts abans o després.
+    """
+    try:
+        id_doctor = int(request.args.get("id_doctor", ""))
+        id_center = int(request.args.get("id_center", ""))
+    except ValueError:
+        return (
+            jsonify({"error": "Els paràmetres id_doctor i id_center són obligatoris"}),
+            400,
+        )
+    try:
+        day = datetime.date.fromisoformat(request.args.get("date", ""))
+    except ValueError:
+        return (
+            jsonify({"error": "El paràmetre 'date' ha de tenir el format ISO-8601"}),
+            400,
+        )
+
+    try:
+        free = free_slots(interval_index, id_doctor, id_center, day, CONFLICT_WINDOW)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return (
+        jsonify(
+            {
+                "id_doctor": id_doctor,
+                "id_center": id_center,
+                "date": day.isoformat(),
+                "free": [d.isoformat() for d in free],
+            }
+        ),
+        200,
+    )
 
 
 @cites_bp.route("/", methods=["POST"])
+# Pitjor cas mesurat: purga o reemplaçament d'una clau d'idempotència
+# caducada, i comprovació del marge en dos mesos sense carregar a l'índex
+@query_budget(17)
 @require_auth_role("admin", "pacient")
+@idempotent
 def create_appointment():
     """
     Endpoint per crear una nova cita.
@@ -174,6 +755,7 @@ def create_appointment():
     Capçaleres:
     {
         Authorization: Bearer <token>
+        Idempotency-Key: <clau> (opcional)
     }
 
     Petició JSON:
@@ -197,7 +779,6 @@ def create_appointment():
         "id_user_register": 3
     }
     """
-    db: Session = SessionLocal()
     try:
         data = request.get_json() or {}
 
@@ -215,12 +796,9 @@ def create_appointment():
                 400,
             )
 
-        # Obté el payload del token
+        # Payload del token, ja descodificat per require_auth_role
         auth_header = request.headers.get("Authorization")
-        parts = auth_header.split()
-        token = parts[1]
-        SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        payload = request.user
 
         dt = parse_datetime(data.get("date"))
         if dt is None:
@@ -229,16 +807,11 @@ def create_appointment():
                 400,
             )
 
-        ADMIN_HOST = os.getenv("ADMIN_HOST", "localhost")
-        ADMIN_PORT = os.getenv("ADMIN_PORT", "5002")
         # Comprovar que el pacient existeix
         try:
-            admin_url = f"http://{ADMIN_HOST}:{ADMIN_PORT}/admin/pacients/{data.get('id_patient')}"
-            # afegeix el token d'autenticació
-            resp = requests.get(
-                admin_url, headers={"Authorization": auth_header}, timeout=5
+            resp = admin_client.get(
+                f"/admin/pacients/{data.get('id_patient')}", auth_header
             )
-            print(resp.status_code)
             if resp.status_code != 200:
                 return jsonify({"error": "El pacient no existeix"}), 400
         except Exception:
@@ -246,9 +819,8 @@ def create_appointment():
 
         # Comprovar que el doctor existeix
         try:
-            admin_url = f"http://{ADMIN_HOST}:{ADMIN_PORT}/admin/doctors/{data.get('id_doctor')}"
-            resp = requests.get(
-                admin_url, headers={"Authorization": auth_header}, timeout=5
+            resp = admin_client.get(
+                f"/admin/doctors/{data.get('id_doctor')}", auth_header
             )
             if resp.status_code != 200:
                 return jsonify({"error": "El doctor no existeix"}), 400
@@ -257,42 +829,14 @@ def create_appointment():
 
         # Comprovar que el centre existeix
         try:
-            admin_url = f"http://{ADMIN_HOST}:{ADMIN_PORT}/admin/centres/{data.get('id_center')}"
-            resp = requests.get(
-                admin_url, headers={"Authorization": auth_header}, timeout=5
+            resp = admin_client.get(
+                f"/admin/centres/{data.get('id_center')}", auth_header
             )
             if resp.status_code != 200:
                 return jsonify({"error": "El centre no existeix"}), 400
         except Exception:
             return jsonify({"error": "No s'ha pogut verificar el centre"}), 500
 
-        # Comprovar que no hi ha cites conflictives (mateix doctor i centre dins de 30 minuts)
-        time_buffer = datetime.timedelta(minutes=30)
-        start_time = dt - time_buffer
-        end_time = dt + time_buffer
-
-        conflicting_appointments = (
-            db.query(Appointment)
-            .filter(
-                Appointment.id_doctor == data.get("id_doctor"),
-                Appointment.id_center == data.get("id_center"),
-                Appointment.status == AppointmentStatusEnum.ACTIVE,
-                Appointment.date >= start_time,
-                Appointment.date <= end_time,
-            )
-            .all()
-        )
-
-        if conflicting_appointments:
-            return (
-                jsonify(
-                    {
-                        "error": "No es pot programar una cita per aquest doctor i centre. Hi ha una cita conflictiva dins de 30 minuts abans o després."
-                    }
-                ),
-                409,
-            )
-
         appointment = Appointment(
             date=dt,
             reason=data.get("reason"),
@@ -303,21 +847,53 @@ def create_appointment():
             id_user_register=payload.get("id_user"),
         )
 
-        db.add(appointment)
-        db.commit()
-        db.refresh(appointment)
+        conflict_error = {
+            "error": "No es pot programar una cita per aquest doctor i centre. Hi ha una cita conflictiva dins de 30 minuts abans o després."
+        }
+
+        # Els conflictes evidents es rebutgen amb l'índex en memòria, sense
+        # passar pel fil escriptor (el mes del doctor i centre es torna a
+        # carregar si un altre procés hi ha escrit)
+        with span("conflict_check"):
+            conflicting = interval_index.find_conflict(
+                appointment.id_doctor, appointment.id_center, dt, CONFLICT_WINDOW
+            )
+        if conflicting is not None:
+            return jsonify(conflict_error), 409
+
+        # La comprovació de conflictes i la inserció s'executen al fil escriptor
+        # del shard del centre, que agrupa les cites concurrents en una sola
+        # transacció. La versió posterior a la inserció permet afegir la cita a
+        # l'índex sense tornar-lo a carregar
+        shard = shard_for_center(appointment.id_center)
+
+        def insert(conn):
+            id_appointment = insert_appointment(conn, appointment, shard.id_base)
+            return id_appointment, read_version(
+                conn, appointment.id_doctor, appointment.id_center, dt
+            )
+
+        try:
+            with span("commit", shard=shard.name):
+                appointment.id_appointment, version = shard.write_queue.submit(insert)
+        except AppointmentConflictError:
+            return jsonify(conflict_error), 409
+        interval_index.add(
+            appointment.id_doctor,
+            appointment.id_center,
+            dt,
+            appointment.id_appointment,
+            version,
+        )
         return jsonify(serialize(appointment)), 201
     except IntegrityError:
-        db.rollback()
         return jsonify({"error": "Error d'integritat en la base de dades"}), 400
     except Exception as e:
-        db.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
 
 
 @cites_bp.route("/<int:id_appointment>", methods=["PUT"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def cancel_appointment(id_appointment):
     """
@@ -333,34 +909,183 @@ def cancel_appointment(id_appointment):
         "message": "La cita ha estat cancel·lada"
     }
     """
-    db: Session = SessionLocal()
     try:
-        a = (
-            db.query(Appointment)
-            .filter(Appointment.id_appointment == id_appointment)
-            .first()
+        shard = shard_for_appointment(id_appointment)
+        previous_status, cancelled = shard.write_queue.submit(
+            lambda conn: cancel_appointment_row(conn, id_appointment)
         )
-        if not a:
+        if cancelled is not None:
+            interval_index.remove(*cancelled)
+        if previous_status is None:
             return jsonify({"error": "No s'ha trobat la cita"}), 404
 
-        if a.status == AppointmentStatusEnum.CANCELLED:
+        if previous_status == AppointmentStatusEnum.CANCELLED:
             return jsonify({"error": "La cita ja està cancel·lada"}), 400
-        a.status = AppointmentStatusEnum.CANCELLED
 
-        db.commit()
-        db.refresh(a)
         return jsonify({"message": "La cita ha estat cancel·lada"}), 200
     except IntegrityError:
-        db.rollback()
         return jsonify({"error": "Error d'integritat en la base de dades"}), 400
     except Exception as e:
-        db.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
+
+
+@cites_bp.route("/cancellacions", methods=["POST"])
+# Sense pressupost: fa una sentència per partició del rang i per shard, de
+# manera que el nombre de consultes depèn de les dates i del centre demanats
+@query_budget(None)
+@require_auth_role("admin", "secretaria")
+def cancel_appointments():
+    """
+    Endpoint per cancel·lar de cop les cites actives d'un doctor.
+
+    Capçaleres:
+    {
+        Authorization: Bearer <token>
+    }
+
+    Petició JSON:
+    {
+        "id_doctor": 2,
+        "id_center": 1 (opcional),
+        "date_from": "2026-07-01T00:00:00" (opcional),
+        "date_to": "2026-07-01T23:59:59" (opcional)
+    }
+
+    Cal indicar un rang de dates o un centre.
+
+    Resposta JSON:
+    {
+        "count": 2,
+        "ids": [12, 15]
+    }
+    """
+    criteria, error = parse_bulk_filter(request.get_json() or {})
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Sense centre, la cancel·lació s'executa a tots els shards
+    ids = []
+    try:
+        for shard in shards_for(criteria.get("id_center")):
+            ids.extend(
+                shard.write_queue.submit(
+                    lambda conn: cancel_appointments_bulk(conn, criteria)
+                )
+            )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"count": len(ids), "ids": ids}), 200
+
+
+@cites_bp.route("/reprogramacions", methods=["POST"])
+# Sense pressupost: fa diverses sentències per partició del rang (i de les
+# particions on arriben les cites) i per shard, de manera que el nombre de
+# consultes depèn de les dates, del desplaçament i del centre demanats
+@query_budget(None)
+@require_auth_role("admin", "secretaria")
+def shift_appointments():
+    """
+    Endpoint per desplaçar de cop les cites actives d'un doctor.
+
+    Capçaleres:
+    {
+        Authorization: Bearer <token>
+    }
+
+    Petició JSON:
+    {
+        "id_doctor": 2,
+        "id_center": 1 (opcional),
+        "date_from": "2026-07-01T00:00:00" (opcional),
+        "date_to": "2026-07-01T23:59:59" (opcional),
+        "shift_minutes": 1440
+    }
+
+    Cal indicar un rang de dates o un centre. Si alguna cita desplaçada
+    quedaria a menys de 30 minuts d'una altra cita activa del mateix doctor i
+    centre, no es desplaça cap cita i es retorna 409 amb els conflictes.
+
+    Resposta JSON:
+    {
+        "count": 2,
+        "ids": [12, 15]
+    }
+
+    Sense centre, cada shard es desplaça en una transacció pròpia. Si un
+    shard falla (409 o 500) després que els anteriors ja s'hagin desplaçat,
+    la resposta d'error indica què s'ha aplicat:
+    {
+        "error": "...",
+        "conflicts": [...] (només amb 409),
+        "partial": true,
+        "ids": [12],
+        "applied_shards": ["a"],
+        "pending_shards": ["b"]
+    }
+    """
+    data = request.get_json() or {}
+    criteria, error = parse_bulk_filter(data)
+    if error:
+        return jsonify({"error": error}), 400
+    minutes = data.get("shift_minutes")
+    if not isinstance(minutes, int) or isinstance(minutes, bool) or minutes == 0:
+        return (
+            jsonify(
+                {"error": "El camp 'shift_minutes' ha de ser un enter diferent de 0"}
+            ),
+            400,
+        )
+
+    # Sense centre, el desplaçament afecta tots els shards: abans de moure res
+    # es comproven els conflictes a tots, i cada shard els torna a comprovar
+    # dins de la seva transacció
+    targets = shards_for(criteria.get("id_center"))
+    ids = []
+    applied = []
+    try:
+        if len(targets) > 1:
+            conflicts = []
+            for shard in targets:
+                with shard.engine.connect() as conn:
+                    conflicts.extend(find_shift_conflicts(conn, criteria, minutes))
+            if conflicts:
+                raise ShiftConflictError(conflicts)
+        for shard in targets:
+            ids.extend(
+                shard.write_queue.submit(
+                    lambda conn: shift_appointments_bulk(conn, criteria, minutes)
+                )
+            )
+            applied.append(shard.name)
+    except ShiftConflictError as e:
+        # Una reserva concurrent pot crear un conflicte en un shard després de
+        # la comprovació: els shards anteriors ja s'han desplaçat i la resposta
+        # ho indica perquè el client ho pugui reconciliar
+        return (
+            jsonify(
+                {
+                    "error": "Algunes cites desplaçades quedarien a menys de 30 minuts d'una altra cita activa",
+                    "conflicts": [
+                        {"id_appointment": moved, "conflicts_with": other}
+                        for moved, other in e.conflicts
+                    ],
+                    **partial_shift(ids, applied, targets),
+                }
+            ),
+            409,
+        )
+    except Exception as e:
+        return (
+            jsonify({"error": str(e), **partial_shift(ids, applied, targets)}),
+            500,
+        )
+
+    return jsonify({"count": len(ids), "ids": ids}), 200
 
 
 @cites_bp.route("/<int:id_appointment>", methods=["DELETE"])
+@query_budget(4)
 @require_auth_role("admin", "secretaria")
 def delete_appointment(id_appointment):
     """
@@ -375,21 +1100,242 @@ def delete_appointment(id_appointment):
         "message": "S'ha eliminat la cita"
     }
     """
-    db: Session = SessionLocal()
+    db: Session = shard_for_appointment(id_appointment).SessionLocal()
     try:
-        a = (
-            db.query(Appointment)
-            .filter(Appointment.id_appointment == id_appointment)
-            .first()
-        )
-        if not a:
+        table, _ = locate_appointment(db.connection(), id_appointment)
+        if table is None:
             return jsonify({"error": "No s'ha trobat la cita"}), 404
 
-        db.delete(a)
+        id_doctor, id_center, date = db.execute(
+            delete(table)
+            .where(table.c.id_appointment == id_appointment)
+            .returning(table.c.id_doctor, table.c.id_center, table.c.date)
+        ).one()
+        version = read_version(db.connection(), id_doctor, id_center, date)
         db.commit()
+        interval_index.remove(id_doctor, id_center, date, id_appointment, version)
         return jsonify({"message": "S'ha eliminat la cita"}), 200
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         db.close()
+
+
+# ENDPOINTS D'INFORMES =========================================================
+
+
+@cites_bp.route("/informes/utilitzacio", methods=["GET"])
+# Sense pressupost: l'informe es calcula al fil de report_worker (compartit per
+# les peticions amb els mateixos paràmetres) i fa una consulta per partició del
+# rang, de manera que el nombre de consultes depèn de les dates demanades
+@query_budget(None)
+@require_auth_role("admin")
+def utilization_report():
+    """
+    Endpoint per obtenir l'informe setmanal de cites reservades i cancel·lades
+    i d'utilització de les franges per doctor i centre.
+
+    Capçaleres:
+    {
+        Authorization: Bearer <token>
+    }
+
+    Paràmetres de consulta:
+        date_from: primer dia del rang en format ISO-8601, ex: 2026-01-01
+            (obligatori)
+        date_to: últim dia del rang, inclòs (obligatori)
+        id_doctor: només les cites d'aquest doctor (opcional)
+        id_center: només les cites d'aquest centre (opcional)
+
+    Resposta JSON:
+    {
+        "date_from": "2026-01-01",
+        "date_to": "2026-03-31",
+        "days": 90,
+        "slots_per_day": 24,
+        "id_doctor": null,
+        "id_center": null,
+        "generated_at": "2026-04-01T09:00:00",
+        "totals": {"doctors": 12, "booked": 9100, "cancelled": 850,
+                   "capacity": 25920, "utilization": 0.3511,
+                   "cancellation_rate": 0.0854},
+        "weeks": [{"week": "2025-12-29", "days": 4, "doctors": 10, ...}, ...],
+        "doctors": [{"id_doctor": 2, "doctor_name": "string" | null,
+                     "centers": 1, ..., "peak_week_utilization": 0.5}, ...],
+        "centers": [{"id_center": 1, "center_name": "string" | null,
+                     "doctors": 4, ...}, ...],
+        "rows": {"week": ["2025-12-29", ...], "id_doctor": [2, ...],
+                 "id_center": [1, ...], "booked": [40, ...],
+                 "cancelled": [3, ...], "capacity": [96, ...],
+                 "utilization": [0.4167, ...],
+                 "cancellation_rate": [0.0698, ...]}
+    }
+
+    rows té una fila per doctor, centre i setmana, retornada per columnes
+    (una llista per camp, totes de la mateixa longitud) perquè els rangs
+    llargs poden tenir centenars de milers de files.
+
+    Les setmanes comencen en dilluns (week és la data del dilluns) i només
+    en compten els dies dins del rang. booked són les cites actives (també
+    les arxivades) i cancelled les cancel·lades. La capacitat són les franges
+    de la jornada que ofereix /disponibilitat de cada dia, per a cada doctor
+    amb alguna cita al rang (a cada centre, a les files); la utilització és
+    booked / capacity i la taxa de cancel·lació, cancelled / (booked +
+    cancelled). Els noms provenen del model de lectura local.
+
+    L'informe es calcula en segon pla: si triga més d'uns segons es respon
+    202 amb la capçalera Retry-After i cal tornar a fer la mateixa petició.
+    """
+    try:
+        date_from = datetime.date.fromisoformat(request.args.get("date_from", ""))
+        date_to = datetime.date.fromisoformat(request.args.get("date_to", ""))
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": "Els paràmetres date_from i date_to són obligatoris i han de tenir el format ISO-8601"
+                }
+            ),
+            400,
+        )
+    if date_from > date_to:
+        return jsonify({"error": "date_from no pot ser posterior a date_to"}), 400
+    try:
+        id_doctor = request.args.get("id_doctor")
+        id_doctor = int(id_doctor) if id_doctor else None
+        id_center = request.args.get("id_center")
+        id_center = int(id_center) if id_center else None
+    except ValueError:
+        return (
+            jsonify(
+                {"error": "Els paràmetres id_doctor i id_center han de ser enters"}
+            ),
+            400,
+        )
+
+    try:
+        body = report_worker.get((date_from, date_to, id_doctor, id_center))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if body is None:
+        response = jsonify(
+            {
+                "status": "pending",
+                "message": "L'informe s'està calculant; torneu a fer la petició més tard",
+            }
+        )
+        response.headers["Retry-After"] = str(REPORT_RETRY_AFTER)
+        return response, 202
+    return Response(body, mimetype="application/json"), 200
+
+
+# ENDPOINTS DE DIAGNÒSTIC DE MEMÒRIA ===========================================
+
+
+@cites_bp.route("/diagnostics/memory", methods=["GET"])
+@query_budget(0)
+@require_auth_role("admin")
+def memory_diagnostics():
+    """
+    Endpoint per consultar l'estat de la memòria del worker que atén la petició
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        limit: llocs d'assignació que es retornen (per defecte 20, màxim 200)
+
+    Resposta JSON:
+    {
+        "pid": int,
+        "rss_bytes": int,
+        "gc_counts": [int, int, int],
+        "tracing": bool,
+        "sqlalchemy": {
+            "sessions": int,
+            "identity_map_total": int,
+            "identity_map_largest": [int, ...],
+            "with_pending_changes": int
+        },
+        "caches": [{"name": ..., "size": int, ...}, ...],
+        "interval_index": {"keys": int, "entries": int, ...},
+        "traced_current_bytes": int,  (només amb tracemalloc actiu)
+        "traced_peak_bytes": int,
+        "top": [{"file": ..., "line": int, "size": int, "count": int}, ...],
+        "has_baseline": bool
+    }
+    """
+    limit = parse_top_limit(request.args.get("limit"))
+    if limit is None:
+        return (
+            jsonify({"error": "El paràmetre 'limit' ha de ser un enter entre 1 i 200"}),
+            400,
+        )
+    report = memory_report(CACHES, limit)
+    report["interval_index"] = interval_index.stats()
+    return jsonify(report), 200
+
+
+@cites_bp.route("/diagnostics/memory/<action>", methods=["POST"])
+@query_budget(0)
+@require_auth_role("admin")
+def memory_diagnostics_action(action):
+    """
+    Endpoint per controlar tracemalloc al worker que atén la petició
+
+    Accions:
+        start: activa tracemalloc (cos opcional: {"frames": int})
+        stop: atura tracemalloc i descarta la instantània de referència
+        snapshot: desa una instantània de referència
+        diff: compara l'estat actual amb la instantània de referència
+
+    Capçaleres:
+    {
+        "Authorization": "Bearer <token>"
+    }
+
+    Paràmetres de consulta:
+        limit: llocs d'assignació que es retornen (snapshot i diff)
+
+    Resposta JSON (diff):
+    {
+        "size_diff": int,
+        "top": [{"file": ..., "line": int, "size": int, "count": int,
+                 "size_diff": int, "count_diff": int}, ...]
+    }
+    """
+    limit = parse_top_limit(request.args.get("limit"))
+    if limit is None:
+        return (
+            jsonify({"error": "El paràmetre 'limit' ha de ser un enter entre 1 i 200"}),
+            400,
+        )
+
+    if action == "start":
+        frames = (request.get_json(silent=True) or {}).get("frames", 1)
+        if not isinstance(frames, int) or not 1 <= frames <= 100:
+            return (
+                jsonify({"error": "El camp 'frames' ha de ser un enter entre 1 i 100"}),
+                400,
+            )
+        return jsonify(start_tracing(frames)), 200
+    if action == "stop":
+        return jsonify(stop_tracing()), 200
+    if action not in ("snapshot", "diff"):
+        return jsonify({"error": f"Acció desconeguda: {action}"}), 404
+    if not tracemalloc.is_tracing():
+        return jsonify({"error": "Cal activar tracemalloc abans (acció start)"}), 409
+    if action == "snapshot":
+        return jsonify(take_baseline(limit)), 200
+    diff = diff_baseline(limit)
+    if diff is None:
+        return (
+            jsonify(
+                {"error": "No hi ha cap instantània de referència (acció snapshot)"}
+            ),
+            409,
+        )
+    return jsonify(diff), 200
@@ -0,0 +1,153 @@
+"""Compressió negociada (brotli/gzip) de les respostes HTTP."""
+
+import gzip
+import os
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli és opcional: sense el paquet només s'ofereix gzip
+    brotli = None
+
+# Tipus MIME que val la pena comprimir (les respostes de l'API són JSON)
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "text/plain",
+    "text/html",
+    "text/csv",
+}
+
+
+def _accepted_encodings(header):
+    """
+    Retorna les codificacions acceptades (amb q > 0) i les rebutjades
+    explícitament (amb q=0) pel client.
+    """
+    accepted = set()
+    refused = set()
+    for part in (header or "").split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+        else:
+            refused.add(coding)
+    return accepted, refused
+
+
+def choose_encoding(header):
+    """
+    Tria la millor codificació disponible: brotli si es pot, si no gzip.
+
+    El comodí * no inclou les codificacions que el client rebutja amb q=0.
+    """
+    accepted, refused = _accepted_encodings(header)
+
+    def acceptable(coding):
+        return coding in accepted or ("*" in accepted and coding not in refused)
+
+    if brotli is not None and acceptable("br"):
+        return "br"
+    if acceptable("gzip"):
+        return "gzip"
+    return None
+
+
+def _compress(data, encoding, config):
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=config["COMPRESS_LEVEL"])
+
+
+def _compress_stream(chunks, encoding, config):
+    """
+    Comprimeix una resposta en streaming fragment a fragment.
+
+    Cada fragment es buida (sync flush) perquè el client el rebi de seguida en
+    lloc d'esperar que el compressor acumuli tota la resposta.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        # wbits=31 genera el format gzip (capçalera i CRC)
+        compressor = zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def compress_response(response):
+    """Comprimeix la resposta si el client ho accepta i val la pena."""
+    config = current_app.config
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or request.method == "HEAD"
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # La mida no es coneix per endavant: es comprimeix sempre
+        response.response = _compress_stream(response.response, encoding, config)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(_compress(data, encoding, config))
+
+    response.headers["Content-Encoding"] = encoding
+    # El cos ja no és idèntic byte a byte: un ETag fort passa a ser feble
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        response.headers["ETag"] = f"W/{etag}"
+    return response
+
+
+def init_compression(app):
+    """
+    Activa la compressió de respostes a l'aplicació.
+
+    Configuració (variables d'entorn o app.config):
+        COMPRESS_MIN_SIZE: mida mínima en bytes per comprimir (per defecte 1024)
+        COMPRESS_LEVEL: nivell de gzip, de 1 a 9 (per defecte 6)
+        COMPRESS_BROTLI_QUALITY: qualitat de brotli, de 0 a 11 (per defecte 5)
+    """
+    app.config.setdefault(
+        "COMPRESS_MIN_SIZE", int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+    )
+    app.config.setdefault("COMPRESS_LEVEL", int(os.getenv("COMPRESS_LEVEL", "6")))
+    app.config.setdefault(
+        "COMPRESS_BROTLI_QUALITY", int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+    )
+    app.after_request(compress_response)
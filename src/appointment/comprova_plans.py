@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Comprovació dels plans d'execució de les consultes freqüents del servei de
+cites.
+
+Crea l'esquema en una base de dades temporal, executa la comprovació de
+conflictes de create_appointment, totes les combinacions de filtres de
+list_appointments (per a cada rol i amb i sense l'arxiu), la càrrega de la
+disponibilitat i els recomptes de l'informe d'utilització, captura les
+sentències SQL que generen i n'obté el pla amb EXPLAIN QUERY PLAN. Retorna el
+codi de sortida 1 si alguna consulta que té un filtre selectiu recorre sencera
+una taula (SCAN) en lloc de fer servir un índex, de manera que un canvi
+d'esquema o de consulta que torni a introduir recorreguts complets fa fallar
+la comprovació.
+
+Ús (des del directori del servei):
+    python comprova_plans.py
+"""
+
+import datetime
+import itertools
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# La base de dades temporal s'ha de configurar abans d'importar l'aplicació
+os.environ["TEST_DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "appointments.db")
+os.environ["SLOW_QUERY_THRESHOLD_MS"] = "-1"
+
+import jwt
+from sqlalchemy import event
+
+import database
+from app import create_app
+from cites_bp import insert_appointment
+from models import Appointment, AppointmentStatusEnum
+from partitions import (
+    active_table_name,
+    ensure_active_table,
+    ensure_partition,
+    partition_name,
+    refresh_partitions,
+)
+from shards import shards
+from slowlog import EXPLAINABLE, explain_query_plan
+
+# Valors dels filtres (el mes de l'interval té una partició a l'arxiu)
+FILTER_VALUES = {
+    "id_doctor": "1",
+    "id_center": "1",
+    "id_patient": "1",
+    "status": "ACTIVE",
+    "date_from": "2026-01-01T00:00:00",
+    "date_to": "2026-01-31T23:59:59",
+}
+# Filtres de list_appointments que accepta cada rol
+ROLE_FILTERS = {
+    "admin": ["id_doctor", "id_center", "status", "date_from", "date_to", "id_patient"],
+    "secretaria": ["date_from", "date_to"],
+    "metge": ["id_doctor"],
+}
+# Filtres que no redueixen prou les files per fer servir un índex
+NON_SELECTIVE = {"status"}
+
+SCAN_PATTERN = re.compile(r"^SCAN (\w+)")
+
+_captured = None
+
+
+def _capture_statement(conn, cursor, statement, parameters, context, many):
+    if _captured is not None and statement.lstrip().upper().startswith(EXPLAINABLE):
+        params = parameters[0] if many and parameters else parameters
+        _captured.append((conn.engine, statement, params))
+
+
+@contextmanager
+def capture():
+    """Captura les sentències SQL executades dins del bloc."""
+    global _captured
+    _captured = statements = []
+    try:
+        yield statements
+    finally:
+        _captured = None
+
+
+def real_tables(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+def full_scans(statements):
+    """
+    Retorna les sentències que recorren sencera alguna taula, amb el seu pla.
+    """
+    tables = {}
+    scans = []
+    for engine, statement, parameters in statements:
+        if engine not in tables:
+            tables[engine] = real_tables(engine)
+        connection = engine.raw_connection()
+        try:
+            plan = explain_query_plan(connection, statement, parameters)
+        finally:
+            connection.close()
+        scanned = [
+            m.group(1)
+            for m in (SCAN_PATTERN.match(line) for line in plan)
+            if m and m.group(1) in tables[engine]
+        ]
+        if scanned:
+            scans.append((statement, plan))
+    return scans
+
+
+class Checker:
+    def __init__(self):
+        self.checked = 0
+        self.failures = 0
+
+    def check(self, name, statements, allow_scan=False):
+        """Comprova que les sentències capturades fan servir índexs."""
+        self.checked += 1
+        if not statements:
+            print(f"FALLA  {name}: no s'ha executat cap consulta")
+            self.failures += 1
+            return
+        scans = [] if allow_scan else full_scans(statements)
+        if not scans:
+            print(f"OK     {name}")
+            return
+        self.failures += 1
+        print(f"FALLA  {name}")
+        for statement, plan in scans:
+            print("    " + " ".join(statement.split())[:300])
+            for line in plan:
+                print(f"        {line}")
+
+
+def token(role):
+    secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+    payload = {
+        "id_user": 1,
+        "username": f"plans-{role}",
+        "role": role,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=10),
+    }
+    return jwt.encode(payload, secret_key, algorithm="HS256")
+
+
+def check_conflict_query(checker):
+    """La comprovació de conflictes i l'assignació d'identificador de create_appointment."""
+    appointment = Appointment(
+        date=datetime.datetime(2026, 1, 15, 10, 0),
+        reason="Comprovació del pla",
+        status=AppointmentStatusEnum.ACTIVE,
+        id_patient=1,
+        id_doctor=1,
+        id_center=1,
+        id_user_register=1,
+    )
+    with database.engine.connect() as conn:
+        transaction = conn.begin()
+        with capture() as statements:
+            insert_appointment(conn, appointment)
+        transaction.rollback()
+    checker.check("create_appointment: conflictes i inserció", statements)
+
+
+def check_listings(checker, client):
+    """Totes les combinacions de filtres de list_appointments per a cada rol."""
+    for role, names in ROLE_FILTERS.items():
+        headers = {"Authorization": f"Bearer {token(role)}"}
+        for size in range(len(names) + 1):
+            for combination in itertools.combinations(names, size):
+                # El metge ha d'indicar sempre el doctor
+                if role == "metge" and not combination:
+                    continue
+                for include_archived in (False, True):
+                    args = {name: FILTER_VALUES[name] for name in combination}
+                    if include_archived:
+                        args["include_archived"] = "true"
+                    with capture() as statements:
+                        response = client.get(
+                            "/cites/", query_string=args, headers=headers
+                        )
+                    if response.status_code != 200:
+                        print(
+                            f"FALLA  list_appointments {role} {args}: {response.status_code}"
+                        )
+                        checker.failures += 1
+                        continue
+                    listing = [
+                        s for s in statements if "FROM table_versions" not in s[1]
+                    ]
+                    checker.check(
+                        f"list_appointments ({role}) {args}",
+                        listing,
+                        allow_scan=set(combination) <= NON_SELECTIVE,
+                    )
+
+
+def check_availability(checker, client):
+    """La càrrega de les cites d'un doctor i centre a l'índex en memòria."""
+    headers = {"Authorization": f"Bearer {token('admin')}"}
+    with capture() as statements:
+        client.get(
+            "/cites/disponibilitat",
+            query_string={"id_doctor": 1, "id_center": 1, "date": "2026-01-15"},
+            headers=headers,
+        )
+    checker.check("get_availability: càrrega de l'índex", statements)
+
+
+def check_report(checker, client):
+    """Els recomptes per setmana de l'informe d'utilització."""
+    headers = {"Authorization": f"Bearer {token('admin')}"}
+    for args in ({}, {"id_doctor": 1}, {"id_center": 1}):
+        args = {"date_from": "2026-01-01", "date_to": "2026-01-31", **args}
+        with capture() as statements:
+            response = client.get(
+                "/cites/informes/utilitzacio", query_string=args, headers=headers
+            )
+        if response.status_code != 200:
+            print(f"FALLA  utilization_report {args}: {response.status_code}")
+            checker.failures += 1
+            continue
+        counts = [s for s in statements if "GROUP BY" in s[1]]
+        checker.check(f"utilization_report {args}", counts)
+
+
+def main():
+    app = create_app("testing")
+    for shard in shards():
+        event.listen(shard.engine, "before_cursor_execute", _capture_statement)
+
+    # Dues particions actuals i una de l'arxiu dins del rang de dates dels
+    # filtres, perquè les consultes es facin sobre la unió de particions
+    with database.engine.begin() as conn:
+        for month in (1, 2):
+            ensure_active_table(conn, active_table_name(datetime.date(2026, month, 1)))
+        ensure_partition(conn, partition_name(datetime.date(2026, 1, 1)))
+    with database.engine.connect() as conn:
+        refresh_partitions(conn)
+
+    checker = Checker()
+    client = app.test_client()
+    check_conflict_query(checker)
+    check_listings(checker, client)
+    check_availability(checker, client)
+    check_report(checker, client)
+
+    print()
+    print(f"Consultes comprovades: {checker.checked}, errors: {checker.failures}")
+    sys.exit(1 if checker.failures else 0)
+
+
+if __name__ == "__main__":
+    main()
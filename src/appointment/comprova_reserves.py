@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Comprovació de la reserva de franges sense dobles reserves.
+
+Crea l'esquema en una base de dades temporal i hi fa moltes reserves
+simultànies amb insert_appointment a través de la cua d'escriptura, des de
+diversos processos (cadascun amb el seu engine i la seva cua, com els workers
+del servei) i diversos fils per procés. A cada ronda, totes les reserves són
+del mateix doctor i centre dins d'una finestra de 30 minuts, de manera que
+només se n'ha d'acceptar una. Després comprova directament que l'índex únic
+parcial de franja de la partició del mes rebutja una segona cita activa a la
+mateixa franja encara que no passi per la comprovació de l'INSERT ... WHERE
+NOT EXISTS.
+
+Retorna el codi de sortida 1 si hi ha alguna franja amb més d'una cita activa,
+dues cites actives dins del marge de 30 minuts o si l'índex únic no rebutja
+la cita duplicada. A diferència de prova_concurrencia.py, no necessita els
+serveis en execució.
+
+Ús (des del directori del servei):
+    python comprova_reserves.py
+"""
+
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import database
+from cites_bp import AppointmentConflictError, CONFLICT_WINDOW, insert_appointment
+from models import Appointment, AppointmentStatusEnum, slot_for
+from partitions import active_table, active_table_name, active_tables_between
+from write_queue import WriteQueue
+
+# Paràmetres de la prova
+PROCESSES = int(os.getenv("PROVA_PROCESSOS", "4"))
+THREADS = int(os.getenv("PROVA_FILS", "16"))
+ROUNDS = int(os.getenv("PROVA_RONDES", "5"))
+ID_DOCTOR = 1
+ID_CENTER = 1
+
+# Les reserves de cada ronda cobreixen dues franges (9:15-9:44): l'índex únic
+# només n'impedeix els duplicats dins de cada franja, i la resta de solapaments
+# els ha d'impedir la comprovació de l'INSERT ... WHERE NOT EXISTS
+START = datetime.datetime(2030, 1, 7, 9, 15)
+
+
+def new_appointment(date, status=AppointmentStatusEnum.ACTIVE):
+    return Appointment(
+        date=date,
+        reason="Comprovació de reserves",
+        status=status,
+        id_patient=1,
+        id_doctor=ID_DOCTOR,
+        id_center=ID_CENTER,
+        id_user_register=1,
+    )
+
+
+def round_dates(round_number, worker):
+    """
+    Dates de les reserves d'un procés en una ronda: totes dins dels 30 minuts
+    posteriors a l'inici de la ronda, de manera que se solapen entre elles.
+    """
+    base = START + datetime.timedelta(hours=2 * round_number)
+    total = PROCESSES * THREADS
+    return [
+        base + datetime.timedelta(minutes=((worker * THREADS + i) * 29) // total)
+        for i in range(THREADS)
+    ]
+
+
+def book_round(path, round_number, worker):
+    """
+    Fa les reserves d'un procés en una ronda, des de THREADS fils que
+    comparteixen la cua d'escriptura del procés.
+
+    Returns:
+        Nombre de cites creades
+    """
+    engine = database.create_database_engine(f"sqlite:///{path}")
+    queue = WriteQueue(engine=engine)
+
+    def book(date):
+        appointment = new_appointment(date)
+        try:
+            queue.submit(lambda conn: insert_appointment(conn, appointment))
+            return 1
+        except AppointmentConflictError:
+            return 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            return sum(executor.map(book, round_dates(round_number, worker)))
+    finally:
+        engine.dispose()
+
+
+def double_bookings(engine):
+    """
+    Retorna les parelles de cites actives del mateix doctor i centre a la
+    mateixa franja o dins del marge de 30 minuts, de qualsevol partició.
+    """
+    window = int(CONFLICT_WINDOW.total_seconds())
+    with engine.connect() as conn:
+        union = " UNION ALL ".join(
+            f"SELECT * FROM {table.name}" for table in active_tables_between(conn)
+        )
+        return conn.execute(
+            text(
+                f"WITH cites AS ({union}) "
+                "SELECT a.id_appointment, b.id_appointment, a.date, b.date "
+                "FROM cites a JOIN cites b "
+                "ON a.id_doctor = b.id_doctor AND a.id_center = b.id_center "
+                "AND a.id_appointment < b.id_appointment "
+                "WHERE a.status = 'ACTIVE' AND b.status = 'ACTIVE' "
+                "AND (a.slot = b.slot OR abs(strftime('%s', a.date) "
+                f"- strftime('%s', b.date)) <= {window})"
+            )
+        ).all()
+
+
+def unique_index_rejects_duplicate(engine):
+    """
+    Insereix directament (sense la comprovació de conflictes) una segona cita
+    activa a la franja d'una cita existent i comprova que l'índex únic de la
+    partició la rebutja, però que accepta una cita cancel·lada a la mateixa
+    franja.
+    """
+    date = START - datetime.timedelta(days=1)
+    table = active_table(active_table_name(date))
+    with engine.begin() as conn:
+        insert_appointment(conn, new_appointment(date))
+
+    def insert_raw(status):
+        appointment = new_appointment(date + datetime.timedelta(minutes=1), status)
+        values = {c.name: getattr(appointment, c.name) for c in table.columns}
+        values["id_appointment"] = None
+        values["slot"] = slot_for(appointment.date)
+        with engine.begin() as conn:
+            conn.execute(table.insert().values(values))
+
+    try:
+        insert_raw(AppointmentStatusEnum.ACTIVE)
+        print("FALLA  l'índex únic accepta dues cites actives a la mateixa franja")
+        return False
+    except IntegrityError:
+        pass
+    try:
+        insert_raw(AppointmentStatusEnum.CANCELLED)
+    except IntegrityError:
+        print("FALLA  l'índex únic rebutja una cita cancel·lada a una franja ocupada")
+        return False
+    print("OK     l'índex únic només rebutja les cites actives duplicades")
+    return True
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "appointments.db")
+    engine = database.create_database_engine(f"sqlite:///{path}")
+    database.init_schema(engine)
+
+    failed = False
+    # Cada procés importa els mòduls i crea el seu engine des de zero
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=PROCESSES, mp_context=context) as executor:
+        for round_number in range(ROUNDS):
+            created = sum(
+                executor.map(
+                    book_round,
+                    [path] * PROCESSES,
+                    [round_number] * PROCESSES,
+                    range(PROCESSES),
+                )
+            )
+            status = "OK   " if created == 1 else "FALLA"
+            print(
+                f"{status}  ronda {round_number + 1}: {PROCESSES * THREADS} "
+                f"reserves, {created} creades"
+            )
+            failed = failed or created != 1
+
+    pairs = double_bookings(engine)
+    for first, second, first_date, second_date in pairs:
+        print(
+            f"FALLA  cites {first} ({first_date}) i {second} ({second_date}) "
+            "se solapen"
+        )
+    failed = failed or bool(pairs)
+    failed = not unique_index_rejects_duplicate(engine) or failed
+    engine.dispose()
+
+    print()
+    if failed:
+        print("Resultat: S'HAN DETECTAT DOBLES RESERVES")
+    else:
+        print("Resultat: CAP DOBLE RESERVA")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Perfils de configuració del servei de cites.
+
+create_app(config) rep el nom d'un perfil (o una classe de configuració). Si
+no se n'indica cap, es fa servir el de la variable d'entorn APP_CONFIG (o
+FLASK_ENV), i per defecte "development".
+"""
+
+import os
+import tempfile
+
+
+class Config:
+    DEBUG = False
+    TESTING = False
+    # Ruta de la base de dades (None: la de DATABASE_PATH)
+    DATABASE_PATH = None
+    # Escriure totes les sentències SQL a la sortida (només per depurar: per
+    # trobar consultes lentes, vegeu slowlog.py)
+    SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+    # Iniciar els fils de sincronització i d'arxivament
+    START_WORKERS = True
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+    DATABASE_PATH = os.getenv(
+        "TEST_DATABASE_PATH",
+        os.path.join(tempfile.gettempdir(), "appointments_test.db"),
+    )
+    SQL_ECHO = False
+    # Les proves fallen si una ruta supera el seu pressupost de consultes
+    QUERY_BUDGET_MODE = "enforce"
+    START_WORKERS = False
+
+
+CONFIGS = {
+    "development": DevelopmentConfig,
+    "production": ProductionConfig,
+    "testing": TestingConfig,
+}
+
+
+def get_config(config=None):
+    """Retorna la classe de configuració d'un perfil (pel nom) o la mateixa classe."""
+    if config is None:
+        config = os.getenv("APP_CONFIG", os.getenv("FLASK_ENV", "development"))
+    if isinstance(config, str):
+        try:
+            return CONFIGS[config]
+        except KeyError:
+            raise ValueError(f"Perfil de configuració desconegut: {config}")
+    return config
@@ -1,18 +1,51 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session
-from models import Base
+from models import Base, SLOT_SECONDS
+from versioning import init_table_versions
+from partitions import init_partitions, migrate_active_partitions, refresh_partitions
+from shards import init_shards
+from metrics import engine_options, instrument_engine
+from slowlog import instrument_slow_queries
+from querybudget import count_queries
 
 # Configuració de la base de dades
 DATABASE_PATH = os.getenv("DATABASE_PATH", "/app/data/appointments.db")
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
-# Crear engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=True,  # Canvia a False en producció
-)
+# Versió de l'esquema (es desa a PRAGMA user_version de cada base de dades).
+# Cal incrementar-la quan es modifiquen els models, les migracions o els
+# triggers.
+SCHEMA_VERSION = 5
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Activa el mode WAL: els lectors no bloquegen l'escriptor de la cua
+    d'escriptura (write_queue) ni a l'inrevés.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def create_database_engine(url, echo=False):
+    """Crea l'engine d'una base de dades de cites (la principal o un shard)."""
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        echo=echo,
+        **engine_options(url),
+    )
+    event.listen(new_engine, "connect", set_sqlite_pragmas)
+    instrument_engine(new_engine)
+    instrument_slow_queries(new_engine)
+    count_queries(new_engine)
+    return new_engine
+
+
+# Crear engine (no es connecta fins a la primera consulta)
+engine = create_database_engine(DATABASE_URL, os.getenv("SQL_ECHO", "0") == "1")
 
 # Crear session factory
 SessionLocal = scoped_session(
@@ -20,6 +53,162 @@ SessionLocal = scoped_session(
 )
 
 
+def configure_engine(path=None, echo=None):
+    """
+    Aplica la configuració de l'aplicació: torna a crear l'engine si canvia
+    la ruta de la base de dades i activa o desactiva el registre de SQL.
+    S'ha de cridar abans de crear els shards.
+    """
+    global engine, DATABASE_PATH, DATABASE_URL
+    if path and path != DATABASE_PATH:
+        engine.dispose()
+        DATABASE_PATH = path
+        DATABASE_URL = f"sqlite:///{path}"
+        engine = create_database_engine(DATABASE_URL)
+        SessionLocal.remove()
+        SessionLocal.configure(bind=engine)
+    if echo is not None:
+        engine.echo = echo
+
+
+def schema_version(bind):
+    """Retorna la versió de l'esquema desada a la base de dades."""
+    with bind.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate_slots(bind):
+    """
+    Afegeix la columna slot a les bases de dades creades abans que existís,
+    calculant la franja de les cites. L'índex únic de reserva de franges el
+    crea migrate_indexes.
+    """
+    columns = {c["name"] for c in inspect(bind).get_columns("appointments")}
+    if "slot" in columns:
+        return
+    with bind.begin() as conn:
+        conn.execute(text("ALTER TABLE appointments ADD COLUMN slot INTEGER"))
+        conn.execute(
+            text(
+                "UPDATE appointments "
+                f"SET slot = CAST(strftime('%s', date) AS INTEGER) / {SLOT_SECONDS}"
+            )
+        )
+
+
+def duplicate_slots(bind):
+    """
+    Cerca franges amb més d'una cita activa del mateix doctor i centre, que
+    impedeixen crear l'índex únic ux_appointments_slot (dades d'abans que
+    existís).
+
+    Returns:
+        Files (id_doctor, id_center, slot, ids de les cites separats per comes)
+    """
+    with bind.connect() as conn:
+        return conn.execute(
+            text(
+                "SELECT id_doctor, id_center, slot, group_concat(id_appointment) "
+                "FROM appointments WHERE status = 'ACTIVE' "
+                "GROUP BY id_doctor, id_center, slot HAVING count(*) > 1"
+            )
+        ).all()
+
+
+def ensure_indexes(bind, table, skip=()):
+    """
+    Crea els índexs de table que no existeixen i torna a crear els que
+    existeixen amb unes altres columnes (índexs ampliats en una versió
+    posterior). Els índexs de skip no es toquen.
+    """
+    existing = {
+        index["name"]: index["column_names"]
+        for index in inspect(bind).get_indexes(table.name)
+    }
+    for index in table.indexes:
+        if index.name in skip:
+            continue
+        columns = existing.get(index.name)
+        if columns == [column.name for column in index.columns]:
+            continue
+        if columns is not None:
+            index.drop(bind=bind)
+        index.create(bind=bind)
+
+
+def migrate_indexes(bind):
+    """
+    Posa al dia els índexs dels models a les bases de dades creades abans que
+    es definissin o es modifiquessin (create_all només els crea amb les taules
+    noves).
+
+    Si hi ha cites actives duplicades a la mateixa franja, les mostra i no
+    crea l'índex únic de reserva de franges: s'han de cancel·lar o moure les
+    cites repetides i tornar a arrencar el servei.
+
+    Returns:
+        True si s'han creat tots els índexs
+    """
+    skip = set()
+    existing = {index["name"] for index in inspect(bind).get_indexes("appointments")}
+    if "ux_appointments_slot" not in existing:
+        duplicates = duplicate_slots(bind)
+        if duplicates:
+            skip.add("ux_appointments_slot")
+            print(
+                "Error: no es pot crear l'índex ux_appointments_slot perquè hi ha "
+                f"{len(duplicates)} franges amb més d'una cita activa:"
+            )
+            for id_doctor, id_center, slot, ids in duplicates:
+                print(
+                    f"    doctor {id_doctor}, centre {id_center}, franja {slot}: "
+                    f"cites {ids}"
+                )
+    for table in Base.metadata.sorted_tables:
+        ensure_indexes(bind, table, skip)
+    return not skip
+
+
+def init_schema(bind):
+    """
+    Crea les taules, aplica les migracions i prepara els comptadors de versió
+    i les particions en una base de dades (la principal o un shard).
+
+    Si la versió desada coincideix amb SCHEMA_VERSION, només es torna a llegir
+    la llista de particions. Si no s'han pogut crear tots els índexs, les
+    cites de la taula appointments no es reparteixen per mesos (les
+    particions tenen l'índex únic de franja), la versió no s'actualitza i les
+    migracions es tornen a aplicar en la propera arrencada.
+
+    Returns:
+        True si s'ha inicialitzat l'esquema, False si ja era al dia
+    """
+    if schema_version(bind) == SCHEMA_VERSION:
+        with bind.connect() as conn:
+            refresh_partitions(conn)
+        return False
+
+    Base.metadata.create_all(bind=bind)
+    migrate_slots(bind)
+    complete = migrate_indexes(bind)
+    init_table_versions(
+        bind,
+        [
+            "appointments",
+            "patients_ref",
+            "doctors_ref",
+            "centers_ref",
+        ],
+    )
+    init_partitions(bind)
+    if complete:
+        migrate_active_partitions(bind)
+        with bind.begin() as conn:
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    return True
+
+
 def init_db():
     """Inicialitza la base de dades creant totes les taules."""
-    Base.metadata.create_all(bind=engine)
+    init_schema(engine)
+    init_shards()
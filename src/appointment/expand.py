@@ -0,0 +1,153 @@
+"""
+Expansió dels llistats de cites amb les dades de pacients, doctors i centres.
+
+Per a cada tipus d'entitat es recullen els identificadors diferents de la
+pàgina de resultats i es resolen amb una sola consulta al model de lectura
+local. Només els identificadors que encara no s'han sincronitzat es demanen
+al servei admin, en lots de com a molt REMOTE_BATCH_SIZE identificadors i amb
+la capçalera d'autorització de qui fa la petició: el servei admin decideix
+què pot veure cada rol.
+"""
+
+import json
+import os
+
+from sqlalchemy import func, select
+
+import admin_client
+from models import CenterRef, DoctorRef, PatientRef
+
+# Identificadors per petició al servei admin (el seu límit MAX_IDS del
+# paràmetre ids)
+REMOTE_BATCH_SIZE = int(os.getenv("EXPAND_REMOTE_BATCH_SIZE", "1000"))
+
+# entitat -> (model local, clau compartida amb la cita, endpoint admin, camps)
+EXPANDABLE = {
+    "patient": (
+        PatientRef,
+        "id_patient",
+        "/admin/pacients",
+        ("id_patient", "name", "status"),
+    ),
+    "doctor": (
+        DoctorRef,
+        "id_doctor",
+        "/admin/doctors",
+        ("id_doctor", "name", "specialty"),
+    ),
+    "center": (
+        CenterRef,
+        "id_center",
+        "/admin/centres",
+        ("id_center", "name", "address"),
+    ),
+}
+
+
+def parse_expand(value):
+    """
+    Valida el paràmetre expand (llista separada per comes).
+
+    Returns:
+        Llista d'entitats a expandir sense duplicats
+
+    Raises:
+        ValueError: si alguna entitat no és expandible
+    """
+    if not value:
+        return []
+    entities = []
+    for entity in value.split(","):
+        entity = entity.strip()
+        if entity not in EXPANDABLE:
+            raise ValueError(entity)
+        if entity not in entities:
+            entities.append(entity)
+    return entities
+
+
+def _load_local(db, model, key, fields, ids):
+    """
+    Obté les entitats del model de lectura local amb una sola consulta. Els
+    identificadors es passen com una llista JSON (json_each) en un sol
+    paràmetre, de manera que el límit de paràmetres de SQLite no obliga a
+    partir-los en lots.
+    """
+    column = getattr(model, key)
+    requested = func.json_each(json.dumps(sorted(ids))).table_valued("value")
+    return {
+        getattr(ref, key): {f: getattr(ref, f) for f in fields}
+        for ref in db.query(model).filter(column.in_(select(requested.c.value)))
+    }
+
+
+def _load_remote(path, key, fields, ids, auth_header):
+    """
+    Obté del servei admin les entitats que encara no s'han sincronitzat
+    localment, en lots de REMOTE_BATCH_SIZE identificadors.
+
+    La petició es fa amb la capçalera d'autorització de qui ha fet la
+    consulta, de manera que només s'expandeixen les entitats que el seu rol
+    pot veure. Els lots que fallen es deixen sense expandir i l'error s'escriu
+    a la sortida estàndard.
+
+    Returns:
+        Tupla (entitats per identificador, cert si cap lot ha fallat). Un 403
+        no compta com a error: el rol no pot veure aquestes entitats.
+    """
+    found = {}
+    complete = True
+    ids = sorted(ids)
+    for i in range(0, len(ids), REMOTE_BATCH_SIZE):
+        batch = ids[i : i + REMOTE_BATCH_SIZE]
+        try:
+            resp = admin_client.get(
+                path, auth_header, params={"ids": ",".join(str(n) for n in batch)}
+            )
+        except Exception as e:
+            print(f"Error en expandir {len(batch)} identificadors de {path}: {e}")
+            complete = False
+            continue
+        if resp.status_code == 403:
+            continue
+        if resp.status_code != 200:
+            print(
+                f"Error en expandir {len(batch)} identificadors de {path}: "
+                f"resposta {resp.status_code}"
+            )
+            complete = False
+            continue
+        found.update({e[key]: {f: e.get(f) for f in fields} for e in resp.json()})
+    return found, complete
+
+
+def expand_items(db, items, entities, auth_header):
+    """
+    Afegeix a cada cita serialitzada l'objecte de cada entitat demanada.
+
+    Args:
+        db: Sessió de la base de dades
+        items: Llista de cites serialitzades (es modifica in situ)
+        entities: Entitats a expandir ('patient', 'doctor', 'center')
+        auth_header: Capçalera Authorization de la petició, per demanar al
+            servei admin les entitats que no s'han sincronitzat
+
+    Returns:
+        Cert si s'han pogut consultar totes les entitats (la resposta es pot
+        desar a la memòria cau)
+    """
+    complete = True
+    for entity in entities:
+        model, key, path, fields = EXPANDABLE[entity]
+        ids = {item[key] for item in items}
+        if not ids:
+            continue
+        found = _load_local(db, model, key, fields, ids)
+        missing = ids - found.keys()
+        if missing:
+            remote, loaded = _load_remote(path, key, fields, missing, auth_header)
+            found.update(remote)
+            complete = complete and loaded
+        for item in items:
+            item[entity] = found.get(item[key])
+    return complete
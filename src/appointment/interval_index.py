@@ -0,0 +1,263 @@
+"""
+Índex en memòria de les cites actives per doctor, centre i mes.
+
+Per a cada doctor i centre es manté, per mesos, la llista ordenada de les
+dates de les cites actives, de manera que la comprovació del marge de 30
+minuts i el càlcul de franges lliures es resolen amb una cerca binària
+(O(log n)). Mentre les cites no canvien, només cal llegir-ne la versió (per
+clau primària) en lloc de fer una consulta per rang a la base de dades.
+
+Cada mes d'un doctor i centre té el seu comptador a table_versions (vegeu
+doctor_counter a partitions.py), que els triggers incrementen a cada
+escriptura de qualsevol procés. La llista es carrega la primera vegada que es
+consulta, només de la partició del mes, i es desa amb la versió que hi havia
+abans de llegir-la. Els endpoints de crear, cancel·lar i eliminar cites la
+mantenen al dia amb add i remove, que reben la versió posterior a
+l'escriptura: si no és la següent de la desada, algun altre procés també hi
+ha escrit i la llista es torna a carregar. Així la base de dades continua
+sent la font de veritat, i una escriptura només fa tornar a carregar el mes
+del doctor i centre afectat.
+"""
+
+import bisect
+import datetime
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select, union_all
+
+from models import AppointmentStatusEnum, TableVersion
+from partitions import active_tables_between, doctor_counter
+from shards import shard_for_center
+from versioning import get_versions
+
+# Nombre màxim de mesos (doctor, centre, mes) carregats alhora
+INTERVAL_INDEX_MAX_KEYS = int(os.getenv("INTERVAL_INDEX_MAX_KEYS", "1024"))
+
+
+def _month(date):
+    """Primer instant del mes d'una data."""
+    return datetime.datetime(date.year, date.month, 1)
+
+
+def _next_month(month):
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months(start, end):
+    """Primer instant de cada mes entre start i end (inclosos)."""
+    month = _month(start)
+    while month <= end:
+        yield month
+        month = _next_month(month)
+
+
+def read_version(conn, id_doctor, id_center, date):
+    """
+    Llegeix la versió de les cites d'un doctor i centre del mes de date. Es
+    crida dins de la transacció d'una escriptura, per passar-la a add o
+    remove.
+    """
+    version = conn.execute(
+        select(TableVersion.version).where(
+            TableVersion.table_name == doctor_counter(id_doctor, id_center, date)
+        )
+    ).scalar()
+    return version or 0
+
+
+class IntervalIndex:
+    """Dates de les cites actives ordenades per cada doctor, centre i mes."""
+
+    def __init__(self, maxkeys=INTERVAL_INDEX_MAX_KEYS):
+        self.maxkeys = maxkeys
+        # (id_doctor, id_center, mes) -> (versió, llista ordenada de
+        # (date, id_appointment)). Les llistes no es modifiquen mai: add i
+        # remove en desen una de nova, de manera que es poden llegir sense lock
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _version(self, key):
+        """Versió actual de les cites del mes d'un doctor i centre."""
+        db = shard_for_center(key[1]).SessionLocal()
+        try:
+            return get_versions(db, (doctor_counter(*key),))[0]
+        finally:
+            db.close()
+
+    def _load(self, key):
+        """Carrega de la partició del mes les cites actives d'un doctor i centre."""
+        id_doctor, id_center, month = key
+        db = shard_for_center(id_center).SessionLocal()
+        try:
+            conn = db.connection()
+            tables = active_tables_between(conn, month, month)
+            if not tables:
+                return []
+            rows = conn.execute(
+                union_all(
+                    *[
+                        select(table.c.date, table.c.id_appointment).where(
+                            table.c.id_doctor == id_doctor,
+                            table.c.id_center == id_center,
+                            table.c.status == AppointmentStatusEnum.ACTIVE,
+                            table.c.date >= month,
+                            table.c.date < _next_month(month),
+                        )
+                        for table in tables
+                    ]
+                )
+            ).all()
+        finally:
+            db.close()
+        with self._lock:
+            self.loads += 1
+        return sorted((date, id_appointment) for date, id_appointment in rows)
+
+    def _store(self, key, version, intervals):
+        """Desa la llista d'un mes. Cal tenir el lock."""
+        self._keys[key] = (version, intervals)
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.maxkeys:
+            self._keys.popitem(last=False)
+
+    def _intervals(self, key):
+        """
+        Retorna la llista d'un mes, carregant-la si no hi és o si les cites
+        han canviat des que es va carregar.
+        """
+        # La versió es llegeix abans que les cites: si hi ha una escriptura
+        # entremig, la llista es desa amb la versió antiga i es tornarà a
+        # carregar a la consulta següent
+        version = self._version(key)
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[0] == version:
+                self._keys.move_to_end(key)
+                return entry[1]
+        # Es carrega fora del lock perquè les consultes dels altres doctors no
+        # l'esperin; si un altre fil ha desat mentrestant una versió igual o
+        # més nova, es conserva la seva
+        intervals = self._load(key)
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or entry[0] < version:
+                self._store(key, version, intervals)
+        return intervals
+
+    def _update(self, id_doctor, id_center, date, version, change):
+        """
+        Aplica change a la llista del mes de date si la versió desada és
+        l'anterior a version (l'escriptura és l'única des que es va carregar).
+        Si no, la llista es torna a carregar a la consulta següent.
+        """
+        key = (int(id_doctor), int(id_center), _month(date))
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or entry[0] != version - 1:
+                return
+            intervals = list(entry[1])
+            change(intervals)
+            self._store(key, version, intervals)
+
+    def find_conflict(self, id_doctor, id_center, date, window):
+        """
+        Busca una cita activa a menys de window de date.
+
+        Returns:
+            L'identificador de la cita que entra en conflicte o None
+        """
+        for month in _months(date - window, date + window):
+            intervals = self._intervals((int(id_doctor), int(id_center), month))
+            i = bisect.bisect_left(intervals, (date - window,))
+            if i < len(intervals) and intervals[i][0] <= date + window:
+                return intervals[i][1]
+        return None
+
+    def busy_between(self, id_doctor, id_center, start, end):
+        """Retorna les dates de les cites actives entre start i end (inclosos)."""
+        busy = []
+        for month in _months(start, end):
+            intervals = self._intervals((int(id_doctor), int(id_center), month))
+            lo = bisect.bisect_left(intervals, (start,))
+            hi = bisect.bisect_right(intervals, (end, float("inf")))
+            busy.extend(date for date, _ in intervals[lo:hi])
+        return busy
+
+    def add(self, id_doctor, id_center, date, id_appointment, version):
+        """
+        Afegeix una cita activa creada per aquest procés.
+
+        Args:
+            version: Versió del mes del doctor i centre just després de la
+                inserció (read_version dins de la mateixa transacció)
+        """
+        self._update(
+            id_doctor,
+            id_center,
+            date,
+            version,
+            lambda intervals: bisect.insort(intervals, (date, id_appointment)),
+        )
+
+    def remove(self, id_doctor, id_center, date, id_appointment, version):
+        """Treu una cita cancel·lada o eliminada per aquest procés (vegeu add)."""
+
+        def change(intervals):
+            i = bisect.bisect_left(intervals, (date, id_appointment))
+            if i < len(intervals) and intervals[i] == (date, id_appointment):
+                del intervals[i]
+
+        self._update(id_doctor, id_center, date, version, change)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "maxkeys": self.maxkeys,
+                "entries": sum(len(entry[1]) for entry in self._keys.values()),
+                "loads": self.loads,
+            }
+
+
+# Jornada i durada de les franges per calcular la disponibilitat
+AVAILABILITY_START = os.getenv("AVAILABILITY_START", "08:00")
+AVAILABILITY_END = os.getenv("AVAILABILITY_END", "20:00")
+AVAILABILITY_STEP = datetime.timedelta(
+    minutes=int(os.getenv("AVAILABILITY_STEP_MINUTES", "30"))
+)
+
+
+def free_slots(index, id_doctor, id_center, day, window):
+    """
+    Calcula les hores d'inici lliures d'un dia dins de la jornada.
+
+    Una hora és lliure si no hi ha cap cita activa a menys de window. Les
+    cites ocupades s'obtenen de l'índex ja ordenades, i es recorren amb un
+    sol punter alhora que les franges candidates.
+
+    Returns:
+        Llista de datetimes lliures
+    """
+    start = datetime.datetime.combine(
+        day, datetime.time.fromisoformat(AVAILABILITY_START)
+    )
+    end = datetime.datetime.combine(day, datetime.time.fromisoformat(AVAILABILITY_END))
+    busy = index.busy_between(id_doctor, id_center, start - window, end + window)
+
+    free = []
+    i = 0
+    candidate = start
+    while candidate < end:
+        # Salta les cites que ja queden massa enrere
+        while i < len(busy) and busy[i] < candidate - window:
+            i += 1
+        if i == len(busy) or busy[i] > candidate + window:
+            free.append(candidate)
+        candidate += AVAILABILITY_STEP
+    return free
+
+
+interval_index = IntervalIndex()
@@ -1,9 +1,28 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    LargeBinary,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
+import calendar
 import enum
 
 Base = declarative_base()
 
+# Durada de les franges de reserva en segons
+SLOT_SECONDS = 30 * 60
+
+
+def slot_for(date):
+    """Retorna la franja de 30 minuts a què pertany una data (sense zona horària)."""
+    return calendar.timegm(date.timetuple()) // SLOT_SECONDS
+
 
 class AppointmentStatusEnum(enum.Enum):
     ACTIVE = "ACTIVE"
@@ -11,7 +30,36 @@ class AppointmentStatusEnum(enum.Enum):
 
 
 class Appointment(Base):
+    """
+    Cita. Les cites es desen a les particions mensuals (vegeu partitions.py),
+    que tenen les mateixes columnes; aquesta taula només conserva les cites
+    que encara no s'han pogut repartir per mesos.
+    """
+
     __tablename__ = "appointments"
+    __table_args__ = (
+        # Reserva de franja: la base de dades impedeix dues cites actives del
+        # mateix doctor i centre a la mateixa franja de 30 minuts
+        Index(
+            "ux_appointments_slot",
+            "id_doctor",
+            "id_center",
+            "slot",
+            unique=True,
+            sqlite_where=text("status = 'ACTIVE'"),
+        ),
+        # Llistats i comprovació de conflictes: qualsevol filtre per doctor,
+        # centre, pacient o rang de dates es resol amb un índex, i les cites
+        # queden ordenades per data
+        Index("ix_appointments_doctor_date", "id_doctor", "date"),
+        Index("ix_appointments_center_date", "id_center", "date"),
+        Index("ix_appointments_patient_date", "id_patient", "date"),
+        # L'índex per data conté les columnes de l'informe d'utilització
+        # (reports.py), que es calcula sense llegir les files de la taula
+        Index(
+            "ix_appointments_date", "date", "id_doctor", "id_center", "status", "slot"
+        ),
+    )
 
     id_appointment = Column(Integer, primary_key=True, autoincrement=True)
     date = Column(DateTime, nullable=False)
@@ -21,6 +69,104 @@ class Appointment(Base):
     id_doctor = Column(Integer, nullable=False)
     id_center = Column(Integer, nullable=False)
     id_user_register = Column(Integer, nullable=False)
+    # Franja de 30 minuts (segons des de l'època / 1800) de la data de la cita
+    slot = Column(Integer, nullable=True)
 
     def __repr__(self):
         return f"<Appointment(id_cita={self.id_cita}, data='{self.data}', status='{self.status.value}')>"
+
+
+# Nom de la seqüència d'identificadors de les cites a id_sequence
+APPOINTMENT_SEQUENCE = "appointments"
+
+
+class IdSequence(Base):
+    """
+    Últim identificador assignat a les cites. Com que les cites es poden
+    eliminar o arxivar, l'identificador no es pot deduir del màxim de la
+    taula sense risc de reutilitzar-lo.
+    """
+
+    __tablename__ = "id_sequence"
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False)
+
+
+# MODEL DE LECTURA LOCAL DE LES DADES DEL SERVEI ADMIN =========================
+
+
+class PatientRef(Base):
+    """Còpia local de les dades dels pacients per mostrar les cites."""
+
+    __tablename__ = "patients_ref"
+
+    id_patient = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=True)
+
+    def __repr__(self):
+        return f"<PatientRef(id_patient={self.id_patient}, name='{self.name}')>"
+
+
+class DoctorRef(Base):
+    """Còpia local de les dades dels doctors per mostrar les cites."""
+
+    __tablename__ = "doctors_ref"
+
+    id_doctor = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    specialty = Column(String(100), nullable=True)
+
+    def __repr__(self):
+        return f"<DoctorRef(id_doctor={self.id_doctor}, name='{self.name}')>"
+
+
+class CenterRef(Base):
+    """Còpia local de les dades dels centres per mostrar les cites."""
+
+    __tablename__ = "centers_ref"
+
+    id_center = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    address = Column(String(255), nullable=True)
+
+    def __repr__(self):
+        return f"<CenterRef(id_center={self.id_center}, name='{self.name}')>"
+
+
+class SyncState(Base):
+    """Estat de la sincronització amb el feed de canvis del servei admin."""
+
+    __tablename__ = "sync_state"
+
+    name = Column(String(50), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)
+
+
+class TableVersion(Base):
+    """Comptador de versions d'una taula, incrementat per triggers a cada escriptura."""
+
+    __tablename__ = "table_versions"
+
+    table_name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """Resposta desada d'una petició amb capçalera Idempotency-Key."""
+
+    __tablename__ = "idempotency_keys"
+
+    # Resum SHA-1 de l'usuari, l'endpoint i la clau enviada pel client
+    key = Column(String(40), primary_key=True)
+    # Resum SHA-1 del cos de la petició, per detectar reutilitzacions de la clau
+    fingerprint = Column(String(40), nullable=False)
+    # NULL mentre la primera petició encara s'està processant
+    status_code = Column(Integer, nullable=True)
+    # Cos de la resposta comprimit amb zlib
+    body = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key='{self.key}', status_code={self.status_code})>"
@@ -0,0 +1,434 @@
+"""
+Particions mensuals de les cites.
+
+Les cites es desen en una taula per mes segons la seva data: les actuals a
+appointments_AAAA_MM i les que el procés d'arxivament ha mogut a l'arxiu a
+appointments_archive_AAAA_MM. Les particions es creen automàticament: les
+actuals quan s'hi insereix o s'hi desplaça la primera cita del mes, i les de
+l'arxiu quan s'hi arxiva la primera. Les consultes per rang de dates i les
+comprovacions de conflictes només llegeixen les particions del rang.
+Eliminar o copiar un mes d'històric és un DROP TABLE o una còpia d'una taula.
+
+La taula appointments (el model Appointment) fa de partició per defecte: només
+conté les cites de bases de dades anteriors a les particions que encara no
+s'han pogut repartir per mesos (vegeu migrate_active_partitions), i només es
+consulta si en té.
+
+La llista de particions de cada base de dades es desa en memòria amb la
+versió de l'esquema (PRAGMA schema_version), que SQLite incrementa quan
+qualsevol procés crea o elimina una taula. Abans d'encaminar una consulta es
+compara amb la versió actual i, si ha canviat, es torna a llegir
+sqlite_master: les particions creades per un altre worker es veuen a la
+consulta següent.
+
+Les particions actuals comparteixen el comptador de versions "appointments"
+de la taula appointments, i les de l'arxiu el comptador
+"appointments_archive"; tots dos formen part de l'ETag dels llistats. Les
+cites actuals també tenen un comptador per mes, doctor i centre (vegeu
+doctor_counter), amb què l'índex en memòria (interval_index.py) només torna a
+carregar les dates afectades per cada escriptura.
+"""
+
+import re
+import threading
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    text,
+    union_all,
+)
+
+import database
+from querybudget import uncounted
+from models import APPOINTMENT_SEQUENCE, Appointment, AppointmentStatusEnum, IdSequence
+from versioning import create_key_version_triggers, create_version_triggers
+
+ACTIVE_PREFIX = "appointments_"
+ARCHIVE_PREFIX = "appointments_archive_"
+# Noms dels comptadors de versions compartits per les particions
+ACTIVE_COUNTER = "appointments"
+ARCHIVE_COUNTER = "appointments_archive"
+ACTIVE_NAME = re.compile(r"appointments_\d{4}_\d{2}")
+# Comptador de cada cita actual: partició del mes, doctor i centre
+# (ex: appointments_2026_07:2:1), el mateix nom que calcula doctor_counter
+DOCTOR_COUNTER = (
+    "'appointments_' || strftime('%Y_%m', {row}.date) "
+    "|| ':' || {row}.id_doctor || ':' || {row}.id_center"
+)
+
+# Les particions no formen part de Base.metadata: no les crea create_all
+partition_metadata = MetaData()
+
+# Particions existents de cada base de dades:
+# engine -> (schema_version, noms actuals, noms de l'arxiu, la taula
+# appointments té cites)
+_partitions = {}
+_partitions_lock = threading.Lock()
+
+
+def _appointment_columns():
+    """Columnes d'una partició, les mateixes que les del model Appointment."""
+    return [
+        Column("id_appointment", Integer, primary_key=True, autoincrement=False),
+        Column("date", DateTime, nullable=False),
+        Column("reason", String(255), nullable=False),
+        Column("status", Enum(AppointmentStatusEnum), nullable=False),
+        Column("id_patient", Integer, nullable=False),
+        Column("id_doctor", Integer, nullable=False),
+        Column("id_center", Integer, nullable=False),
+        Column("id_user_register", Integer, nullable=False),
+        Column("slot", Integer, nullable=True),
+    ]
+
+
+def _date_indexes(name):
+    """Índexs de llistats i informes, els mateixos que els d'Appointment."""
+    return [
+        Index(f"ix_{name}_doctor_date", "id_doctor", "date"),
+        Index(f"ix_{name}_center_date", "id_center", "date"),
+        Index(f"ix_{name}_patient_date", "id_patient", "date"),
+        Index(f"ix_{name}_date", "date", "id_doctor", "id_center", "status", "slot"),
+    ]
+
+
+def active_table_name(date):
+    """Nom de la partició actual del mes d'una data."""
+    return f"{ACTIVE_PREFIX}{date.year:04d}_{date.month:02d}"
+
+
+def doctor_counter(id_doctor, id_center, date):
+    """Nom del comptador de versions de les cites d'un doctor i centre d'un mes."""
+    return f"{active_table_name(date)}:{int(id_doctor)}:{int(id_center)}"
+
+
+def active_table(name):
+    """Retorna la definició (Table) de la partició actual amb aquest nom."""
+    if name in partition_metadata.tables:
+        return partition_metadata.tables[name]
+    return Table(
+        name,
+        partition_metadata,
+        *_appointment_columns(),
+        # Reserva de franja, com ux_appointments_slot: totes les cites d'una
+        # franja són del mateix mes i, per tant, de la mateixa partició
+        Index(
+            f"ux_{name}_slot",
+            "id_doctor",
+            "id_center",
+            "slot",
+            unique=True,
+            sqlite_where=text("status = 'ACTIVE'"),
+        ),
+        *_date_indexes(name),
+    )
+
+
+def partition_name(date):
+    """Nom de la partició de l'arxiu del mes d'una data."""
+    return f"{ARCHIVE_PREFIX}{date.year:04d}_{date.month:02d}"
+
+
+def partition_table(name):
+    """Retorna la definició (Table) de la partició de l'arxiu amb aquest nom."""
+    if name in partition_metadata.tables:
+        return partition_metadata.tables[name]
+    return Table(
+        name,
+        partition_metadata,
+        *_appointment_columns(),
+        Column("archived_at", DateTime, nullable=False),
+        *_date_indexes(name),
+    )
+
+
+def _read_partitions(conn):
+    """Llegeix de sqlite_master les particions existents."""
+    version = conn.execute(text("PRAGMA schema_version")).scalar()
+    names = (
+        conn.execute(
+            text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name LIKE :prefix ORDER BY name"
+            ),
+            {"prefix": f"{ACTIVE_PREFIX}%"},
+        )
+        .scalars()
+        .all()
+    )
+    # Les cites noves ja no es desen a la taula appointments: si és buida, no
+    # tornarà a tenir cites
+    has_default = conn.execute(
+        select(func.max(Appointment.__table__.c.id_appointment))
+    ).scalar()
+    return (
+        version,
+        [name for name in names if ACTIVE_NAME.fullmatch(name)],
+        [name for name in names if name.startswith(ARCHIVE_PREFIX)],
+        has_default is not None,
+    )
+
+
+def _store(conn, state):
+    # La llista llegida dins d'una transacció d'escriptura pot incloure
+    # particions que encara no s'han confirmat (i que es poden desfer): es fa
+    # servir, però no es desa
+    if not conn.connection.dbapi_connection.in_transaction:
+        with _partitions_lock:
+            _partitions[conn.engine] = state
+    return state
+
+
+def refresh_partitions(conn):
+    """Torna a llegir de la base de dades la llista de particions existents."""
+    with uncounted():
+        return _store(conn, _read_partitions(conn))
+
+
+def _current_partitions(conn):
+    """
+    Llista de particions de la base de dades de conn. Només es torna a llegir
+    si l'esquema ha canviat des de l'última lectura (ex: un altre procés ha
+    creat una partició).
+    """
+    version = conn.execute(text("PRAGMA schema_version")).scalar()
+    with _partitions_lock:
+        state = _partitions.get(conn.engine)
+    if state is not None and state[0] == version:
+        return state
+    return refresh_partitions(conn)
+
+
+def _between(names, name_from, name_to):
+    # Els noms AAAA_MM s'ordenen igual que els mesos
+    return [
+        name
+        for name in names
+        if (name_from is None or name >= name_from)
+        and (name_to is None or name <= name_to)
+    ]
+
+
+def active_tables_between(conn, date_from=None, date_to=None):
+    """
+    Retorna les taules de cites actuals de la base de dades de conn que poden
+    contenir cites entre date_from i date_to (qualsevol dels dos límits pot
+    ser None): les particions actuals del rang i, si té cites, la taula
+    appointments.
+    """
+    _, active, _, has_default = _current_partitions(conn)
+    names = _between(
+        active,
+        active_table_name(date_from) if date_from else None,
+        active_table_name(date_to) if date_to else None,
+    )
+    tables = [active_table(name) for name in names]
+    return [Appointment.__table__] + tables if has_default else tables
+
+
+def partitions_between(conn, date_from=None, date_to=None):
+    """
+    Retorna les particions de l'arxiu de la base de dades de conn que poden
+    contenir cites entre date_from i date_to (qualsevol dels dos límits pot
+    ser None).
+    """
+    _, _, archive, _ = _current_partitions(conn)
+    names = _between(
+        archive,
+        partition_name(date_from) if date_from else None,
+        partition_name(date_to) if date_to else None,
+    )
+    return [partition_table(name) for name in names]
+
+
+def ensure_active_table(conn, name):
+    """Retorna la partició actual amb aquest nom i la crea si encara no existeix."""
+    table = active_table(name)
+    if name not in _current_partitions(conn)[1]:
+        with uncounted():
+            table.create(bind=conn, checkfirst=True)
+            create_version_triggers(conn, name, ACTIVE_COUNTER)
+            create_key_version_triggers(conn, name, DOCTOR_COUNTER)
+    return table
+
+
+def ensure_partition(conn, name):
+    """
+    Crea la partició de l'arxiu (i els seus triggers de versió) si encara no
+    existeix, i posa al dia els seus índexs si es va crear amb una versió
+    anterior.
+    """
+    table = partition_table(name)
+    table.create(bind=conn, checkfirst=True)
+    database.ensure_indexes(conn, table)
+    create_version_triggers(conn, name, ARCHIVE_COUNTER)
+    return table
+
+
+def union_of(tables, name):
+    """
+    Subconsulta amb les columnes del model Appointment de la unió de tables
+    (UNION ALL), o la taula mateixa si només n'hi ha una. SQLite aplica les
+    condicions de la consulta exterior a cada taula de la unió, amb els seus
+    índexs.
+    """
+    if len(tables) == 1:
+        return tables[0].alias(name)
+    columns = [c.name for c in Appointment.__table__.columns]
+    return union_all(
+        *[select(*[table.c[column] for column in columns]) for table in tables]
+    ).subquery(name)
+
+
+def locate_appointment(conn, id_appointment):
+    """
+    Cerca una cita actual per identificador a totes les taules de cites
+    actuals, amb una sola consulta (una cerca per clau primària a cada taula).
+
+    Returns:
+        (taula, estat) o (None, None) si no existeix
+    """
+    tables = active_tables_between(conn)
+    if not tables:
+        return None, None
+    row = conn.execute(
+        union_all(
+            *[
+                select(literal(i).label("i"), table.c.status).where(
+                    table.c.id_appointment == id_appointment
+                )
+                for i, table in enumerate(tables)
+            ]
+        )
+    ).first()
+    if row is None:
+        return None, None
+    return tables[row[0]], row[1]
+
+
+def relocate_rows(conn, table, *conditions):
+    """
+    Mou a la partició actual del seu mes les cites de la partició table que
+    compleixen conditions i ja no són del mes de la partició (ex: cites
+    desplaçades). Les de la taula appointments no es mouen.
+
+    Returns:
+        Llista de les particions on s'han mogut cites
+    """
+    if table is Appointment.__table__:
+        return []
+    month = func.strftime("%Y_%m", table.c.date)
+    outside = [*conditions, month != table.name[len(ACTIVE_PREFIX) :]]
+    months = conn.execute(select(month).where(*outside).distinct()).scalars().all()
+    targets = []
+    for target_month in months:
+        target = ensure_active_table(conn, f"{ACTIVE_PREFIX}{target_month}")
+        conn.execute(
+            insert(target).from_select(
+                [c.name for c in table.columns],
+                select(*table.columns).where(*outside, month == target_month),
+            )
+        )
+        targets.append(target)
+    if targets:
+        conn.execute(delete(table).where(*outside))
+    return targets
+
+
+def migrate_active_partitions(bind):
+    """
+    Reparteix per mesos les cites de la taula appointments (bases de dades
+    anteriors a les particions actuals). Abans desa a la seqüència
+    d'identificadors el màxim de la taula, que quedarà buida, perquè no es
+    reutilitzin.
+    """
+    table = Appointment.__table__
+    with bind.begin() as conn:
+        conn.execute(
+            insert(IdSequence)
+            .prefix_with("OR IGNORE")
+            .from_select(
+                [IdSequence.name, IdSequence.last_id],
+                select(
+                    literal(APPOINTMENT_SEQUENCE), func.max(table.c.id_appointment)
+                ).having(func.count() > 0),
+            )
+        )
+        months = conn.execute(
+            text("SELECT DISTINCT strftime('%Y_%m', date) FROM appointments")
+        ).scalars()
+        for month in list(months):
+            name = f"{ACTIVE_PREFIX}{month}"
+            ensure_active_table(conn, name)
+            conn.execute(
+                text(
+                    f"INSERT INTO {name} SELECT * FROM appointments "
+                    "WHERE strftime('%Y_%m', date) = :month"
+                ),
+                {"month": month},
+            )
+        conn.execute(text("DELETE FROM appointments"))
+    with bind.connect() as conn:
+        refresh_partitions(conn)
+
+
+def init_partitions(engine):
+    """
+    Prepara el comptador de versions de l'arxiu, carrega la llista de
+    particions i hi crea els índexs i els triggers de versió que faltin. Les cites d'una taula
+    appointments_archive única (anterior a les particions) es reparteixen per
+    mesos i la taula s'elimina.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO table_versions (table_name, version) "
+                "VALUES (:table, 0)"
+            ),
+            {"table": ARCHIVE_COUNTER},
+        )
+        legacy = conn.execute(
+            text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'appointments_archive'"
+            )
+        ).scalar()
+        if legacy:
+            months = conn.execute(
+                text(
+                    "SELECT DISTINCT strftime('%Y_%m', date) "
+                    "FROM appointments_archive"
+                )
+            ).scalars()
+            for month in list(months):
+                name = f"{ARCHIVE_PREFIX}{month}"
+                ensure_partition(conn, name)
+                conn.execute(
+                    text(
+                        f"INSERT INTO {name} SELECT * FROM appointments_archive "
+                        "WHERE strftime('%Y_%m', date) = :month"
+                    ),
+                    {"month": month},
+                )
+            conn.execute(text("DROP TABLE appointments_archive"))
+        # Índexs afegits després de crear les particions existents
+        for table in partitions_between(conn):
+            ensure_partition(conn, table.name)
+        create_key_version_triggers(conn, Appointment.__tablename__, DOCTOR_COUNTER)
+        for name in _current_partitions(conn)[1]:
+            database.ensure_indexes(conn, active_table(name))
+            create_version_triggers(conn, name, ACTIVE_COUNTER)
+            create_key_version_triggers(conn, name, DOCTOR_COUNTER)
+    with engine.connect() as conn:
+        refresh_partitions(conn)
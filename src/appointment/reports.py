@@ -0,0 +1,438 @@
+"""
+Informe d'utilització de les franges i de càrrega de treball.
+
+Per a un rang de dies, l'informe compta per setmana, doctor i centre les
+cites reservades (actives) i les cancel·lades, i en deriva:
+    - la capacitat: franges de la jornada (les mateixes que ofereix la
+      disponibilitat) dels dies del rang, per a cada doctor amb cites
+    - la utilització de les franges: reservades / capacitat
+    - la taxa de cancel·lació: cancel·lades / (reservades + cancel·lades)
+amb totals per setmana, per doctor, per centre i globals.
+
+Els recomptes es fan a la base de dades amb un GROUP BY per doctor, centre i
+setmana, amb una consulta per taula: les particions mensuals (actuals i de
+l'arxiu) de cada shard que toquen el rang. La setmana es calcula amb
+aritmètica entera sobre la franja (slot) i l'índex per data de cada partició
+conté totes les columnes de la consulta, de manera que no es llegeixen les
+files de la taula. Les consultes de taules diferents s'executen en paral·lel (sqlite3
+allibera el GIL mentre executa una consulta).
+
+Les mètriques derivades es calculen per columnes sobre el resultat agregat
+(una fila per doctor, centre i setmana, no per cita) en un fil en segon pla.
+L'endpoint espera l'informe com a màxim REPORT_WAIT segons; si encara no
+està, respon 202 i el client torna a fer la mateixa petició més tard. Les
+peticions simultànies amb els mateixos paràmetres comparteixen el càlcul, i
+els informes acabats es desen a report_cache (vegeu cache.py) amb les
+versions de les taules (table_versions) que hi havia abans de calcular-los:
+quan alguna canvia, l'informe es torna a calcular.
+
+Configuració (variables d'entorn):
+    REPORT_WAIT: segons que l'endpoint espera l'informe (per defecte 2)
+    REPORT_RETRY_AFTER: segons de la capçalera Retry-After de les respostes
+        202 (per defecte 2)
+    REPORT_QUERY_THREADS: consultes simultànies d'un informe (per defecte 4)
+"""
+
+import datetime
+import json
+import math
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from itertools import groupby
+from operator import add, sub
+
+from sqlalchemy import case, func, select
+
+from cache import report_cache
+from database import SessionLocal
+from interval_index import AVAILABILITY_END, AVAILABILITY_START, AVAILABILITY_STEP
+from models import (
+    AppointmentStatusEnum,
+    CenterRef,
+    DoctorRef,
+    SLOT_SECONDS,
+)
+from partitions import active_tables_between, partitions_between
+from shards import shards_for
+from versioning import get_versions
+
+REPORT_WAIT = float(os.getenv("REPORT_WAIT", "2"))
+REPORT_RETRY_AFTER = int(os.getenv("REPORT_RETRY_AFTER", "2"))
+REPORT_QUERY_THREADS = int(os.getenv("REPORT_QUERY_THREADS", "4"))
+
+SLOTS_PER_DAY = 24 * 60 * 60 // SLOT_SECONDS
+# Les franges es compten des de l'1/1/1970, que era dijous: sumant-hi 3 dies,
+# les setmanes comencen en dilluns
+WEEK_OFFSET_DAYS = 3
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def week_start(week):
+    """Data del dilluns d'una setmana (número de setmana des de 1970)."""
+    return EPOCH + datetime.timedelta(days=7 * week - WEEK_OFFSET_DAYS)
+
+
+def days_in_week(week, date_from, date_to):
+    """Dies d'una setmana que són dins del rang [date_from, date_to]."""
+    first = max(week_start(week), date_from)
+    last = min(week_start(week) + datetime.timedelta(days=6), date_to)
+    return max(0, (last - first).days + 1)
+
+
+def slots_per_workday():
+    """Franges de la jornada d'un dia, les mateixes que calcula free_slots."""
+    day = datetime.date.today()
+    start = datetime.datetime.combine(
+        day, datetime.time.fromisoformat(AVAILABILITY_START)
+    )
+    end = datetime.datetime.combine(day, datetime.time.fromisoformat(AVAILABILITY_END))
+    return max(0, math.ceil((end - start) / AVAILABILITY_STEP))
+
+
+def weekly_counts(engine, table, start, end, id_doctor=None, id_center=None):
+    """
+    Recomptes d'una taula (una partició actual o de l'arxiu) entre
+    start (inclòs) i end (exclòs), agrupats per doctor, centre i setmana.
+
+    Returns:
+        Files (id_doctor, id_center, setmana, cites, cancel·lades)
+    """
+    week = ((table.c.slot // SLOTS_PER_DAY + WEEK_OFFSET_DAYS) // 7).label("week")
+    cancelled = case((table.c.status == AppointmentStatusEnum.CANCELLED, 1), else_=0)
+    query = (
+        select(
+            table.c.id_doctor,
+            table.c.id_center,
+            week,
+            func.count(),
+            func.sum(cancelled),
+        )
+        .where(table.c.date >= start, table.c.date < end)
+        .group_by(table.c.id_doctor, table.c.id_center, week)
+    )
+    if id_doctor is not None:
+        query = query.where(table.c.id_doctor == id_doctor)
+    if id_center is not None:
+        query = query.where(table.c.id_center == id_center)
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def appointment_counts(date_from, date_to, id_doctor=None, id_center=None):
+    """
+    Recomptes de totes les taules amb cites del rang (les particions actuals i
+    de l'arxiu de cada shard implicat), sumats per clau.
+
+    Returns:
+        Diccionari (id_doctor, id_center, setmana) -> [cites, cancel·lades]
+    """
+    start = datetime.datetime.combine(date_from, datetime.time.min)
+    end = datetime.datetime.combine(
+        date_to + datetime.timedelta(days=1), datetime.time.min
+    )
+    last = datetime.datetime.combine(date_to, datetime.time.max)
+    tables = []
+    for shard in shards_for(id_center):
+        with shard.engine.connect() as conn:
+            partitions = active_tables_between(conn, start, last)
+            partitions += partitions_between(conn, start, last)
+        tables.extend((shard.engine, partition) for partition in partitions)
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=REPORT_QUERY_THREADS) as executor:
+        results = executor.map(
+            lambda item: weekly_counts(
+                item[0], item[1], start, end, id_doctor, id_center
+            ),
+            tables,
+        )
+        # Una setmana pot estar repartida entre dues particions, l'actual i
+        # l'arxiu o diversos shards
+        for rows in results:
+            if not counts:
+                counts = {
+                    (doctor, center, week): [total, cancelled]
+                    for doctor, center, week, total, cancelled in rows
+                }
+                continue
+            for doctor, center, week, total, cancelled in rows:
+                key = (doctor, center, week)
+                current = counts.get(key)
+                if current is None:
+                    counts[key] = [total, cancelled]
+                else:
+                    current[0] += total
+                    current[1] += cancelled
+    return counts
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def _runs(column):
+    """Trams de valors iguals d'una columna ordenada: (valor, inici, final)."""
+    runs = []
+    start = 0
+    for value, group in groupby(column):
+        end = start + sum(1 for _ in group)
+        runs.append((value, start, end))
+        start = end
+    return runs
+
+
+def _take(column, order):
+    return [column[i] for i in order]
+
+
+def _totals_by(groups, doctors, booked, cancelled):
+    """
+    Totals de les columnes per a cada valor de groups.
+
+    Returns:
+        Llista de (valor, doctors diferents, reservades, cancel·lades)
+    """
+    order = sorted(range(len(groups)), key=groups.__getitem__)
+    groups = _take(groups, order)
+    doctors = _take(doctors, order)
+    booked = _take(booked, order)
+    cancelled = _take(cancelled, order)
+    return [
+        (value, len(set(doctors[i:j])), sum(booked[i:j]), sum(cancelled[i:j]))
+        for value, i, j in _runs(groups)
+    ]
+
+
+def _summary(booked, cancelled, capacity):
+    return {
+        "booked": booked,
+        "cancelled": cancelled,
+        "capacity": capacity,
+        "utilization": _ratio(booked, capacity),
+        "cancellation_rate": _ratio(cancelled, booked + cancelled),
+    }
+
+
+def build_report(counts, date_from, date_to, doctor_names=None, center_names=None):
+    """
+    Calcula les mètriques de l'informe a partir dels recomptes.
+
+    Els recomptes es converteixen en columnes (doctor, centre, setmana,
+    reservades, cancel·lades, capacitat) ordenades per doctor, centre i
+    setmana, i les mètriques es calculen sobre columnes senceres; els totals
+    de cada doctor són trams consecutius de les columnes, i els de cada
+    centre i setmana, trams de les columnes reordenades (_totals_by).
+    """
+    doctor_names = doctor_names or {}
+    center_names = center_names or {}
+    per_day = slots_per_workday()
+    days = (date_to - date_from).days + 1
+
+    keys = sorted(counts)
+    doctors = [key[0] for key in keys]
+    centers = [key[1] for key in keys]
+    weeks = [key[2] for key in keys]
+    cancelled = [counts[key][1] for key in keys]
+    booked = list(map(sub, [counts[key][0] for key in keys], cancelled))
+    week_days = {week: days_in_week(week, date_from, date_to) for week in set(weeks)}
+    capacity = [week_days[week] * per_day for week in weeks]
+    utilization = list(map(_ratio, booked, capacity))
+
+    # Les files es retornen per columnes: una llista per camp, amb una
+    # posició per doctor, centre i setmana
+    week_labels = {week: week_start(week).isoformat() for week in week_days}
+    rows = {
+        "week": [week_labels[week] for week in weeks],
+        "id_doctor": doctors,
+        "id_center": centers,
+        "booked": booked,
+        "cancelled": cancelled,
+        "capacity": capacity,
+        "utilization": utilization,
+        "cancellation_rate": list(map(_ratio, cancelled, map(add, booked, cancelled))),
+    }
+
+    # Cada doctor té una agenda per dia, encara que treballi a diversos centres
+    by_doctor = []
+    for doctor, i, j in _runs(doctors):
+        item = {"id_doctor": doctor, "doctor_name": doctor_names.get(doctor)}
+        item["centers"] = len(set(centers[i:j]))
+        item.update(_summary(sum(booked[i:j]), sum(cancelled[i:j]), days * per_day))
+        item["peak_week_utilization"] = max(
+            (u for u in utilization[i:j] if u is not None), default=None
+        )
+        by_doctor.append(item)
+
+    # Un centre té una agenda per dia de cada doctor amb cites al centre
+    by_center = [
+        {
+            "id_center": center,
+            "center_name": center_names.get(center),
+            "doctors": n,
+            **_summary(b, c, n * days * per_day),
+        }
+        for center, n, b, c in _totals_by(centers, doctors, booked, cancelled)
+    ]
+
+    # Una setmana té una agenda per dia (del rang) de cada doctor amb cites
+    by_week = [
+        {
+            "week": week_labels[week],
+            "days": week_days[week],
+            "doctors": n,
+            **_summary(b, c, n * week_days[week] * per_day),
+        }
+        for week, n, b, c in _totals_by(weeks, doctors, booked, cancelled)
+    ]
+
+    totals = {"doctors": len(by_doctor)}
+    totals.update(
+        _summary(sum(booked), sum(cancelled), len(by_doctor) * days * per_day)
+    )
+    return {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "days": days,
+        "slots_per_day": per_day,
+        "totals": totals,
+        "weeks": by_week,
+        "doctors": by_doctor,
+        "centers": by_center,
+        "rows": rows,
+    }
+
+
+def _names(column, name_column, ids):
+    """Noms del model de lectura local dels identificadors indicats."""
+    if not ids:
+        return {}
+    db = SessionLocal()
+    try:
+        return dict(db.query(column, name_column).filter(column.in_(ids)))
+    finally:
+        db.close()
+
+
+def compute_report(date_from, date_to, id_doctor=None, id_center=None):
+    """
+    Calcula l'informe d'un rang de dies (opcionalment d'un doctor o centre).
+
+    Returns:
+        Cos JSON de l'informe
+    """
+    counts = appointment_counts(date_from, date_to, id_doctor, id_center)
+    report = build_report(
+        counts,
+        date_from,
+        date_to,
+        _names(DoctorRef.id_doctor, DoctorRef.name, {key[0] for key in counts}),
+        _names(CenterRef.id_center, CenterRef.name, {key[1] for key in counts}),
+    )
+    report["id_doctor"] = id_doctor
+    report["id_center"] = id_center
+    report["generated_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    return json.dumps(report).encode("utf-8")
+
+
+def report_versions(id_center=None):
+    """
+    Versions de les taules de l'informe: les cites actuals i arxivades de cada
+    shard implicat i els noms del model de lectura local.
+    """
+    versions = []
+    for shard in shards_for(id_center):
+        db = shard.SessionLocal()
+        try:
+            versions.append(get_versions(db, ("appointments", "appointments_archive")))
+        finally:
+            db.close()
+    db = SessionLocal()
+    try:
+        versions.append(get_versions(db, ("doctors_ref", "centers_ref")))
+    finally:
+        db.close()
+    return tuple(versions)
+
+
+class ReportWorker:
+    """Fil en segon pla que calcula els informes d'un en un."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        # (paràmetres, versions) -> Future dels informes encuats o en càlcul
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="reports", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, key):
+        """
+        Encua el càlcul d'un informe, si no s'està calculant ja.
+
+        Args:
+            key: ((date_from, date_to, id_doctor, id_center), versions de
+                report_versions)
+
+        Returns:
+            Future amb el cos JSON de l'informe
+        """
+        self._ensure_started()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = Future()
+                self._pending[key] = future
+                self._queue.put((key, future))
+        return future
+
+    def get(self, params, timeout=REPORT_WAIT):
+        """
+        Retorna l'informe desat o el calcula, esperant-lo com a màxim timeout
+        segons.
+
+        Returns:
+            Cos JSON de l'informe o None si encara s'està calculant
+
+        Raises:
+            L'error del càlcul de l'informe
+        """
+        # Les versions es llegeixen abans de calcular l'informe: si hi ha una
+        # escriptura entremig, l'informe es desa amb les versions antigues i
+        # es tornarà a calcular a la petició següent
+        key = (params, report_versions(params[3]))
+        body = report_cache.get(key)
+        if body is not None:
+            return body
+        future = self.submit(key)
+        wait([future], timeout=timeout)
+        if not future.done():
+            return None
+        return future.result()
+
+    def _run(self):
+        while True:
+            key, future = self._queue.get()
+            try:
+                body = compute_report(*key[0])
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                # L'informe es desa abans de deixar de ser pendent, perquè una
+                # petició el trobi sempre en un dels dos llocs
+                report_cache.set(key, body)
+                future.set_result(body)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+
+report_worker = ReportWorker()
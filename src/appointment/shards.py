@@ -0,0 +1,138 @@
+"""
+Repartiment opcional (sharding) de les cites per centre.
+
+SQLite només admet un escriptor per fitxer: amb un sol appointments.db les
+reserves de centres diferents, que mai no entren en conflicte entre elles,
+s'esperen les unes a les altres. Amb sharding, cada grup de centres escriu a
+la seva pròpia base de dades, amb el seu engine i la seva cua d'escriptura,
+de manera que el rendiment d'escriptura creix amb el nombre de shards.
+
+Configuració (variables d'entorn):
+    APPOINTMENT_SHARDS: shards addicionals, "nom=ruta" separats per comes
+        (ex: "nord=/app/data/appointments_nord.db,sud=/app/data/appointments_sud.db")
+    APPOINTMENT_SHARD_MAP: centre de cada shard, "id_center=nom" separats per
+        comes (ex: "1=nord,2=nord,3=sud")
+
+Els centres que no són al mapa es queden a la base de dades principal (el
+shard "default"), que és l'únic que existeix si no es configura res. Cada
+shard té l'esquema complet (inclòs el model de lectura, que se sincronitza a
+tots) i un rang d'identificadors propi: el shard número n assigna ids a partir
+de n * SHARD_ID_SPACE, de manera que els ids són únics globalment i
+indiquen a quin shard pertany cada cita. Per això, un cop hi ha cites, no es
+pot canviar l'ordre de APPOINTMENT_SHARDS ni moure un centre de shard sense
+migrar-ne les dades.
+"""
+
+import os
+import threading
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import database
+from write_queue import WriteQueue, write_queue
+
+APPOINTMENT_SHARDS = os.getenv("APPOINTMENT_SHARDS", "")
+APPOINTMENT_SHARD_MAP = os.getenv("APPOINTMENT_SHARD_MAP", "")
+# Mida del rang d'identificadors de cada shard
+SHARD_ID_SPACE = 10**12
+
+DEFAULT_SHARD = "default"
+
+
+class Shard:
+    """Una base de dades de cites amb el seu engine, sessions i cua d'escriptura."""
+
+    def __init__(self, number, name, engine, session_factory, queue):
+        self.number = number
+        self.name = name
+        self.engine = engine
+        self.SessionLocal = session_factory
+        self.write_queue = queue
+        # Primer identificador (exclòs) del rang del shard
+        self.id_base = number * SHARD_ID_SPACE
+
+    def __repr__(self):
+        return f"<Shard(number={self.number}, name='{self.name}')>"
+
+
+_shards = None
+_shard_map = {}
+_shards_lock = threading.Lock()
+
+
+def _parse_pairs(value):
+    pairs = []
+    for item in value.split(","):
+        key, sep, val = item.partition("=")
+        if sep and key.strip() and val.strip():
+            pairs.append((key.strip(), val.strip()))
+    return pairs
+
+
+def _create_shard(number, name, path):
+    engine = database.create_database_engine(
+        f"sqlite:///{path}", echo=database.engine.echo
+    )
+    session_factory = scoped_session(
+        sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    )
+    return Shard(number, name, engine, session_factory, WriteQueue(engine=engine))
+
+
+def shards():
+    """Retorna tots els shards, començant pel principal (es creen la primera vegada)."""
+    global _shards
+    with _shards_lock:
+        if _shards is None:
+            shard_list = [
+                Shard(
+                    0,
+                    DEFAULT_SHARD,
+                    database.engine,
+                    database.SessionLocal,
+                    write_queue,
+                )
+            ]
+            by_name = {DEFAULT_SHARD: shard_list[0]}
+            for name, path in _parse_pairs(APPOINTMENT_SHARDS):
+                if name in by_name:
+                    continue
+                shard = _create_shard(len(shard_list), name, path)
+                shard_list.append(shard)
+                by_name[name] = shard
+            for id_center, name in _parse_pairs(APPOINTMENT_SHARD_MAP):
+                if name in by_name and id_center.isdigit():
+                    _shard_map[int(id_center)] = by_name[name]
+            _shards = shard_list
+        return _shards
+
+
+def shard_for_center(id_center):
+    """Retorna el shard on es desen les cites d'un centre."""
+    all_shards = shards()
+    try:
+        return _shard_map.get(int(id_center), all_shards[0])
+    except (TypeError, ValueError):
+        return all_shards[0]
+
+
+def shard_for_appointment(id_appointment):
+    """Retorna el shard d'una cita a partir del rang del seu identificador."""
+    all_shards = shards()
+    number = int(id_appointment) // SHARD_ID_SPACE
+    if 0 <= number < len(all_shards):
+        return all_shards[number]
+    return all_shards[0]
+
+
+def shards_for(id_center=None):
+    """Shards que cal consultar: el del centre si s'indica, si no tots."""
+    if id_center is not None:
+        return [shard_for_center(id_center)]
+    return shards()
+
+
+def init_shards():
+    """Crea l'esquema a les bases de dades dels shards addicionals."""
+    for shard in shards()[1:]:
+        database.init_schema(shard.engine)
@@ -0,0 +1,100 @@
+"""
+Registre de consultes lentes amb el pla d'execució de SQLite.
+
+Cada sentència es cronometra amb els esdeveniments de SQLAlchemy. Les que
+superen el llindar es desen (amb els paràmetres, el pla de EXPLAIN QUERY PLAN
+i l'identificador de la petició) en un fitxer JSON Lines, que escriu un fil en
+segon pla. Substitueix echo=True, que escrivia totes les sentències a la
+sortida estàndard.
+
+Configuració (variables d'entorn):
+    SLOW_QUERY_THRESHOLD_MS: llindar en mil·lisegons (per defecte 100; negatiu
+        per desactivar el registre)
+    SLOW_QUERY_SAMPLE_RATE: proporció de consultes lentes que es desen, de 0 a
+        1 (per defecte 1)
+    SLOW_QUERY_LOG: fitxer del registre (per defecte slow_queries.jsonl al
+        directori de la base de dades)
+    SLOW_QUERY_LOG_PARAMS: 0 per no desar els paràmetres (per defecte 1)
+"""
+
+import datetime
+import os
+import random
+import time
+
+from sqlalchemy import event
+
+from tracing import current_request_id, get_sink
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "1") == "1"
+# Longitud màxima de cada paràmetre desat
+PARAM_MAX_LENGTH = 200
+
+# Sentències que admeten EXPLAIN QUERY PLAN
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def _format_params(parameters):
+    if isinstance(parameters, dict):
+        return {k: repr(v)[:PARAM_MAX_LENGTH] for k, v in parameters.items()}
+    return [repr(v)[:PARAM_MAX_LENGTH] for v in parameters or ()]
+
+
+def explain_query_plan(dbapi_connection, statement, parameters):
+    """
+    Retorna el pla de SQLite d'una sentència com a llista de línies
+    ("SEARCH appointments USING INDEX ...") o None si no se'n pot obtenir.
+    """
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+            return [row[3] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as e:
+        return [f"error: {e}"]
+
+
+def instrument_slow_queries(engine, path=None):
+    """Registra les consultes lentes d'un engine."""
+    if SLOW_QUERY_THRESHOLD_MS < 0:
+        return
+    database = engine.url.database or ""
+    path = (
+        path
+        or SLOW_QUERY_LOG
+        or os.path.join(
+            os.path.dirname(os.path.abspath(database)), "slow_queries.jsonl"
+        )
+    )
+    threshold = SLOW_QUERY_THRESHOLD_MS / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("slowlog_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["slowlog_start"].pop()
+        if elapsed < threshold or random.random() >= SLOW_QUERY_SAMPLE_RATE:
+            return
+        # En un executemany, el pla es calcula amb el primer joc de paràmetres
+        params = parameters[0] if many and parameters else parameters
+        record = {
+            "time": datetime.datetime.now().isoformat(),
+            "database": os.path.basename(database),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "executemany": many,
+            "request_id": current_request_id(),
+            "plan": explain_query_plan(cursor.connection, statement, params),
+        }
+        if SLOW_QUERY_LOG_PARAMS:
+            record["parameters"] = _format_params(params)
+        get_sink(path).write(record)
@@ -0,0 +1,190 @@
+"""
+Sincronització en segon pla del model de lectura local (pacients, doctors i
+centres) a partir del feed de canvis del servei admin.
+
+Els errors es desen com a trams "sync" al fitxer de traçat (TRACE_FILE) i es
+compten a les mètriques, juntament amb el moment de l'última sincronització
+correcta de cada shard.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import admin_client
+from database import SessionLocal
+from metrics import Counter, Gauge, registry
+from models import CenterRef, DoctorRef, PatientRef, SyncState
+from shards import shards
+from tracing import get_sink
+
+# Interval en segons entre consultes al feed de canvis
+SYNC_INTERVAL = float(os.getenv("ADMIN_SYNC_INTERVAL", "5"))
+SYNC_ENABLED = os.getenv("ADMIN_SYNC_ENABLED", "1") == "1"
+SYNC_PAGE_SIZE = int(os.getenv("ADMIN_SYNC_PAGE_SIZE", "500"))
+
+SYNC_STATE_NAME = "admin_changes"
+
+# Una sincronització aturada es detecta perquè sync_last_success_timestamp
+# deixa d'avançar (i sync_errors_total creix)
+sync_errors = registry.register(
+    Counter(
+        "sync_errors_total",
+        "Errors en sincronitzar el model de lectura amb el servei admin",
+        ("shard",),
+    )
+)
+sync_changes = registry.register(
+    Counter(
+        "sync_changes_total",
+        "Canvis del servei admin aplicats al model de lectura",
+        ("shard",),
+    )
+)
+sync_last_success = registry.register(
+    Gauge(
+        "sync_last_success_timestamp_seconds",
+        "Moment de l'última sincronització correcta del model de lectura",
+        ("shard",),
+    )
+)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _to_ref(entity, entity_id, data):
+    """Converteix les dades d'un canvi en l'objecte del model de lectura."""
+    if entity == "patient":
+        return PatientRef(
+            id_patient=entity_id, name=data["name"], status=data.get("status")
+        )
+    if entity == "doctor":
+        return DoctorRef(
+            id_doctor=entity_id, name=data["name"], specialty=data.get("specialty")
+        )
+    if entity == "center":
+        return CenterRef(
+            id_center=entity_id, name=data["name"], address=data.get("address")
+        )
+    return None
+
+
+REF_MODELS = {"patient": PatientRef, "doctor": DoctorRef, "center": CenterRef}
+
+
+def apply_change(db, change):
+    """Aplica un canvi del feed (INSERT, UPDATE o DELETE) al model de lectura."""
+    entity = change["entity"]
+    model = REF_MODELS.get(entity)
+    if model is None:
+        return
+    if change["op"] == "DELETE":
+        ref = db.get(model, change["id"])
+        if ref is not None:
+            db.delete(ref)
+    else:
+        db.merge(_to_ref(entity, change["id"], change["data"]))
+    # Una mateixa pàgina pot contenir diversos canvis de la mateixa entitat
+    db.flush()
+
+
+def sync_once(session_factory=SessionLocal):
+    """
+    Llegeix totes les pàgines pendents del feed de canvis i les aplica.
+
+    Cada pàgina s'aplica i es confirma juntament amb la nova posició del feed,
+    de manera que una interrupció no perd ni duplica canvis. Cada shard té la
+    seva còpia del model de lectura i la seva posició al feed.
+
+    Args:
+        session_factory: Sessions de la base de dades a sincronitzar
+
+    Returns:
+        Nombre de canvis aplicats
+    """
+    applied = 0
+    db = session_factory()
+    try:
+        state = db.get(SyncState, SYNC_STATE_NAME)
+        if state is None:
+            state = SyncState(name=SYNC_STATE_NAME, last_seq=0)
+            db.add(state)
+        while True:
+            resp = admin_client.get(
+                "/admin/canvis",
+                admin_client.service_auth_header(),
+                params={"since": state.last_seq, "limit": SYNC_PAGE_SIZE},
+            )
+            resp.raise_for_status()
+            page = resp.json()
+            for change in page["changes"]:
+                apply_change(db, change)
+            state.last_seq = page["next_since"]
+            db.commit()
+            applied += len(page["changes"])
+            if not page["has_more"]:
+                return applied
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _record_error(trace_file, shard, start, duration, error):
+    """
+    Desa un error de sincronització com a tram "sync" al fitxer de traçat
+    (TRACE_FILE), o l'escriu a la sortida estàndard si no n'hi ha.
+    """
+    if not trace_file:
+        print(f"Error en sincronitzar les dades del servei admin ({shard}): {error}")
+        return
+    get_sink(trace_file).write(
+        {
+            "service": "appointment",
+            "request_id": None,
+            "span": "sync",
+            "start": datetime.datetime.fromtimestamp(start).isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "shard": shard,
+            "error": f"{type(error).__name__}: {error}",
+        }
+    )
+
+
+def _run(trace_file):
+    while True:
+        for shard in shards():
+            start = time.time()
+            t0 = time.perf_counter()
+            try:
+                applied = sync_once(shard.SessionLocal)
+            except Exception as e:
+                sync_errors.inc(shard=shard.name)
+                _record_error(
+                    trace_file, shard.name, start, time.perf_counter() - t0, e
+                )
+            else:
+                sync_changes.inc(applied, shard=shard.name)
+                sync_last_success.set(time.time(), shard=shard.name)
+        time.sleep(SYNC_INTERVAL)
+
+
+def start_sync_worker(trace_file=None):
+    """
+    Inicia (una sola vegada per procés) el fil de sincronització en segon pla.
+
+    Args:
+        trace_file: Fitxer de traçat on es desen els errors (TRACE_FILE)
+    """
+    global _worker
+    if not SYNC_ENABLED:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(
+                target=_run, args=(trace_file,), name="admin-sync", daemon=True
+            )
+            _worker.start()
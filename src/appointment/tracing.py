@@ -0,0 +1,172 @@
+"""
+Traçat de peticions amb identificadors de correlació (X-Request-ID).
+
+Cada petició rep l'identificador de la capçalera X-Request-ID (si el client o
+un altre servei l'envia) o un de nou, que es retorna a la resposta i es
+reenvia a les crides al servei admin. Amb span() es mesura el temps de cada
+fase d'una petició; els trams es desen, juntament amb el de la petició
+sencera, en un fitxer JSON Lines (un objecte per línia) per analitzar-los
+fora de línia.
+
+Configuració (variables d'entorn o app.config):
+    TRACE_FILE: fitxer on es desen els trams (buit: no se'n desa cap)
+    TRACE_QUEUE_SIZE: trams pendents d'escriure com a màxim (per defecte 10000)
+"""
+
+import datetime
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Identificadors acceptats dels clients (la resta se substitueixen)
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+
+class JsonLinesSink:
+    """
+    Fitxer JSON Lines escrit per un fil en segon pla.
+
+    write() no bloqueja mai la petició: si la cua és plena, el registre es
+    descarta i es compta a dropped.
+    """
+
+    def __init__(self, path, maxsize=TRACE_QUEUE_SIZE):
+        self.path = path
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="jsonl-sink", daemon=True
+                )
+                self._thread.start()
+
+    def write(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # Escriu d'una vegada tots els registres que ja són a la cua
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, default=str) + "\n")
+                self.written += len(records)
+            except OSError as e:
+                self.dropped += len(records)
+                print(f"Error en escriure a {self.path}: {e}")
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(path):
+    """Retorna el sink d'un fitxer (un per fitxer i procés)."""
+    with _sinks_lock:
+        sink = _sinks.get(path)
+        if sink is None:
+            sink = _sinks[path] = JsonLinesSink(path)
+        return sink
+
+
+def current_request_id():
+    """Identificador de la petició en curs o None fora d'una petició."""
+    if has_request_context():
+        return g.get("request_id")
+    return None
+
+
+def _record(name, start, duration, attrs):
+    record = {
+        "service": current_app.config["TRACE_SERVICE"],
+        "request_id": g.get("request_id"),
+        "span": name,
+        "start": datetime.datetime.fromtimestamp(start).isoformat(),
+        "duration_ms": round(duration * 1000, 3),
+    }
+    record.update(attrs)
+    get_sink(current_app.config["TRACE_FILE"]).write(record)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Mesura el temps d'un bloc de codi dins d'una petició i el desa com a tram.
+
+    Fora d'una petició, o si no hi ha TRACE_FILE, no fa res.
+    """
+    if not has_request_context() or not current_app.config.get("TRACE_FILE"):
+        yield
+        return
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, start, time.perf_counter() - t0, attrs)
+
+
+def _before_request():
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.trace_start = time.time()
+    g.trace_t0 = time.perf_counter()
+
+
+def _after_request(response):
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    g.trace_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    if "trace_t0" not in g or not current_app.config.get("TRACE_FILE"):
+        return
+    _record(
+        "request",
+        g.trace_start,
+        time.perf_counter() - g.trace_t0,
+        {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": g.get("trace_status", 500),
+        },
+    )
+
+
+def init_tracing(app, service):
+    """Assigna un X-Request-ID a cada petició i desa els trams si hi ha TRACE_FILE."""
+    app.config.setdefault("TRACE_FILE", os.getenv("TRACE_FILE", ""))
+    app.config["TRACE_SERVICE"] = service
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
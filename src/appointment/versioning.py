@@ -0,0 +1,159 @@
+"""
+Versions per taula i suport d'ETag / peticions GET condicionals.
+
+Cada taula versionada té un comptador a table_versions que uns triggers
+incrementen a cada INSERT, UPDATE o DELETE. L'ETag d'una resposta es calcula
+a partir d'aquests comptadors, de manera que una petició amb If-None-Match
+es pot respondre amb 304 sense executar la consulta ni serialitzar res.
+"""
+
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request
+from sqlalchemy import text
+
+import shards
+from models import TableVersion
+
+
+def create_version_triggers(conn, table, counter=None):
+    """
+    Crea el comptador i els triggers que l'incrementen a cada escriptura de
+    table. Per defecte el comptador té el nom de la taula; diverses taules
+    (ex: particions) poden compartir un mateix comptador.
+    """
+    counter = counter or table
+    conn.execute(
+        text(
+            "INSERT OR IGNORE INTO table_versions (table_name, version) "
+            "VALUES (:table, 0)"
+        ),
+        {"table": counter},
+    )
+    for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+        conn.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} "
+                f"AFTER {event} ON {table} BEGIN "
+                f"UPDATE table_versions SET version = version + 1 "
+                f"WHERE table_name = '{counter}'; END"
+            )
+        )
+
+
+def create_key_version_triggers(conn, table, key):
+    """
+    Crea els triggers que mantenen a table_versions un comptador per clau de
+    les files de table (ex: per doctor i centre), de manera que una
+    escriptura només fa caducar les dades que depenen de la seva clau.
+
+    key és l'expressió SQL del nom del comptador, amb {row} en lloc de NEW o
+    OLD. Els comptadors es creen a la primera escriptura de cada clau, i una
+    actualització que canvia la clau incrementa el de l'antiga i el de la
+    nova.
+    """
+    new, old = key.format(row="NEW"), key.format(row="OLD")
+
+    def bump(name, condition="1"):
+        return (
+            "INSERT INTO table_versions (table_name, version) "
+            f"SELECT {name}, 1 WHERE {condition} "
+            "ON CONFLICT (table_name) DO UPDATE SET version = version + 1;"
+        )
+
+    for suffix, event, body in (
+        ("ai", "INSERT", bump(new)),
+        ("au", "UPDATE", bump(new) + " " + bump(old, f"{old} != {new}")),
+        ("ad", "DELETE", bump(old)),
+    ):
+        conn.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_key_version_{suffix} "
+                f"AFTER {event} ON {table} BEGIN {body} END"
+            )
+        )
+
+
+def init_table_versions(engine, tables):
+    """Crea els comptadors i els triggers que els incrementen a cada escriptura."""
+    with engine.begin() as conn:
+        for table in tables:
+            create_version_triggers(conn, table)
+
+
+def get_versions(db, tables):
+    """Retorna les versions actuals de les taules indicades, en el mateix ordre."""
+    rows = dict(
+        db.query(TableVersion.table_name, TableVersion.version).filter(
+            TableVersion.table_name.in_(tables)
+        )
+    )
+    return tuple(rows.get(t, 0) for t in tables)
+
+
+def compute_etag(versions, role):
+    """
+    Calcula l'ETag a partir de les versions, la URL amb els paràmetres de
+    consulta i el rol de l'usuari (alguns llistats depenen del rol).
+    """
+    key = f"{versions}|{request.full_path}|{role}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _cache_control(response, max_age):
+    if max_age:
+        response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        # El client pot desar la resposta però l'ha de revalidar sempre
+        response.headers["Cache-Control"] = "private, no-cache"
+
+
+def conditional_get(*tables, max_age=0):
+    """
+    Decorador que afegeix ETag i Cache-Control a un endpoint GET i respon
+    304 Not Modified quan l'ETag de If-None-Match encara és vàlid.
+
+    S'ha d'aplicar després de require_auth_role, que deixa el payload del
+    token a request.user. Les versions llegides queden a g.table_versions
+    perquè l'endpoint les pugui fer servir (ex: a la clau de la memòria cau).
+
+    Args:
+        *tables: Taules de les quals depèn la resposta
+        max_age: Segons que el client pot reutilitzar la resposta sense
+            revalidar-la (0 per revalidar sempre)
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Les versions es llegeixen abans de la consulta: si hi ha una
+            # escriptura entremig, l'ETag serà antic i es tornarà a validar.
+            # Amb sharding, la resposta depèn de les versions de tots els shards
+            versions = []
+            for shard in shards.shards():
+                db = shard.SessionLocal()
+                try:
+                    versions.append(get_versions(db, tables))
+                finally:
+                    db.close()
+            versions = g.table_versions = tuple(versions)
+
+            role = getattr(request, "user", {}).get("role")
+            etag = compute_etag(versions, role)
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+                response.set_etag(etag, weak=True)
+                _cache_control(response, max_age)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                _cache_control(response, max_age)
+            return response
+
+        return decorated_function
+
+    return decorator
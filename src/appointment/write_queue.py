@@ -0,0 +1,147 @@
+"""
+Cua d'escriptura amb confirmació agrupada (group commit).
+
+Les peticions concurrents no escriuen directament a SQLite: encuen una
+operació i esperen el resultat. Un únic fil escriptor agafa les operacions
+pendents, les executa dins d'una sola transacció (cadascuna amb el seu
+SAVEPOINT, perquè un error només desfaci la seva operació) i fa un sol
+COMMIT per lot. Així el cost del fsync es reparteix entre totes les
+operacions del lot i no hi ha competència pel bloqueig d'escriptura.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import database
+from querybudget import add_queries, counting_into, request_counter
+
+# Nombre màxim d'operacions per lot i temps màxim d'espera per omplir-lo
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "32"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY_MS", "5")) / 1000
+# Temps màxim que una petició espera el resultat de la seva operació
+WRITE_TIMEOUT = float(os.getenv("WRITE_TIMEOUT", "30"))
+
+
+class WriteQueue:
+    """Cua d'operacions d'escriptura consumida per un únic fil escriptor."""
+
+    def __init__(
+        self, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY, engine=None
+    ):
+        # Base de dades on escriu la cua (per defecte, la principal)
+        self.engine = engine
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="write-queue", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, op, timeout=WRITE_TIMEOUT):
+        """
+        Encua una operació i espera que el seu lot es confirmi.
+
+        Args:
+            op: Funció que rep una connexió SQLAlchemy (dins d'una transacció)
+                i retorna el resultat de l'operació
+            timeout: Segons màxims d'espera
+
+        Returns:
+            El valor retornat per op, un cop confirmat a la base de dades
+
+        Raises:
+            L'excepció que hagi llançat op, o l'error del COMMIT del lot.
+            TimeoutError si op no s'ha començat a executar abans de timeout;
+            en aquest cas es descarta i no s'executarà
+        """
+        self._ensure_started()
+        future = Future()
+        # Les consultes de op compten per al pressupost de la petició
+        counter = request_counter()
+        self._queue.put((op, future, counter))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Si l'escriptor encara no l'ha agafat, l'operació es cancel·la i
+            # no s'executarà. Si ja s'està executant, s'espera el resultat del
+            # lot: el client no ha de rebre un error d'una escriptura que
+            # acabarà confirmada
+            if future.cancel():
+                raise
+            return future.result()
+        finally:
+            add_queries(counter)
+
+    def _next_batch(self):
+        """Espera la primera operació i hi afegeix les que arribin a temps."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._execute(batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _execute(self, batch):
+        """Executa un lot dins d'una transacció i un sol COMMIT."""
+        results = []
+        # Les transaccions es controlen manualment: el mòdul sqlite3 no gestiona
+        # correctament els SAVEPOINT amb el seu mode transaccional implícit
+        engine = self.engine or database.engine
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                for op, future, counter in batch:
+                    # Les operacions cancel·lades per temps d'espera no s'executen
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.exec_driver_sql("SAVEPOINT write_op")
+                    try:
+                        with counting_into(counter):
+                            result = op(conn)
+                        results.append((future, result, None))
+                        conn.exec_driver_sql("RELEASE write_op")
+                    except Exception as e:
+                        conn.exec_driver_sql("ROLLBACK TO write_op")
+                        conn.exec_driver_sql("RELEASE write_op")
+                        results.append((future, None, e))
+                conn.exec_driver_sql("COMMIT")
+            except Exception:
+                # SQLite desfà tota sola la transacció amb alguns errors (ex:
+                # disc ple): un ROLLBACK sense transacció amagaria l'error
+                if conn.connection.dbapi_connection.in_transaction:
+                    conn.exec_driver_sql("ROLLBACK")
+                raise
+        # Els resultats només es publiquen quan el lot ja és a disc
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+write_queue = WriteQueue()
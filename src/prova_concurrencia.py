@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Prova d'estrès de reserves concurrents: llança moltes peticions simultànies
+de cites per al mateix doctor i centre dins d'una mateixa finestra de 30
+minuts i comprova que el servei de cites només n'accepta una.
+
+Requereix els serveis en execució i les dades inicials carregades
+(carga_inicial.py). Retorna el codi de sortida 1 si detecta una doble reserva.
+appointment/comprova_reserves.py fa la mateixa comprovació sense els serveis,
+contra una base de dades temporal.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import sys
+
+import requests
+
+# Configuració
+AUTH_SERVICE_URL = "http://localhost:5002"
+ADMIN_LOGIN_ENDPOINT = f"{AUTH_SERVICE_URL}/auth/login"
+APPOINTMENT_SERVICE_URL = "http://localhost:5001"
+APPOINTMENT_ENDPOINT = f"{APPOINTMENT_SERVICE_URL}/cites/"
+
+# Credencials de l'administrador per defecte (per obtenir el token)
+DEFAULT_ADMIN_USERNAME = "admin"
+DEFAULT_ADMIN_PASSWORD = "admin123"
+
+# Paràmetres de la prova
+ID_PATIENT = 1
+ID_DOCTOR = 1
+ID_CENTER = 1
+PARALLEL_REQUESTS = 64
+ROUNDS = 5
+
+
+def get_admin_token():
+    """Obté el token d'autenticació de l'administrador per defecte."""
+    try:
+        response = requests.post(
+            ADMIN_LOGIN_ENDPOINT,
+            json={
+                "username": DEFAULT_ADMIN_USERNAME,
+                "password": DEFAULT_ADMIN_PASSWORD,
+            },
+            timeout=5,
+        )
+        if response.status_code == 200:
+            return response.json().get("access_token")
+        print(f"Error en obtenir el token: {response.status_code} - {response.text}")
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"Error de connexió: {e}")
+        return None
+
+
+def book(token, date):
+    """Intenta reservar una cita i retorna el codi d'estat HTTP (0 si falla)."""
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {
+        "date": date.isoformat(),
+        "reason": "Prova de concurrència",
+        "id_patient": ID_PATIENT,
+        "id_doctor": ID_DOCTOR,
+        "id_center": ID_CENTER,
+    }
+    try:
+        response = requests.post(
+            APPOINTMENT_ENDPOINT, json=payload, headers=headers, timeout=60
+        )
+        return response.status_code
+    except requests.exceptions.RequestException:
+        return 0
+
+
+def run_round(token, base_date):
+    """
+    Llança PARALLEL_REQUESTS reserves simultànies repartides dins dels 30
+    minuts posteriors a base_date. Totes es solapen entre elles, de manera
+    que n'hi ha d'haver exactament una de creada.
+
+    Returns:
+        Diccionari codi d'estat -> nombre de respostes
+    """
+    dates = [
+        base_date + datetime.timedelta(minutes=(i * 29) // PARALLEL_REQUESTS)
+        for i in range(PARALLEL_REQUESTS)
+    ]
+    with ThreadPoolExecutor(max_workers=PARALLEL_REQUESTS) as executor:
+        statuses = list(executor.map(lambda d: book(token, d), dates))
+
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def main():
+    """Funció principal."""
+
+    token = get_admin_token()
+    if not token:
+        print("\nNo s'ha pogut obtenir el token de l'administrador per defecte.")
+        sys.exit(1)
+
+    # Cada execució utilitza franges futures noves per no topar amb cites
+    # creades en execucions anteriors
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    start = now + datetime.timedelta(days=365)
+
+    failed = False
+    for round_number in range(ROUNDS):
+        base_date = start + datetime.timedelta(hours=2 * round_number)
+        counts = run_round(token, base_date)
+        created = counts.get(201, 0)
+        print(f"[{round_number + 1}] {base_date.isoformat()}: {counts}")
+        if created != 1:
+            print(f"Error: s'han creat {created} cites en lloc d'una.")
+            failed = True
+
+    print("\n" + "-" * 50)
+    if failed:
+        print(" RESULTAT: S'HAN DETECTAT DOBLES RESERVES O ERRORS")
+    else:
+        print(" RESULTAT: CAP DOBLE RESERVA")
+    print("-" * 50)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()